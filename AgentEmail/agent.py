@@ -1,117 +1,124 @@
-from google.adk.agents import Agent
-from google.adk.runners import Runner
-from google.adk.sessions import InMemorySessionService
-from google.genai import types
-from google.adk.models.llm_request import LlmRequest
-from google.adk.models.llm_response import LlmResponse
-from google.adk.tools.base_tool import BaseTool
-from google.adk.tools.tool_context import ToolContext
-from typing import Optional, Dict, Any
-from google.adk.tools import google_search
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import numpy as np
-import pickle
-
-
-import imaplib
-import email
-from email.header import decode_header
+from email.utils import formataddr
 from dotenv import load_dotenv
 import os
-import json
+import sys
+import threading
+
+# The IMAP helpers live in the mail_agent package.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../EmailPreviewBrowser"))
+from mail_agent.mailbox import MailCache, MailboxSync
+from mail_agent.metrics import span
+
+
+load_dotenv()
+
+
+def mail_pool():
+    """The shared IMAP connection pool of the configured mailbox."""
+    from mail_agent.imap import get_pool
+
+    return get_pool(
+        os.getenv("IMAP_HOST", "imap.gmail.com"),
+        os.getenv("EMAIL"),
+        os.getenv("PASSWORD"),
+        port=int(os.getenv("IMAP_PORT", "0")) or None,
+        ssl=os.getenv("IMAP_SSL", "1") != "0",
+        keepalive=float(os.getenv("IMAP_KEEPALIVE_SECONDS", "300")),
+    )
+
+
+# Local copy of the mailbox; get_latest_emails only syncs what changed since the last call.
+mail_cache = MailCache(os.getenv(
+    "MAIL_CACHE_DB", os.path.join(os.path.dirname(__file__), "../EmailPreviewBrowser/server/mail_cache.db")
+))
+mailbox_sync = MailboxSync(mail_cache, user_id=int(os.getenv("MAIL_USER_ID", "1")))
+mail_sync_interval = float(os.getenv("MAIL_SYNC_INTERVAL_SECONDS", "30"))
 
 
 def get_latest_emails(n: int = 5) -> str:
     """Returns the last n received emails starting with 'Re:' or 'R:' in the subject."""
+    with span("tool_run", tool="get_latest_emails"):
+        mailbox_sync.refresh(mail_pool(), "INBOX", max_age=mail_sync_interval)
 
-    load_dotenv()
+        result = []
+        for msg in mail_cache.latest_replies(mailbox_sync.user_id, n):
+            sender = formataddr((msg["sender"], msg["sender_email"]))
+            result.append(f"From: {sender}\nSubject: {msg['subject']}\nThread: {msg['thread_id']}")
 
-    mail = imaplib.IMAP4_SSL("imap.gmail.com")
-    mail.login(os.getenv("EMAIL"), os.getenv("PASSWORD"))
-    mail.select("inbox")
+    return "\n\n".join(result)
 
-    _, data = mail.search(None, 'OR SUBJECT "Re:" SUBJECT "R:"')
-    ids = data[0].split()[-n:]
 
-    def clean_subject(subject_raw):
-        subject, encoding = decode_header(subject_raw)[0]
-        if isinstance(subject, bytes):
-            return subject.decode(encoding or "utf-8")
-        return subject
+def get_email_thread(thread_id: str) -> str:
+    """
+    Returns the whole conversation an email belongs to, oldest message first.
 
-    result = []
-    for eid in ids:
-        res, msg_data = mail.fetch(eid, "(RFC822)")
-        msg = email.message_from_bytes(msg_data[0][1])
-        subject = clean_subject(msg["Subject"])
-        sender = msg["From"]
-        result.append(f"From: {sender}\nSubject: {subject}")
+    Args:
+        thread_id: The 'Thread' value shown with each email by get_latest_emails.
+    """
+    with span("tool_run", tool="get_email_thread"):
+        mailbox_sync.refresh(mail_pool(), "INBOX", max_age=mail_sync_interval)
+
+        result = []
+        for msg in mail_cache.thread(mailbox_sync.user_id, thread_id):
+            sender = formataddr((msg["sender"], msg["sender_email"]))
+            result.append(f"From: {sender}\nDate: {msg['timestamp']}\nSubject: {msg['subject']}\n\n{msg['body'][:2000]}")
+
+    return "\n\n---\n\n".join(result)
 
-    return "\n\n".join(result)
 
 
+class _MailUser:
+    # The part of the ADK's ToolContext mail_agent's DocumentSearchTool reads.
+    user_id = mailbox_sync.user_id
 
-#database_path = os.path.join(os.path.dirname(__file__), "AInstein/EmailPreviewBrowser/server/storage.ts")
-database_vectors_path = os.path.join(os.path.dirname(__file__), "AInstein/EmailPreviewBrowser/server/tfidf_vectors.json")
-json_file = os.path.join(os.path.dirname(__file__),"AInstein/EmailPreviewBrowser/server/documents.json")
 
 def DocumentSearchTool(query: list[str]):
     """
-    Compare query to precomputed TF-IDF vectors of database entries.
+    Search the user's documents for the queries, by TF-IDF similarity of
+    their content.
 
     Args:
-        vectorizer: A fitted TfidfVectorizer.
-        database_vectors: TF-IDF matrix of the database (already transformed).
-        query: The input query string.
-        database: List of original database entries.
+        query: One or more query strings, e.g. the email subject, its body and
+            each topic it mentions.
 
     Returns:
-        List of tuples (entry, similarity_score), sorted by similarity.
+        One {"query": query, "results": [(entry, similarity_score), ...]}
+        per query, in the order given, with the results sorted by similarity.
     """
-   
-    # Load the database entries
-    try:
-        with open(json_file, 'r') as f:
-            documents = json.load(f)
-    except FileNotFoundError:
-        print(f"Error: File not found at {json_file}")
-        return
-    except json.JSONDecodeError:
-        print(f"Error: Could not decode JSON from {json_file}")
-        return 
-
-    # Load the database vectors (NumPy array or sparse matrix)
-    database_vectors = np.load(database_vectors_path, allow_pickle=True)
-
-    # Vectorize the query using the same fitted vectorizer
-    vectorizer = TfidfVectorizer(max_df=0.8, min_df=5, stop_words='english')
-    query_vector = vectorizer.transform([query])
-
-    # Compute cosine similarity between the query and database vectors
-    similarities = cosine_similarity(query_vector, database_vectors).flatten()
-
-    # Sort by similarity score (highest first)
-    similar_indices = similarities.argsort()[::-1][:6]
-
-    # Return entries with their corresponding similarity score
-    return [(json_file[i], similarities[i]) for i in similar_indices]
-
-
-
-
-
-# Root agent for orchestration
-root_agent = Agent(
-    name="email_root_agent_v2",
-    model="gemini-2.0-flash-001",  
-    description="Main email assistant agent: interacts politely with the user, delegates to other agents when necessary, and manages document retrieval and integration.",
-    instruction=(
-        """ Always be polite and clear in your answers. When you receive an email classify it using zero, one or more of these labels: (important), (work), (family), (deadline), (meeting). And return the output of the classification."
-          if it indicates a need for documentation or if the response seems incomplete, use the 'find_related_documents' tool or the google_search tool to search for relevant documents based on the initial response's content or the user's request, and return these documents. Always specify from which tool you get info"
-          When you receive an email answer to the best of your capabilities"# and if there are some documents use these to enrich the answer """
-    ),
-    tools=[DocumentSearchTool],
-    #sub_agents=[],
-    output_key="email_assistant_output",
-)
\ No newline at end of file
+    # The persistent per-user index of mail_agent; imported on first search,
+    # as loading it imports scikit-learn.
+    from mail_agent.agent import DocumentSearchTool as search_documents
+
+    return search_documents(query, _MailUser())
+
+
+def build_root_agent():
+    """Root agent for orchestration."""
+    from google.adk.agents import Agent
+
+    return Agent(
+        name="email_root_agent_v2",
+        model="gemini-2.0-flash-001",  
+        description="Main email assistant agent: interacts politely with the user, delegates to other agents when necessary, and manages document retrieval and integration.",
+        instruction=(
+            """ Always be polite and clear in your answers. When you receive an email classify it using zero, one or more of these labels: (important), (work), (family), (deadline), (meeting). And return the output of the classification."
+              if it indicates a need for documentation or if the response seems incomplete, use the 'find_related_documents' tool or the google_search tool to search for relevant documents based on the initial response's content or the user's request, and return these documents. Always specify from which tool you get info"
+              When you receive an email answer to the best of your capabilities"# and if there are some documents use these to enrich the answer """
+        ),
+        tools=[DocumentSearchTool, get_email_thread],
+        #sub_agents=[],
+        output_key="email_assistant_output",
+    )
+
+
+_root_agent_lock = threading.Lock()
+
+
+def __getattr__(name):
+    # Built on first access, so importing this module doesn't load the ADK.
+    if name == "root_agent":
+        with _root_agent_lock:
+            if "root_agent" not in globals():
+                globals()["root_agent"] = build_root_agent()
+        return globals()["root_agent"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
@@ -1 +1,13 @@
-from . import agent
+import importlib
+
+# Submodules are imported on first access, so importing the package, or one of
+# its light modules such as imap or mailbox, doesn't load the agent's
+# dependencies (the ADK, scikit-learn, SciPy).
+SUBMODULES = ("agent", "hybrid", "imap", "index", "logs", "mailbox", "metrics", "mime", "passages", "retrieval",
+              "shards", "sources", "threads", "vectorize")
+
+
+def __getattr__(name):
+    if name in SUBMODULES:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
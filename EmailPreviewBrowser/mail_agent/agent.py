@@ -1,124 +1,248 @@
-from google.adk.agents import Agent
-from google.adk.runners import Runner
-from google.adk.sessions import InMemorySessionService
-from google.genai import types
-from google.adk.models.llm_request import LlmRequest
-from google.adk.models.llm_response import LlmResponse
-from google.adk.tools.base_tool import BaseTool
-from google.adk.tools.tool_context import ToolContext
-from typing import Optional, Dict, Any
-from google.adk.tools import google_search
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import numpy as np
 import json
+import logging
+import os
+import threading
+from email.utils import formataddr
+from typing import TYPE_CHECKING, Optional
 
-
-import imaplib
-import email
-from email.header import decode_header
 from dotenv import load_dotenv
-import os
+
+from .mailbox import MailCache, MailboxSync
+from .metrics import span
+from .sources import open_source
+
+# The ADK, scikit-learn and SciPy take seconds to import, so they are only
+# imported by the code that needs them: root_agent is built on first access,
+# and the document indexes are loaded the first time a user searches.
+if TYPE_CHECKING:
+    from google.adk.tools.tool_context import ToolContext
+    from .shards import ShardedIndexStore
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+def mail_pool():
+    """The shared IMAP connection pool of the configured mailbox."""
+    from .imap import get_pool
+
+    return get_pool(
+        os.getenv("IMAP_HOST", "imap.gmail.com"),
+        os.getenv("EMAIL"),
+        os.getenv("PASSWORD"),
+        port=int(os.getenv("IMAP_PORT", "0")) or None,
+        ssl=os.getenv("IMAP_SSL", "1") != "0",
+        keepalive=float(os.getenv("IMAP_KEEPALIVE_SECONDS", "300")),
+    )
+
+
+# Local copy of the mailbox; get_latest_emails only syncs what changed since the last call.
+mail_cache = MailCache(os.getenv("MAIL_CACHE_DB", os.path.join(os.path.dirname(__file__), "../server/mail_cache.db")))
+mailbox_sync = MailboxSync(mail_cache, user_id=int(os.getenv("MAIL_USER_ID", "1")))
+mail_sync_interval = float(os.getenv("MAIL_SYNC_INTERVAL_SECONDS", "30"))
 
 
 def get_latest_emails(n: int = 5) -> str:
     """Returns the last n received emails starting with 'Re:' or 'R:' in the subject."""
+    with span("tool_run", tool="get_latest_emails"):
+        mailbox_sync.refresh(mail_pool(), "INBOX", max_age=mail_sync_interval)
 
-    load_dotenv()
+        result = []
+        for msg in mail_cache.latest_replies(mailbox_sync.user_id, n):
+            sender = formataddr((msg["sender"], msg["sender_email"]))
+            result.append(f"From: {sender}\nSubject: {msg['subject']}\nThread: {msg['thread_id']}")
 
-    mail = imaplib.IMAP4_SSL("imap.gmail.com")
-    mail.login(os.getenv("EMAIL"), os.getenv("PASSWORD"))
-    mail.select("inbox")
+    return "\n\n".join(result)
 
-    _, data = mail.search(None, 'OR SUBJECT "Re:" SUBJECT "R:"')
-    ids = data[0].split()[-n:]
 
-    def clean_subject(subject_raw):
-        subject, encoding = decode_header(subject_raw)[0]
-        if isinstance(subject, bytes):
-            return subject.decode(encoding or "utf-8")
-        return subject
+def get_email_thread(thread_id: str) -> str:
+    """
+    Returns the whole conversation an email belongs to, oldest message first.
 
-    result = []
-    for eid in ids:
-        res, msg_data = mail.fetch(eid, "(RFC822)")
-        msg = email.message_from_bytes(msg_data[0][1])
-        subject = clean_subject(msg["Subject"])
-        sender = msg["From"]
-        result.append(f"From: {sender}\nSubject: {subject}")
+    Args:
+        thread_id: The 'Thread' value shown with each email by get_latest_emails.
+    """
+    with span("tool_run", tool="get_email_thread"):
+        mailbox_sync.refresh(mail_pool(), "INBOX", max_age=mail_sync_interval)
 
-    return "\n\n".join(result)
+        result = []
+        for msg in mail_cache.thread(mailbox_sync.user_id, thread_id):
+            sender = formataddr((msg["sender"], msg["sender_email"]))
+            result.append(f"From: {sender}\nDate: {msg['timestamp']}\nSubject: {msg['subject']}\n\n{msg['body'][:2000]}")
 
+    return "\n\n---\n\n".join(result)
 
 
-database_vectors_path = os.path.join(os.path.dirname(__file__), "../server/tfidf_vectors.json")
+
+index_dir = os.path.join(os.path.dirname(__file__), "../server/tfidf_index")
 json_file = os.path.join(os.path.dirname(__file__),"../server/documents.json")
+# documents.json, or a SQLite database with a `documents` table (see sources.py).
+document_source = open_source(os.getenv("DOCUMENT_SOURCE", json_file))
+
+# "exact" scores every document; "ivf" only scans the clusters closest to the query.
+search_scorer_name = os.getenv("DOCUMENT_SEARCH_SCORER", "exact")
+search_top_k = int(os.getenv("DOCUMENT_SEARCH_TOP_K", "6"))
+search_min_score = float(os.getenv("DOCUMENT_SEARCH_MIN_SCORE", "0.0"))
+# Hybrid scores are reciprocal rank fusion scores, at most about 0.033 (see
+# HybridIndex.search), so hybrid mode has its own threshold on that scale:
+# 0.01 keeps documents in the top 40 of either side, or found by both.
+hybrid_min_score = float(os.getenv("DOCUMENT_HYBRID_MIN_SCORE", "0.01"))
+# Documents less similar than this to the query, by embedding, don't count as
+# semantic matches at all.
+hybrid_min_similarity = float(os.getenv("DOCUMENT_HYBRID_MIN_SIMILARITY", "0.2"))
+# "tfidf" searches the content of documents; "hybrid" fuses BM25 over all their
+# fields with dense embeddings, cached in embedding_cache_dir; "passages"
+# searches overlapping passages of the content and returns the best ones.
+search_mode = os.getenv("DOCUMENT_SEARCH_MODE", "tfidf")
+passage_chars = int(os.getenv("DOCUMENT_PASSAGE_CHARS", "1000"))
+passage_overlap = int(os.getenv("DOCUMENT_PASSAGE_OVERLAP", "200"))
+search_encoder = os.getenv("DOCUMENT_SEARCH_ENCODER", "lsa")
+embedding_cache_dir = os.getenv("DOCUMENT_EMBEDDING_CACHE",
+                                os.path.join(os.path.dirname(__file__), "../server/embedding_cache"))
+embedding_dtype = os.getenv("DOCUMENT_EMBEDDING_DTYPE", "int8")
+
+
+def search_scorer():
+    """A new scorer of the configured kind for a loaded index."""
+    from .retrieval import SCORERS
+
+    return SCORERS[search_scorer_name]()
+
+
+def load_document_index(user_id: str):
+    """
+    Builds a user's index from the document source when no saved shard
+    exists, or returns None if the source can't be read.
+    """
+    from .hybrid import EmbeddingCache, HybridIndex, LSAEncoder, SentenceTransformerEncoder
+    from .index import DocumentIndex
+    from .passages import PassageIndex
 
+    try:
+        if search_mode == "passages":
+            # Streamed into the shard directory, so later loads just map it.
+            index = PassageIndex.build(document_source.for_user(user_id), document_shards().shard_dir(user_id),
+                                       scorer=search_scorer(), chunk_chars=passage_chars, overlap=passage_overlap)
+            return index if len(index) else None
+        documents = list(document_source.for_user(user_id))
+    except FileNotFoundError:
+        logger.error("File not found at %s", document_source.path)
+        return None
+    except json.JSONDecodeError:
+        logger.error("Could not decode JSON from %s", document_source.path)
+        return None
+
+    if search_mode == "hybrid":
+        if not documents:
+            return None
+        encoder = LSAEncoder() if search_encoder == "lsa" else SentenceTransformerEncoder(search_encoder)
+        return HybridIndex.from_documents(documents, encoder=encoder,
+                                          cache=EmbeddingCache(embedding_cache_dir, dtype=embedding_dtype),
+                                          min_similarity=hybrid_min_similarity)
+
+    user_documents = [doc for doc in documents if doc.get("content")]
+    if not user_documents:
+        return None
+    return DocumentIndex.from_documents(user_documents, scorer=search_scorer())
+
+
+_document_shards: Optional["ShardedIndexStore"] = None
+_document_shards_lock = threading.Lock()
+
+
+def document_shards() -> "ShardedIndexStore":
+    """
+    One index per user, loaded the first time that user's session searches
+    and shared by every later DocumentSearchTool call until it is evicted.
+    Saved shards are TF-IDF or passage indexes; hybrid indexes are built by
+    the loader. The store is created on first use.
+    """
+    global _document_shards
+    with _document_shards_lock:
+        if _document_shards is None:
+            from .index import DocumentIndex
+            from .passages import PassageIndex
+            from .shards import ShardedIndexStore
+
+            _document_shards = ShardedIndexStore(
+                index_dir if search_mode == "tfidf" else f"{index_dir}_{search_mode}",
+                memory_budget=int(os.getenv("DOCUMENT_INDEX_MEMORY_MB", "256")) * 1024 * 1024,
+                loader=load_document_index,
+                scorer=search_scorer,
+                index_class=PassageIndex if search_mode == "passages" else DocumentIndex,
+            )
+        return _document_shards
+
+
+def document_index_version() -> str:
+    """
+    Changes whenever a user's document index is rebuilt or invalidated, e.g.
+    by `server/embeddings.py --update`; see ShardedIndexStore.version.
+    """
+    return document_shards().version()
 
-def DocumentSearchTool(query: list[str]):
+
+def DocumentSearchTool(query: list[str], tool_context: "ToolContext"):
     """
-    Compare query to precomputed TF-IDF vectors of database entries.
+    Search the user's documents for the queries, by TF-IDF similarity of
+    their content or, in hybrid mode, by their name, description, content,
+    tags and meaning. In passages mode, entries hold the document's best
+    matching passages, with their page, instead of its content.
 
     Args:
-        vectorizer: A fitted TfidfVectorizer.
-        database_vectors: TF-IDF matrix of the database (already transformed).
-        query: The input query string.
-        database: List of original database entries.
+        query: One or more query strings, e.g. the email subject, its body and
+            each topic it mentions. They are searched together in one call.
 
     Returns:
-        List of tuples (entry, similarity_score), sorted by similarity.
-    """ 
+        One {"query": query, "results": [(entry, similarity_score), ...]}
+        per query, in the order given, with the results sorted by similarity.
+    """
+    with span("tool_run", tool="DocumentSearchTool"):
+        document_index = document_shards().get(tool_context.user_id)
+        if document_index is None:
+            return
+
+        if isinstance(query, str):
+            query = [query]
+
+        min_score = hybrid_min_score if search_mode == "hybrid" else search_min_score
+        results = document_index.search_many(query, k=search_top_k, min_score=min_score)
+        # A list rather than a dict keyed by query, which would merge repeated queries.
+        return [{"query": q, "results": hits} for q, hits in zip(query, results)]
+
 
-    # Load the database entries
-    try:
-        with open(json_file, 'r') as f:
-            documents = json.load(f)
-    except FileNotFoundError:
-        print(f"Error: File not found at {json_file}")
-        return
-    except json.JSONDecodeError:
-        print(f"Error: Could not decode JSON from {json_file}")
-        return 
-    
-    try:
-        with open(database_vectors_path, 'r') as f:
-            database_vectors = json.load(f)
-    except FileNotFoundError:
-        print(f"Error: File not found at {database_vectors_path}")
-        return
-    except json.JSONDecodeError:
-        print(f"Error: Could not decode JSON from {database_vectors_path}")
-        return 
 
-    # Vectorize the query using the same fitted vectorizer
-    vectorizer = TfidfVectorizer(max_df=0.8, min_df=5, stop_words='english')
-    vectorizer.fit(documents)
-    query_vector = vectorizer.transform([query])
-    print("----vectorized query----")
 
-    # Compute cosine similarity between the query and database vectors
-    similarities = cosine_similarity(query_vector, database_vectors).flatten()
+def build_root_agent():
+    """Root agent for orchestration."""
+    from google.adk.agents import Agent
 
-    # Sort by similarity score (highest first)
-    similar_indices = similarities.argsort()[::-1][:6]
+    return Agent(
+        name="email_root_agent_v2",
+        model="gemini-2.0-flash-001",
+        description="Main email assistant agent: interacts politely and clearly with the user, manages email classification, response, and retrieval of relevant documents.",
+        #instruction=("use the 'DocumentSearchTool' to find pertinent documents. Provide the found documents to the user"),
+        instruction=("Always be polite and clear in your responses to the user. When you receive a new email from the user: 1. **Classify the email** using zero, one, or more of the following labels relevant to its content: (important), (work), (family), (deadline), (meeting). Clearly return the classification to the user. 2. **Respond to the email** as comprehensively and helpfully as possible, based on the email content. 3. **Search for relevant documents:** If you believe the email content could be enriched by information in documents, use the 'DocumentSearchTool' to find pertinent documents. Provide the found documents to the user along with your response, briefly explaining their relevance. If the user's request is not a new email but a specific question or instruction, respond politely and clearly, using 'DocumentSearchTool' if necessary to provide additional information."),
+        tools=[DocumentSearchTool, get_email_thread],
+        #sub_agents=[],
+        output_key="email_assistant_output",
+    )
 
-    # Return entries with their corresponding similarity score
-    return [(documents[i], similarities[i]) for i in similar_indices]
 
+_root_agent_lock = threading.Lock()
 
 
+def __getattr__(name):
+    # The ADK finds the agent as `mail_agent.agent.root_agent`.
+    if name == "root_agent":
+        with _root_agent_lock:
+            if "root_agent" not in globals():
+                globals()["root_agent"] = build_root_agent()
+        return globals()["root_agent"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# Root agent for orchestration
-root_agent = Agent(
-    name="email_root_agent_v2",
-    model="gemini-2.0-flash-001",
-    description="Main email assistant agent: interacts politely and clearly with the user, manages email classification, response, and retrieval of relevant documents.",
-    #instruction=("use the 'DocumentSearchTool' to find pertinent documents. Provide the found documents to the user"),
-    instruction=("Always be polite and clear in your responses to the user. When you receive a new email from the user: 1. **Classify the email** using zero, one, or more of the following labels relevant to its content: (important), (work), (family), (deadline), (meeting). Clearly return the classification to the user. 2. **Respond to the email** as comprehensively and helpfully as possible, based on the email content. 3. **Search for relevant documents:** If you believe the email content could be enriched by information in documents, use the 'DocumentSearchTool' to find pertinent documents. Provide the found documents to the user along with your response, briefly explaining their relevance. If the user's request is not a new email but a specific question or instruction, respond politely and clearly, using 'DocumentSearchTool' if necessary to provide additional information."),
-    tools=[DocumentSearchTool],
-    #sub_agents=[],
-    output_key="email_assistant_output",
-)
 
 """
 "Always be polite and clear in your responses to the user."
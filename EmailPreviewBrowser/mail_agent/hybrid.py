@@ -0,0 +1,398 @@
+import hashlib
+import os
+import tempfile
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy.sparse import diags
+from sklearn.decomposition import TruncatedSVD
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+from sklearn.preprocessing import normalize
+
+from .metrics import span
+from .retrieval import ExactScorer, top_k
+
+FIELDS = ("name", "description", "content", "tags")
+# Names and tags are short and chosen by hand, so a match there says more than one in the content.
+FIELD_WEIGHTS = {"name": 3.0, "description": 2.0, "content": 1.0, "tags": 2.0}
+
+
+def field_text(document: Dict[str, Any], field: str) -> str:
+    value = document.get(field) or ""
+    return " ".join(map(str, value)) if isinstance(value, list) else str(value)
+
+
+def document_text(document: Dict[str, Any]) -> str:
+    """All the searchable fields of a document, as one text."""
+    return "\n".join(field_text(document, field) for field in FIELDS)
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class BM25Index:
+    """
+    BM25F over the fields of the documents.
+
+    Each field's term frequencies are normalised by the field's length
+    relative to its average, weighted by `field_weights` and summed, then
+    saturated with k1 and multiplied by the idf, all at build time. The
+    resulting sparse matrix holds each document's BM25 weight for every term
+    it contains, so scoring a query is a sparse product with its terms,
+    done by ExactScorer.
+
+    Attributes:
+        vectorizer: Shared vocabulary of all fields.
+        matrix: CSR matrix of BM25 weights, (n_documents, n_terms).
+    """
+
+    def __init__(self, field_weights: Optional[Dict[str, float]] = None, k1: float = 1.2, b: float = 0.75):
+        self.field_weights = field_weights or FIELD_WEIGHTS
+        self.k1 = k1
+        self.b = b
+        self.scorer = ExactScorer()
+
+    def fit(self, documents: Sequence[Dict[str, Any]]) -> "BM25Index":
+        self.vectorizer = CountVectorizer(dtype=np.float32).fit(document_text(doc) for doc in documents)
+        tf = None
+        for field, weight in self.field_weights.items():
+            counts = self.vectorizer.transform(field_text(doc, field) for doc in documents)
+            lengths = np.asarray(counts.sum(axis=1)).ravel()
+            norm = 1 - self.b + self.b * lengths / max(lengths.mean(), 1e-9)
+            weighted = diags((weight / norm).astype(np.float32)) @ counts
+            tf = weighted if tf is None else tf + weighted
+        tf = tf.tocsr()
+        df = np.bincount(tf.indices, minlength=tf.shape[1])
+        idf = np.log1p((len(documents) - df + 0.5) / (df + 0.5)).astype(np.float32)
+        tf.data = tf.data * (self.k1 + 1) / (tf.data + self.k1)
+        self.matrix = (tf @ diags(idf)).tocsr()
+        return self
+
+    def search_many(self, queries: List[str], k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """The rows and BM25 scores of each query's k best documents, best first."""
+        query_matrix = self.vectorizer.transform(queries)
+        query_matrix.data[:] = 1  # a term repeated in the query doesn't count twice
+        return self.scorer.search_many(self.matrix, query_matrix, k)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self.matrix, name).nbytes for name in ("data", "indices", "indptr")) \
+            + 100 * len(self.vectorizer.vocabulary_)
+
+
+class LSAEncoder:
+    """
+    Dense document vectors from a truncated SVD of the TF-IDF matrix (latent
+    semantic analysis), fitted on the corpus itself; needs nothing to be
+    downloaded.
+
+    Terms that occur in the same documents end up close together, so a
+    query can match documents that use related words instead of its own.
+
+    Attributes:
+        key: Identifies the fitted model, for EmbeddingCache. Vectors of
+            different fits aren't comparable, so the key changes with the
+            corpus, and only rebuilds of an unchanged corpus (a restart, a
+            shard reloaded after eviction) find their vectors cached.
+    """
+
+    def __init__(self, n_components: int = 128, seed: int = 0):
+        self.n_components = n_components
+        self.seed = seed
+        self.key: Optional[str] = None
+
+    def fit(self, texts: Sequence[str]) -> "LSAEncoder":
+        self.tfidf = TfidfVectorizer(sublinear_tf=True, dtype=np.float32)
+        matrix = self.tfidf.fit_transform(texts)
+        n_components = max(1, min(self.n_components, matrix.shape[0] - 1, matrix.shape[1] - 1))
+        svd = TruncatedSVD(n_components, random_state=self.seed).fit(matrix)
+        # Kept as a contiguous (n_terms, n_components) array: multiplying by
+        # the transposed components, as TruncatedSVD.transform does, is
+        # several times slower for single queries.
+        self.projection = np.ascontiguousarray(svd.components_.T, dtype=np.float32)
+        digest = hashlib.sha1(self.projection.tobytes())
+        self.key = f"lsa-{n_components}-{digest.hexdigest()[:16]}"
+        return self
+
+    def encode(self, texts: Sequence[str]) -> np.ndarray:
+        """L2-normalised float32 vectors, one row per text."""
+        return normalize(self.tfidf.transform(texts) @ self.projection).astype(np.float32)
+
+
+class SentenceTransformerEncoder:
+    """
+    A small sentence-transformers model run on the CPU, e.g.
+    "all-MiniLM-L6-v2". Needs the sentence-transformers package and
+    downloads the model on first use.
+    """
+
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2", batch_size: int = 64):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.batch_size = batch_size
+        self.key = f"st-{model_name.replace('/', '-')}"
+
+    def fit(self, texts: Sequence[str]) -> "SentenceTransformerEncoder":
+        return self
+
+    def encode(self, texts: Sequence[str]) -> np.ndarray:
+        return self.model.encode(list(texts), batch_size=self.batch_size, normalize_embeddings=True,
+                                 convert_to_numpy=True).astype(np.float32)
+
+
+class QuantizedVectors:
+    """
+    Row vectors kept as float16, or as int8 with one float32 scale per row,
+    which take a half and a quarter of the memory of float32.
+
+    Dot products are computed in blocks of rows, so the float32 copy of the
+    block they need never grows with the number of rows.
+    """
+
+    block_rows = 16_384
+
+    def __init__(self, values: np.ndarray, scales: Optional[np.ndarray] = None):
+        self.values = values
+        self.scales = scales
+
+    @classmethod
+    def quantize(cls, vectors: np.ndarray, dtype: str = "int8") -> "QuantizedVectors":
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if dtype == "float32":
+            return cls(vectors)
+        if dtype == "float16":
+            return cls(vectors.astype(np.float16))
+        if dtype == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127
+            scales[scales == 0] = 1
+            values = np.rint(vectors / scales[:, None]).astype(np.int8)
+            return cls(values, scales.astype(np.float32))
+        raise ValueError(f"Unsupported dtype {dtype}")
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def dot(self, queries: np.ndarray) -> np.ndarray:
+        """(n_rows, n_queries) dot products with float32 query vectors."""
+        queries = np.asarray(queries, dtype=np.float32)
+        scores = np.empty((len(self.values), queries.shape[0]), dtype=np.float32)
+        for start in range(0, len(self.values), self.block_rows):
+            block = self.values[start:start + self.block_rows].astype(np.float32)
+            scores[start:start + len(block)] = block @ queries.T
+        if self.scales is not None:
+            scores *= self.scales[:, None]
+        return scores
+
+
+class EmbeddingCache:
+    """
+    Document embeddings on disk, keyed by the hash of the embedded text.
+
+    Each encoder (by its `key`) gets one .npz file of quantised vectors, so
+    re-indexing only encodes texts that are new or changed, in batches of
+    `batch_size`. Only the `max_files` most recently used files are kept;
+    the keys of fitted encoders like LSAEncoder change with the corpus,
+    which would otherwise leave a file behind on every change.
+    """
+
+    def __init__(self, cache_dir: str, dtype: str = "int8", batch_size: int = 256, max_files: int = 64):
+        self.cache_dir = cache_dir
+        self.dtype = dtype
+        self.batch_size = batch_size
+        self.max_files = max_files
+        self.encoded = 0  # texts encoded, i.e. not found in the cache, over the cache's lifetime
+
+    def embed(self, encoder, texts: Sequence[str]) -> QuantizedVectors:
+        """Vectors of the texts, in order, encoding only those not cached yet."""
+        path = os.path.join(self.cache_dir, f"{encoder.key}-{self.dtype}.npz")
+        hashes = [content_hash(text) for text in texts]
+        cached_hashes, values, scales = self._read(path)
+        row_of = {h: row for row, h in enumerate(cached_hashes)}
+
+        missing = {}
+        for h, text in zip(hashes, texts):
+            if h not in row_of and h not in missing:
+                missing[h] = text
+        if missing:
+            new_texts = list(missing.values())
+            batches = [QuantizedVectors.quantize(encoder.encode(new_texts[start:start + self.batch_size]), self.dtype)
+                       for start in range(0, len(new_texts), self.batch_size)]
+            new_values = np.concatenate([batch.values for batch in batches])
+            values = new_values if values is None else np.concatenate([values, new_values])
+            if self.dtype == "int8":
+                new_scales = np.concatenate([batch.scales for batch in batches])
+                scales = new_scales if scales is None else np.concatenate([scales, new_scales])
+            for h in missing:
+                row_of[h] = len(row_of)
+            cached_hashes = cached_hashes + list(missing)
+            self._write(path, cached_hashes, values, scales)
+            self._prune(keep=path)
+            self.encoded += len(missing)
+        elif cached_hashes:
+            # Marks the file used, for _prune.
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+
+        rows = np.fromiter((row_of[h] for h in hashes), dtype=np.int64, count=len(hashes))
+        return QuantizedVectors(values[rows], scales[rows] if scales is not None else None)
+
+    @staticmethod
+    def _read(path: str):
+        if not os.path.exists(path):
+            return [], None, None
+        with np.load(path) as data:
+            scales = data["scales"] if "scales" in data else None
+            return [h.decode("ascii") for h in data["hashes"]], data["values"], scales
+
+    @staticmethod
+    def _write(path: str, hashes: List[str], values: np.ndarray, scales: Optional[np.ndarray]):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        arrays = {"hashes": np.array([h.encode("ascii") for h in hashes], dtype="S40"), "values": values}
+        if scales is not None:
+            arrays["scales"] = scales
+        # A temporary file of its own, so concurrent builds never write to the same one.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".embeddings-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def _prune(self, keep: str):
+        """Deletes the least recently used cache files beyond `max_files`."""
+        files = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith(".npz") and path != keep:
+                try:
+                    files.append((os.path.getmtime(path), path))
+                except OSError:
+                    pass  # pruned by a concurrent build
+        for _, path in sorted(files, reverse=True)[max(self.max_files - 1, 0):]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class HybridIndex:
+    """
+    Lexical and semantic search over the document store, combined by
+    reciprocal rank fusion.
+
+    BM25 (see BM25Index) ranks documents by the query's terms in their
+    name, description, content and tags; the dense side ranks them by the
+    cosine similarity of their embeddings with the query's. Each contributes
+    its best `candidates` documents, and a document scores
+    sum(1 / (rrf_k + rank)) over the rankings it appears in, so neither
+    side's scores need to be calibrated against the other's.
+
+    Ranks alone can't tell a match from noise, so each side only ranks
+    documents that match at all: BM25 those sharing a term with the query,
+    the dense side those at least `min_similarity` similar to it. A query
+    matching nothing finds nothing, like with the TF-IDF index.
+
+    Attributes:
+        documents: The indexed document entries, by row.
+        bm25: The lexical index.
+        encoder: Embeds documents and queries, e.g. LSAEncoder.
+        vectors: Quantised document embeddings.
+        min_similarity: Lowest cosine similarity the dense side ranks. On
+            the benchmark corpus, 99% of the LSA similarities of unrelated
+            documents are below 0.16 and 95% of relevant ones above 0.3.
+    """
+
+    def __init__(self, documents: List[Dict[str, Any]], bm25: BM25Index, encoder, vectors: QuantizedVectors,
+                 candidates: int = 50, rrf_k: int = 60, min_similarity: float = 0.2):
+        self.documents = documents
+        self.bm25 = bm25
+        self.encoder = encoder
+        self.vectors = vectors
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.min_similarity = min_similarity
+
+    @classmethod
+    def from_documents(cls, documents: List[Dict[str, Any]], encoder=None, cache: Optional[EmbeddingCache] = None,
+                       dtype: str = "int8", field_weights: Optional[Dict[str, float]] = None,
+                       **kwargs) -> "HybridIndex":
+        """
+        Builds the index.
+
+        Args:
+            documents: Document entries shaped like the `documents` table.
+            encoder: Dense encoder with `fit`, `encode` and `key`; an
+                LSAEncoder fitted on the documents by default.
+            cache: Where embeddings are cached; without one they are all encoded.
+            dtype: "int8", "float16" or "float32" storage of the embeddings,
+                when there is no cache (the cache has its own).
+            field_weights: BM25 field weights, FIELD_WEIGHTS by default.
+            kwargs: `candidates`, `rrf_k` and `min_similarity`.
+        """
+        documents = [doc for doc in documents if isinstance(doc, dict)]
+        texts = [document_text(doc) for doc in documents]
+        encoder = (encoder or LSAEncoder()).fit(texts)
+        if cache is not None:
+            vectors = cache.embed(encoder, texts)
+        else:
+            vectors = QuantizedVectors.quantize(encoder.encode(texts), dtype)
+        return cls(documents, BM25Index(field_weights).fit(documents), encoder, vectors, **kwargs)
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by the index, for ShardedIndexStore."""
+        return self.bm25.nbytes + self.vectors.nbytes
+
+    def search(self, query: str, k: int = 6, min_score: float = 0.0) -> List[Tuple[Dict[str, Any], float]]:
+        """
+        Returns the k best documents for the query, with their fused scores,
+        best first, like `DocumentIndex.search`.
+
+        Fused scores aren't similarities: they are at most
+        2 / (rrf_k + 1), about 0.033, for a document ranked first by both
+        sides, so `min_score` is on that scale rather than the cosine scale
+        of the TF-IDF index.
+        """
+        return self.search_many([query], k, min_score)[0]
+
+    def search_many(self, queries: List[str], k: int = 6,
+                    min_score: float = 0.0) -> List[List[Tuple[Dict[str, Any], float]]]:
+        """
+        Searches several queries at once; both sides score the whole batch in
+        one product. `min_score` is on the fused scale, see `search`.
+        """
+        if not self.documents or not queries:
+            return [[] for _ in queries]
+
+        with span("vectorize", index="hybrid"):
+            query_vectors = self.encoder.encode(queries)
+        with span("score", index="hybrid"):
+            lexical = self.bm25.search_many(queries, self.candidates)
+            dense_scores = self.vectors.dot(query_vectors)
+        all_rows = np.arange(len(self.documents))
+
+        results = []
+        for i, (lexical_rows, _) in enumerate(lexical):
+            dense_rows, _ = top_k(all_rows, dense_scores[:, i], self.candidates, self.min_similarity)
+            fused: Dict[int, float] = {}
+            for ranking in (lexical_rows, dense_rows):
+                for rank, row in enumerate(ranking):
+                    fused[row] = fused.get(row, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+            rows = np.fromiter(fused.keys(), dtype=np.int64, count=len(fused))
+            scores = np.fromiter(fused.values(), dtype=np.float64, count=len(fused))
+            rows, scores = top_k(rows, scores, k, min_score)
+            results.append([(self.documents[row], float(score)) for row, score in zip(rows, scores)])
+        return results
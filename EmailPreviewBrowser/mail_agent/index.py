@@ -0,0 +1,378 @@
+import copy
+import json
+import os
+import pickle
+import tempfile
+import threading
+import uuid
+from typing import Any, Dict, Iterable, List, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix, vstack
+from sklearn.base import clone
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from .metrics import span
+from .retrieval import ExactScorer
+from .vectorize import parallel_fit_transform
+
+# On-disk layout of a saved index: one raw .npy file per CSR array, so they can
+# be memory-mapped, plus a pickle with the fitted vectorizer, the documents and
+# the names of the array files.
+CSR_ARRAYS = ("data", "indices", "indptr")
+META_FILE = "meta.pkl"
+
+
+class DocumentIndex:
+    """
+    Long-lived TF-IDF index over the document store.
+
+    The vectorizer is fitted once and the document matrix is kept as a sparse
+    CSR matrix with L2-normalised rows, so a query only needs to be transformed
+    and scored against the matrix by the index's scorer (see retrieval.py).
+
+    Writes are incremental: new and edited documents are weighted with the
+    current vocabulary and idf and appended as new rows, and the rows they
+    replace are tombstoned. Tombstones are compacted away once they pass
+    `compact_threshold` of the rows, and the vectorizer is only refitted once
+    the changes since the last fit pass `refit_threshold` of the corpus.
+
+    Attributes:
+        vectorizer: The fitted TfidfVectorizer.
+        matrix: CSR matrix of shape (n_rows, n_terms), including tombstoned rows.
+        ids: Document id of each matrix row.
+        rows: Mapping of live document id to its matrix row.
+        documents: Mapping of live document id to the original document entry.
+        scorer: Scorer used by `search`, refitted whenever rows move.
+    """
+
+    refit_threshold = 0.2
+    compact_threshold = 0.1
+
+    def __init__(self, vectorizer: TfidfVectorizer, matrix, documents: List[Dict[str, Any]],
+                 ids: List[Any] = None, scorer=None):
+        self.vectorizer = vectorizer
+        self.matrix = matrix.tocsr()
+        self.ids = list(ids) if ids is not None else [document_id(doc) for doc in documents]
+        self.rows = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        self.documents = dict(zip(self.ids, documents))
+        self._alive = np.ones(len(self.ids), dtype=bool)
+        self._fitted_size = len(self.ids)
+        self._changes = 0
+        self._lock = threading.RLock()
+        self.scorer = (scorer or ExactScorer()).fit(self.matrix)
+
+    @classmethod
+    def from_documents(cls, documents: List[Dict[str, Any]], scorer=None, workers: int = 1,
+                       **vectorizer_kwargs) -> "DocumentIndex":
+        """
+        Fits a vectorizer on the documents and builds the index.
+
+        Args:
+            documents: Document entries shaped like the `documents` table.
+            scorer: Scorer for `search`, ExactScorer by default.
+            workers: Processes tokenising the documents, see
+                `parallel_fit_transform`; the result is the same for any number.
+            vectorizer_kwargs: Extra arguments for TfidfVectorizer.
+        """
+        documents = [doc for doc in documents if isinstance(doc, dict) and doc.get("content")]
+        vectorizer = TfidfVectorizer(**vectorizer_kwargs)
+        matrix = parallel_fit_transform(vectorizer, (doc["content"] for doc in documents), workers)
+        return cls(vectorizer, matrix, documents, scorer=scorer)
+
+    @classmethod
+    def from_json(cls, json_file: str, scorer=None, **vectorizer_kwargs) -> "DocumentIndex":
+        """Builds the index from a JSON file containing a list of documents."""
+        with open(json_file, "r") as f:
+            documents = json.load(f)
+        return cls.from_documents(documents, scorer=scorer, **vectorizer_kwargs)
+
+    def save(self, index_dir: str):
+        """
+        Saves the index as a directory of memory-mappable CSR arrays.
+
+        Each save writes its arrays under new file names and then replaces the
+        metadata file, which names them, in one `os.replace`: a crash or a
+        concurrent `load` sees either the old index or the new one, never a
+        mix. An index already memory-mapped from the directory stays valid.
+
+        Args:
+            index_dir: Directory to write to, created if needed.
+        """
+        with self._lock:
+            self.compact()
+            os.makedirs(index_dir, exist_ok=True)
+            version = uuid.uuid4().hex[:12]
+            arrays = {name: f"{name}.{version}.npy" for name in CSR_ARRAYS}
+            for name, file_name in arrays.items():
+                np.save(os.path.join(index_dir, file_name), getattr(self.matrix, name))
+
+            # stop_words_ only records the pruned terms and can be larger than
+            # the vocabulary itself; it's dropped from a copy, as the live
+            # vectorizer may still be used.
+            vectorizer = copy.copy(self.vectorizer)
+            vectorizer.stop_words_ = None
+            meta = {
+                "shape": self.matrix.shape,
+                "arrays": arrays,
+                "vectorizer": vectorizer,
+                "ids": self.ids,
+                "documents": [self.documents[i] for i in self.ids],
+                "fitted_size": self._fitted_size,
+                "changes": self._changes,
+            }
+            fd, tmp_path = tempfile.mkstemp(dir=index_dir, prefix=META_FILE)
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(meta, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, os.path.join(index_dir, META_FILE))
+            _remove_unused_arrays(index_dir, set(arrays.values()))
+
+    @classmethod
+    def load(cls, index_dir: str, mmap: bool = True, scorer=None) -> "DocumentIndex":
+        """
+        Opens an index written by `save`.
+
+        Args:
+            index_dir: Directory the index was saved to.
+            mmap: Memory-map the CSR arrays instead of reading them into memory.
+            scorer: Scorer for `search`, ExactScorer by default.
+        """
+        mmap_mode = "r" if mmap else None
+        for attempt in range(3):
+            with open(os.path.join(index_dir, META_FILE), "rb") as f:
+                meta = pickle.load(f)
+            # Indexes saved before the arrays were versioned use fixed names.
+            files = meta.get("arrays") or {name: f"{name}.npy" for name in CSR_ARRAYS}
+            try:
+                arrays = [np.load(os.path.join(index_dir, files[name]), mmap_mode=mmap_mode) for name in CSR_ARRAYS]
+                break
+            except FileNotFoundError:
+                # A concurrent save replaced the metadata and removed these
+                # arrays after it was read; read the new one.
+                if attempt == 2:
+                    raise
+        matrix = csr_matrix(tuple(arrays), shape=meta["shape"], copy=False)
+
+        index = cls(meta["vectorizer"], matrix, meta["documents"], ids=meta["ids"], scorer=scorer)
+        index._fitted_size = meta["fitted_size"]
+        index._changes = meta["changes"]
+        return index
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by the index: the CSR arrays plus the vocabulary and idf."""
+        matrix_bytes = sum(getattr(self.matrix, name).nbytes for name in CSR_ARRAYS)
+        vocabulary = getattr(self.vectorizer, "vocabulary_", {})
+        # A vocabulary_ entry (str key, int value, dict slot) takes roughly 100 bytes.
+        return matrix_bytes + self.vectorizer.idf_.nbytes + 100 * len(vocabulary)
+
+    @property
+    def drift(self) -> float:
+        """Fraction of the corpus added, edited or deleted since the vectorizer was last fitted."""
+        return self._changes / max(self._fitted_size, 1)
+
+    def upsert(self, documents: Iterable[Dict[str, Any]]):
+        """
+        Adds documents, or re-weights them if their id is already indexed.
+
+        Documents without content are removed from the index instead.
+
+        Args:
+            documents: Document entries shaped like the `documents` table.
+        """
+        with self._lock:
+            added = {}
+            for doc in documents:
+                doc_id = document_id(doc)
+                if doc_id in self.rows:
+                    self._tombstone(doc_id)
+                    self._changes += 1
+                added.pop(doc_id, None)
+                if doc.get("content"):
+                    added[doc_id] = doc
+            if added:
+                rows = self.vectorizer.transform([doc["content"] for doc in added.values()])
+                self.matrix = vstack([self.matrix, rows], format="csr")
+                for doc_id, doc in added.items():
+                    self.rows[doc_id] = len(self.ids)
+                    self.ids.append(doc_id)
+                    self.documents[doc_id] = doc
+                self._alive = np.concatenate([self._alive, np.ones(len(added), dtype=bool)])
+                self._changes += len(added)
+            self._maintain()
+
+    def remove(self, doc_ids: Iterable[Any]):
+        """Tombstones the documents with the given ids; unknown ids are ignored."""
+        with self._lock:
+            for doc_id in doc_ids:
+                if doc_id in self.rows:
+                    self._tombstone(doc_id)
+                    self._changes += 1
+            self._maintain()
+
+    def sync(self, documents: List[Dict[str, Any]]):
+        """
+        Brings the index in line with the full list of documents.
+
+        Only documents that are new, deleted or whose content changed touch the
+        matrix; metadata-only edits just replace the stored entry.
+        """
+        with self._lock:
+            seen = set()
+            changed = []
+            for doc in documents:
+                if not isinstance(doc, dict):
+                    continue
+                doc_id = document_id(doc)
+                seen.add(doc_id)
+                current = self.documents.get(doc_id)
+                if current is None or current.get("content") != doc.get("content"):
+                    changed.append(doc)
+                else:
+                    self.documents[doc_id] = doc
+            self.upsert(changed)
+            self.remove([doc_id for doc_id in self.rows if doc_id not in seen])
+
+    def compact(self):
+        """Drops tombstoned rows from the matrix."""
+        with self._lock:
+            if self._alive.all():
+                return
+            live = np.flatnonzero(self._alive)
+            self.matrix = self.matrix[live]
+            self.ids = [self.ids[row] for row in live]
+            self.rows = {doc_id: row for row, doc_id in enumerate(self.ids)}
+            self._alive = np.ones(len(self.ids), dtype=bool)
+            self.scorer.fit(self.matrix)
+
+    def refit(self):
+        """Refits the vectorizer on the live documents, refreshing the vocabulary and idf weights."""
+        with self._lock:
+            self.ids = [self.ids[row] for row in np.flatnonzero(self._alive)]
+            self.rows = {doc_id: row for row, doc_id in enumerate(self.ids)}
+            self._alive = np.ones(len(self.ids), dtype=bool)
+            vectorizer = clone(self.vectorizer)
+            self.matrix = vectorizer.fit_transform([self.documents[i]["content"] for i in self.ids]).tocsr()
+            self.vectorizer = vectorizer
+            self.scorer.fit(self.matrix)
+            self._fitted_size = len(self.ids)
+            self._changes = 0
+
+    def _tombstone(self, doc_id):
+        self._alive[self.rows.pop(doc_id)] = False
+        del self.documents[doc_id]
+
+    def _maintain(self):
+        if self.drift > self.refit_threshold and self.rows:
+            self.refit()
+        elif len(self.ids) - len(self.rows) > self.compact_threshold * len(self.ids):
+            self.compact()
+
+    def search(self, query: str, k: int = 6, min_score: float = 0.0) -> List[Tuple[Dict[str, Any], float]]:
+        """
+        Returns the k documents most similar to the query.
+
+        Args:
+            query: The input query string.
+            k: Maximum number of results.
+            min_score: Documents scoring below this are left out.
+
+        Returns:
+            List of tuples (document, similarity_score), sorted by similarity.
+            Documents sharing no term with the query are never returned.
+        """
+        with self._lock:
+            if not self.rows:
+                return []
+
+            with span("vectorize", index="tfidf"):
+                query_vector = self.vectorizer.transform([query])
+            with span("score", index="tfidf"):
+                rows, scores = self.scorer.search(self.matrix, query_vector, k, min_score, alive=self._alive)
+
+            return [(self.documents[self.ids[row]], float(score)) for row, score in zip(rows, scores)]
+
+    def search_many(self, queries: List[str], k: int = 6,
+                    min_score: float = 0.0) -> List[List[Tuple[Dict[str, Any], float]]]:
+        """
+        Searches several queries at once.
+
+        The queries are vectorised together and scored in one sparse
+        matrix-matrix product, instead of one pass over the matrix per query.
+
+        Returns:
+            One result list per query, in the same order, as returned by `search`.
+        """
+        with self._lock:
+            if not self.rows or not queries:
+                return [[] for _ in queries]
+
+            with span("vectorize", index="tfidf"):
+                query_matrix = self.vectorizer.transform(queries)
+            with span("score", index="tfidf"):
+                results = self.scorer.search_many(self.matrix, query_matrix, k, min_score, alive=self._alive)
+
+            return [
+                [(self.documents[self.ids[row]], float(score)) for row, score in zip(rows, scores)]
+                for rows, scores in results
+            ]
+
+
+def _remove_unused_arrays(index_dir: str, keep: set):
+    """Deletes array files of earlier saves; indexes still mapping them keep their data."""
+    for file_name in os.listdir(index_dir):
+        if file_name.endswith(".npy") and file_name not in keep:
+            try:
+                os.remove(os.path.join(index_dir, file_name))
+            except OSError:
+                # Windows can't delete a mapped file; the next save retries.
+                pass
+
+
+def document_id(document: Dict[str, Any]):
+    """Returns the document's `id`, falling back to (userId, name) for entries that were never stored."""
+    if "id" in document:
+        return document["id"]
+    return (document.get("userId"), document.get("name"))
+
+
+def convert_legacy_vectors(vectors_file: str, json_file: str, index_dir: str) -> DocumentIndex:
+    """
+    Converts a dense `tfidf_vectors.json` file into the binary index format.
+
+    The legacy file only holds the vectors, keyed by document name, so the
+    vocabulary and idf weights are recovered by refitting the default
+    TfidfVectorizer that produced it on the same documents.
+
+    Args:
+        vectors_file: Path to the legacy JSON vectors.
+        json_file: Path to the documents the vectors were computed from.
+        index_dir: Directory where the converted index will be saved.
+    """
+    with open(vectors_file, "r") as f:
+        vectors = json.load(f)
+    with open(json_file, "r") as f:
+        documents = json.load(f)
+
+    by_name = {}
+    for doc in documents:
+        if isinstance(doc, dict) and "name" in doc:
+            by_name.setdefault(doc["name"], doc)
+    names = [name for name in vectors if name in by_name]
+    entries = [by_name[name] for name in names]
+
+    vectorizer = TfidfVectorizer()
+    vectorizer.fit([doc.get("content") or "" for doc in entries])
+    matrix = csr_matrix(np.array([vectors[name] for name in names], dtype=np.float64))
+    if matrix.shape[1] != len(vectorizer.vocabulary_):
+        raise ValueError(
+            f"{vectors_file} has {matrix.shape[1]} terms but the documents produce "
+            f"{len(vectorizer.vocabulary_)}; they were not computed from {json_file}"
+        )
+
+    index = DocumentIndex(vectorizer, matrix, entries)
+    index.save(index_dir)
+    return index
@@ -0,0 +1,96 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import random
+from typing import Optional
+
+FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+
+class SampleFilter(logging.Filter):
+    """Lets every warning and error through, and a `rate` share of the records below."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stock handler formats the message before queueing it, on the
+        # thread that logged; the listener formats it instead. The queue is
+        # only read in this process, so the record needn't be picklable.
+        return record
+
+
+_handler: Optional[logging.Handler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def configure_logging(mode: Optional[str] = None, sample_rate: Optional[float] = None,
+                      level: Optional[str] = None) -> logging.Handler:
+    """
+    Sets up the root logger's output, replacing what an earlier call set up.
+
+    Args:
+        mode: "sync" writes each record to stderr on the thread that logged
+            it; "async" queues it for a background thread to write, so a slow
+            terminal or pipe doesn't hold up requests; "off" only writes
+            warnings and errors. LOG_MODE, or "sync", by default.
+        sample_rate: Share of the records below WARNING that are written,
+            e.g. 0.01 under load; warnings and errors always are.
+            LOG_SAMPLE_RATE, or 1, by default.
+        level: Lowest level logged, LOG_LEVEL or INFO by default.
+
+    Returns:
+        The handler added to the root logger.
+    """
+    global _handler, _listener
+    mode = mode or os.getenv("LOG_MODE", "sync")
+    sample_rate = float(os.getenv("LOG_SAMPLE_RATE", "1")) if sample_rate is None else sample_rate
+    level = logging.getLevelName((level or os.getenv("LOG_LEVEL", "INFO")).upper())
+    if mode not in ("sync", "async", "off"):
+        raise ValueError(f"Unknown log mode {mode!r}")
+
+    # FORMAT doesn't show them, so records needn't walk the stack for the
+    # caller's file and line or look up the thread, process and task names,
+    # as the logging HOWTO's "Optimization" section suggests.
+    logging._srcfile = None
+    logging.logThreads = logging.logProcesses = logging.logMultiprocessing = False
+    logging.logAsyncioTasks = False
+
+    root = logging.getLogger()
+    if _handler is not None:
+        root.removeHandler(_handler)
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+    stream = logging.StreamHandler()
+    stream.setFormatter(logging.Formatter(FORMAT))
+    if mode == "async":
+        _handler = _QueueHandler(queue.SimpleQueue())
+        _listener = logging.handlers.QueueListener(_handler.queue, stream)
+        _listener.start()
+    else:
+        _handler = stream
+    if sample_rate < 1:
+        # On the handler logged to, so dropped records are never queued or formatted.
+        _handler.addFilter(SampleFilter(sample_rate))
+    root.addHandler(_handler)
+    # With "off", records below WARNING are dropped by the logger's level
+    # check, before a record is even created.
+    root.setLevel(max(level, logging.WARNING) if mode == "off" else level)
+    return _handler
+
+
+@atexit.register
+def _flush():
+    # Writes what the background thread hasn't yet.
+    if _listener is not None:
+        _listener.stop()
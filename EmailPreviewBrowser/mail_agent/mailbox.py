@@ -0,0 +1,572 @@
+import imaplib
+import json
+import re
+import sqlite3
+import threading
+import time
+from datetime import timezone
+from email.header import decode_header, make_header
+from email.utils import getaddresses, parseaddr, parsedate_to_datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .imap import ImapConnectionPool
+from .metrics import span
+from .mime import ParsedMessage, stream_messages
+from .threads import ThreadIndex, message_ids
+
+FETCH_UID = re.compile(rb"UID (\d+)")
+FETCH_FLAGS = re.compile(rb"FLAGS \(([^)]*)\)")
+FETCH_MODSEQ = re.compile(rb"MODSEQ \((\d+)\)")
+
+# Columns follow the `emails` and `replies` tables in shared/schema.ts, plus
+# the IMAP coordinates (folder, uid, modseq) the sync needs and the
+# checkpoints of batch jobs.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS emails (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    folder TEXT NOT NULL,
+    uid INTEGER NOT NULL,
+    modseq INTEGER,
+    message_id TEXT,
+    in_reply_to TEXT,
+    reference_ids TEXT,
+    sender TEXT NOT NULL,
+    sender_email TEXT NOT NULL,
+    recipients TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    preview TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    is_read INTEGER NOT NULL DEFAULT 0,
+    labels TEXT,
+    thread_id TEXT,
+    UNIQUE (user_id, folder, uid)
+);
+CREATE INDEX IF NOT EXISTS emails_timestamp ON emails (user_id, timestamp);
+CREATE INDEX IF NOT EXISTS emails_thread ON emails (user_id, thread_id);
+CREATE TABLE IF NOT EXISTS folders (
+    user_id INTEGER NOT NULL,
+    folder TEXT NOT NULL,
+    uidvalidity INTEGER NOT NULL,
+    highest_uid INTEGER NOT NULL,
+    highest_modseq INTEGER,
+    PRIMARY KEY (user_id, folder)
+);
+CREATE TABLE IF NOT EXISTS replies (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    email_id INTEGER NOT NULL REFERENCES emails (id),
+    content TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    tone TEXT,
+    length TEXT,
+    is_draft INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS replies_email ON replies (email_id);
+CREATE TABLE IF NOT EXISTS batch_jobs (
+    id TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    source TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS batch_items (
+    job_id TEXT NOT NULL REFERENCES batch_jobs (id),
+    email_id INTEGER NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (job_id, email_id)
+);
+"""
+COLUMNS = ["user_id", "folder", "uid", "modseq", "message_id", "in_reply_to", "reference_ids", "sender",
+           "sender_email", "recipients", "subject", "body", "preview", "timestamp", "is_read", "labels",
+           "thread_id"]
+JSON_COLUMNS = ("in_reply_to", "reference_ids", "recipients", "labels")
+# Set locally, e.g. by batch jobs, rather than synced, so a re-download keeps them.
+LOCAL_COLUMNS = ("labels",)
+
+
+def decode(value: Optional[str]) -> str:
+    """Decodes an RFC 2047 encoded header to text."""
+    if not value:
+        return ""
+    try:
+        return str(make_header(decode_header(value)))
+    except (UnicodeDecodeError, LookupError):
+        return value
+
+
+def local_message_id(folder: str, uid: int) -> str:
+    """Stand-in Message-ID for messages without one."""
+    return f"<{uid}.{folder}@local>"
+
+
+def email_record(parsed: ParsedMessage, uid: int, flags: Sequence[bytes] = (),
+                 modseq: Optional[int] = None) -> Dict[str, Any]:
+    """Maps a parsed message to the columns of the `emails` table."""
+    msg = parsed.headers
+    sender, sender_email = parseaddr(decode(msg.get("From")))
+    try:
+        date = parsedate_to_datetime(msg["Date"])
+        # In UTC, so timestamps sort chronologically as text.
+        timestamp = (date if date.tzinfo else date.replace(tzinfo=timezone.utc)).astimezone(timezone.utc).isoformat()
+    except (TypeError, ValueError):
+        timestamp = ""
+    return {
+        "uid": uid,
+        "modseq": modseq,
+        "message_id": (msg.get("Message-ID") or "").strip(),
+        "in_reply_to": message_ids(msg.get("In-Reply-To")),
+        "reference_ids": message_ids(msg.get("References")),
+        "sender": sender or sender_email,
+        "sender_email": sender_email,
+        "recipients": [addr for _, addr in getaddresses(msg.get_all("To", []) + msg.get_all("Cc", []))],
+        "subject": decode(msg.get("Subject")),
+        "body": parsed.body,
+        "preview": parsed.text_preview,
+        "timestamp": timestamp,
+        "is_read": b"\\Seen" in flags,
+        "labels": [],
+        "thread_id": None,
+    }
+
+
+class MailCache:
+    """
+    Local SQLite copy of synced mailboxes, in the shape of the `emails` table.
+
+    Also stores each folder's sync state (UIDVALIDITY and the highest UID and
+    MODSEQ seen), draft replies in the shape of the `replies` table, and which
+    messages batch jobs have processed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        # Opened, creating the file and tables, by the first call rather than
+        # by the constructor, so that importing a module with a MailCache has
+        # no side effects. Only read with _lock held.
+        if self._connection is None:
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            db.row_factory = sqlite3.Row
+            # Caches created before the threading columns existed get them added.
+            columns = {row[1] for row in db.execute("PRAGMA table_info(emails)")}
+            for column in ("in_reply_to", "reference_ids"):
+                if columns and column not in columns:
+                    db.execute(f"ALTER TABLE emails ADD COLUMN {column} TEXT")
+            db.executescript(SCHEMA)
+            self._connection = db
+        return self._connection
+
+    def folder_state(self, user_id: int, folder: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT uidvalidity, highest_uid, highest_modseq FROM folders WHERE user_id = ? AND folder = ?",
+                (user_id, folder),
+            ).fetchone()
+        return dict(row) if row else None
+
+    def set_folder_state(self, user_id: int, folder: str, uidvalidity: int, highest_uid: int,
+                         highest_modseq: Optional[int]):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO folders VALUES (?, ?, ?, ?, ?)",
+                (user_id, folder, uidvalidity, highest_uid, highest_modseq),
+            )
+
+    def reset_folder(self, user_id: int, folder: str):
+        """Forgets a folder's messages and state, e.g. after its UIDVALIDITY changed."""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM emails WHERE user_id = ? AND folder = ?", (user_id, folder))
+            self._db.execute("DELETE FROM folders WHERE user_id = ? AND folder = ?", (user_id, folder))
+
+    def add(self, user_id: int, folder: str, records: Iterable[Dict[str, Any]]):
+        rows = []
+        for record in records:
+            record = {**record, "user_id": user_id, "folder": folder}
+            for column in JSON_COLUMNS:
+                record[column] = json.dumps(record[column])
+            rows.append(tuple(record[column] for column in COLUMNS))
+        # An upsert rather than INSERT OR REPLACE, which would delete the row
+        # and give it a new id, orphaning the replies and batch items of a
+        # message downloaded again.
+        updates = ", ".join(f"{column} = excluded.{column}" for column in COLUMNS
+                            if column not in ("user_id", "folder", "uid") + LOCAL_COLUMNS)
+        with self._lock, self._db:
+            self._db.executemany(
+                f"INSERT INTO emails ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+                f" ON CONFLICT (user_id, folder, uid) DO UPDATE SET {updates}",
+                rows,
+            )
+
+    def update_flags(self, user_id: int, folder: str, changes: Iterable[Dict[str, Any]]):
+        with self._lock, self._db:
+            self._db.executemany(
+                "UPDATE emails SET is_read = ?, modseq = ? WHERE user_id = ? AND folder = ? AND uid = ?",
+                [(change["is_read"], change["modseq"], user_id, folder, change["uid"]) for change in changes],
+            )
+
+    def remove(self, user_id: int, folder: str, uids: Iterable[int]):
+        with self._lock, self._db:
+            self._db.executemany(
+                "DELETE FROM emails WHERE user_id = ? AND folder = ? AND uid = ?",
+                [(user_id, folder, uid) for uid in uids],
+            )
+
+    def relabel_threads(self, user_id: int, old_thread_ids: Sequence[str], thread_id: str):
+        """Moves the messages of merged threads to the thread they were merged into."""
+        with self._lock, self._db:
+            self._db.executemany(
+                "UPDATE emails SET thread_id = ? WHERE user_id = ? AND thread_id = ?",
+                [(thread_id, user_id, old) for old in old_thread_ids],
+            )
+
+    def count(self, user_id: int, folder: str) -> int:
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM emails WHERE user_id = ? AND folder = ?", (user_id, folder)
+            ).fetchone()[0]
+
+    def uids(self, user_id: int, folder: str) -> List[int]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT uid FROM emails WHERE user_id = ? AND folder = ? ORDER BY uid", (user_id, folder)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def ids(self, user_id: int, folder: str, uids: Iterable[int]) -> List[int]:
+        """Row ids of cached messages, by UID."""
+        uids = list(uids)
+        ids = []
+        with self._lock:
+            # In slices, to stay under SQLite's limit on query parameters.
+            for start in range(0, len(uids), 500):
+                chunk = uids[start:start + 500]
+                ids.extend(row[0] for row in self._db.execute(
+                    f"SELECT id FROM emails WHERE user_id = ? AND folder = ? AND uid IN ({', '.join('?' * len(chunk))})"
+                    " ORDER BY uid",
+                    (user_id, folder, *chunk),
+                ))
+        return ids
+
+    def known_ids(self, user_id: int, ids: Sequence[int]) -> List[int]:
+        """The ids of `ids` that are cached messages of the user, in the order given."""
+        known = set()
+        with self._lock:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                known.update(row[0] for row in self._db.execute(
+                    f"SELECT id FROM emails WHERE user_id = ? AND id IN ({', '.join('?' * len(chunk))})",
+                    (user_id, *chunk),
+                ))
+        return [i for i in ids if i in known]
+
+    def records(self, user_id: int, ids: Sequence[int]) -> List[Dict[str, Any]]:
+        """Cached messages by row id, in the order of `ids`; unknown ids are left out."""
+        by_id = {}
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            for record in self._select(f"WHERE user_id = ? AND id IN ({', '.join('?' * len(chunk))})",
+                                       (user_id, *chunk)):
+                by_id[record["id"]] = record
+        return [by_id[i] for i in ids if i in by_id]
+
+    def create_job(self, job_id: str, user_id: int, email_ids: Sequence[int], source: str):
+        """Records a batch job over some cached messages; `source` says how they were picked."""
+        with self._lock, self._db:
+            self._db.execute("INSERT INTO batch_jobs VALUES (?, ?, ?, ?)", (job_id, user_id, time.time(), source))
+            self._db.executemany(
+                "INSERT OR IGNORE INTO batch_items (job_id, email_id) VALUES (?, ?)",
+                [(job_id, email_id) for email_id in email_ids],
+            )
+
+    def drop_items(self, job_id: str, email_ids: Iterable[int]):
+        """Takes messages out of a batch job, e.g. ones removed from the cache since it was created."""
+        with self._lock, self._db:
+            self._db.executemany(
+                "DELETE FROM batch_items WHERE job_id = ? AND email_id = ?",
+                [(job_id, email_id) for email_id in email_ids],
+            )
+
+    def job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """A batch job's owner and source, with its number of messages and of those done."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT j.id, j.user_id, j.created_at, j.source, COUNT(i.email_id) AS total,"
+                " COALESCE(SUM(i.done), 0) AS done"
+                " FROM batch_jobs j LEFT JOIN batch_items i ON i.job_id = j.id WHERE j.id = ? GROUP BY j.id",
+                (job_id,),
+            ).fetchone()
+        return dict(row) if row else None
+
+    def pending_items(self, job_id: str) -> List[int]:
+        """Ids of the messages a batch job hasn't processed yet."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT email_id FROM batch_items WHERE job_id = ? AND done = 0 ORDER BY email_id", (job_id,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def save_results(self, job_id: str, user_id: int, results: Iterable[Dict[str, Any]]):
+        """
+        Writes the labels and draft replies of processed messages and marks
+        them done, in one transaction, so a resumed job neither loses nor
+        repeats any of them.
+
+        Args:
+            results: Dicts with the message's `email_id`, its `labels` and the
+                reply's `subject` and `content`.
+        """
+        results = list(results)
+        with self._lock, self._db:
+            self._db.executemany(
+                "UPDATE emails SET labels = ? WHERE user_id = ? AND id = ?",
+                [(json.dumps(r["labels"]), user_id, r["email_id"]) for r in results],
+            )
+            self._db.executemany(
+                "INSERT INTO replies (email_id, content, subject) VALUES (?, ?, ?)",
+                [(r["email_id"], r["content"], r["subject"]) for r in results],
+            )
+            self._db.executemany(
+                "UPDATE batch_items SET done = 1 WHERE job_id = ? AND email_id = ?",
+                [(job_id, r["email_id"]) for r in results],
+            )
+
+    def replies(self, email_id: int) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM replies WHERE email_id = ? ORDER BY id", (email_id,)).fetchall()
+        return [{**dict(row), "is_draft": bool(row["is_draft"])} for row in rows]
+
+    def latest_replies(self, user_id: int, n: int, folder: str = "INBOX") -> List[Dict[str, Any]]:
+        """
+        The last n cached messages with 'Re:' or 'R:' in the subject, in
+        mailbox order; the local equivalent of SEARCH OR SUBJECT "Re:" SUBJECT "R:".
+        """
+        records = self._select(
+            "WHERE user_id = ? AND folder = ? AND (subject LIKE '%Re:%' OR subject LIKE '%R:%')"
+            " ORDER BY uid DESC LIMIT ?",
+            (user_id, folder, n),
+        )
+        return records[::-1]
+
+    def thread(self, user_id: int, thread_id: str) -> List[Dict[str, Any]]:
+        """The messages of a thread in all folders, oldest first; what /api/threads/:threadId returns."""
+        return self._select("WHERE user_id = ? AND thread_id = ? ORDER BY timestamp, id", (user_id, thread_id))
+
+    def threading_records(self, user_id: int) -> List[Dict[str, Any]]:
+        """The threading headers of all cached messages, in the order they were added."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT folder, uid, message_id, in_reply_to, reference_ids, subject, timestamp"
+                " FROM emails WHERE user_id = ? ORDER BY id",
+                (user_id,),
+            ).fetchall()
+        return [
+            {
+                "message_id": row["message_id"] or local_message_id(row["folder"], row["uid"]),
+                "in_reply_to": json.loads(row["in_reply_to"] or "[]"),
+                "references": json.loads(row["reference_ids"] or "[]"),
+                "subject": row["subject"],
+                "timestamp": row["timestamp"],
+            }
+            for row in rows
+        ]
+
+    def _select(self, clause: str, params: Sequence[Any]) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._db.execute(f"SELECT * FROM emails {clause}", params).fetchall()
+        records = []
+        for row in rows:
+            record = dict(row)
+            for column in JSON_COLUMNS:
+                record[column] = json.loads(record[column]) if record[column] else []
+            record["is_read"] = bool(record["is_read"])
+            records.append(record)
+        return records
+
+
+class MailboxSync:
+    """
+    Incremental sync of IMAP folders into a MailCache.
+
+    Each sync SELECTs the folder and compares its UIDVALIDITY with the cached
+    one; if it changed, the folder's cache is dropped. Otherwise only messages
+    with a UID above the highest cached one are downloaded, flag changes are
+    fetched with CHANGEDSINCE when the server supports CONDSTORE, and
+    expunged messages are looked for only when the message count doesn't add
+    up. The cost of a sync therefore grows with new mail, not with the size
+    of the folder.
+
+    Attributes:
+        cache: Where messages and folder state are stored.
+        user_id: Owner of the synced messages.
+        batch_size: Messages downloaded per FETCH.
+        spool_dir: Where attachments are written; when None they are skipped.
+        threads: Threading of the user's messages, rebuilt from the cache on
+            first use and extended as messages arrive; sets their thread_id.
+
+    Syncs of the same user's folder are serialised, also across instances
+    sharing a process, so concurrent callers never download the same new
+    messages twice.
+    """
+
+    _folder_locks: Dict[Tuple[int, str], threading.RLock] = {}
+    _folder_locks_lock = threading.Lock()
+
+    def __init__(self, cache: MailCache, user_id: int = 1, batch_size: int = 200, spool_dir: Optional[str] = None):
+        self.cache = cache
+        self.user_id = user_id
+        self.batch_size = batch_size
+        self.spool_dir = spool_dir
+        self._threads: Optional[ThreadIndex] = None
+        # Syncs of different folders share the thread index.
+        self._threads_lock = threading.Lock()
+        self._synced_at: Dict[str, float] = {}
+
+    @property
+    def threads(self) -> ThreadIndex:
+        with self._threads_lock:
+            if self._threads is None:
+                self._threads = ThreadIndex.from_records(self.cache.threading_records(self.user_id))
+            return self._threads
+
+    def folder_lock(self, folder: str) -> threading.RLock:
+        """The lock held while the user's folder is synced."""
+        with self._folder_locks_lock:
+            return self._folder_locks.setdefault((self.user_id, folder), threading.RLock())
+
+    def refresh(self, pool: ImapConnectionPool, folder: str = "INBOX", max_age: float = 0) -> Optional[Dict[str, int]]:
+        """
+        Syncs a folder over a pooled connection unless it was synced less than
+        max_age seconds ago, e.g. by a concurrent call this one waited for.
+        """
+        with self.folder_lock(folder):
+            if time.monotonic() - self._synced_at.get(folder, float("-inf")) < max_age:
+                return None
+            with pool.connection() as conn:
+                counts = self.sync(conn, folder)
+            self._synced_at[folder] = time.monotonic()
+            return counts
+
+    def sync(self, conn: imaplib.IMAP4, folder: str = "INBOX") -> Dict[str, int]:
+        """
+        Brings the cached copy of a folder up to date.
+
+        Returns:
+            Counts of added, updated and removed messages.
+        """
+        with self.folder_lock(folder):
+            return self._sync(conn, folder)
+
+    def _sync(self, conn: imaplib.IMAP4, folder: str) -> Dict[str, int]:
+        typ, data = conn.select(folder, readonly=True)
+        if typ != "OK":
+            raise imaplib.IMAP4.error(f"SELECT {folder} failed: {data}")
+        conn._selected_mailbox = (folder, True)
+        exists = int(data[0])
+        uidvalidity = int(conn.response("UIDVALIDITY")[1][0])
+        modseq_response = conn.response("HIGHESTMODSEQ")[1]
+        highest_modseq = int(modseq_response[0]) if modseq_response and modseq_response[0] else None
+        condstore = highest_modseq is not None and "CONDSTORE" in conn.capabilities
+
+        state = self.cache.folder_state(self.user_id, folder)
+        if state is None or state["uidvalidity"] != uidvalidity:
+            self.cache.reset_folder(self.user_id, folder)
+            state = {"uidvalidity": uidvalidity, "highest_uid": 0, "highest_modseq": None}
+        highest_uid = state["highest_uid"]
+
+        updated = 0
+        if highest_uid and (not condstore or not state["highest_modseq"] or highest_modseq > state["highest_modseq"]):
+            # Without CONDSTORE the only way to see flag changes is to refetch them all.
+            changes = self._fetch_flags(conn, f"1:{highest_uid}", condstore, state["highest_modseq"])
+            self.cache.update_flags(self.user_id, folder, changes)
+            updated = len(changes)
+
+        new_uids = [uid for uid in self._search_uids(conn, f"UID {highest_uid + 1}:*") if uid > highest_uid]
+        for start in range(0, len(new_uids), self.batch_size):
+            batch = new_uids[start:start + self.batch_size]
+            records = self._fetch_messages(conn, batch, condstore)
+            merged = self._thread(folder, records)
+            self.cache.add(self.user_id, folder, records)
+            for thread_id, old_thread_ids in merged.items():
+                self.cache.relabel_threads(self.user_id, old_thread_ids, thread_id)
+
+        removed = 0
+        if self.cache.count(self.user_id, folder) != exists:
+            on_server = set(self._search_uids(conn, "ALL"))
+            gone = [uid for uid in self.cache.uids(self.user_id, folder) if uid not in on_server]
+            self.cache.remove(self.user_id, folder, gone)
+            removed = len(gone)
+
+        self.cache.set_folder_state(
+            self.user_id, folder, uidvalidity, max(new_uids, default=highest_uid), highest_modseq
+        )
+        return {"added": len(new_uids), "updated": updated, "removed": removed}
+
+    def _thread(self, folder: str, records: List[Dict[str, Any]]) -> Dict[str, List[str]]:
+        """Sets the records' thread_id; returns the threads merged into each thread by them."""
+        merged: Dict[str, List[str]] = {}
+        keys = []
+        threads = self.threads
+        with self._threads_lock:
+            for record in records:
+                key = record["message_id"] or local_message_id(folder, record["uid"])
+                thread_id, old_thread_ids = threads.add(
+                    key, record["in_reply_to"], record["reference_ids"], record["subject"], record["timestamp"]
+                )
+                merged.setdefault(thread_id, []).extend(old_thread_ids)
+                keys.append(key)
+            # A later record of the batch may have merged the thread of an earlier one.
+            for record, key in zip(records, keys):
+                record["thread_id"] = threads.thread_of(key)
+        return {thread_id: old for thread_id, old in merged.items() if old}
+
+    @staticmethod
+    def _search_uids(conn: imaplib.IMAP4, criteria: str) -> List[int]:
+        with span("imap", command="UID SEARCH"):
+            typ, data = conn.uid("SEARCH", None, criteria)
+        if typ != "OK":
+            raise imaplib.IMAP4.error(f"UID SEARCH failed: {data}")
+        return [int(uid) for uid in data[0].split()]
+
+    @staticmethod
+    def _fetch_flags(conn: imaplib.IMAP4, uid_set: str, condstore: bool,
+                     changed_since: Optional[int] = None) -> List[Dict[str, Any]]:
+        if not condstore:
+            args = ["(UID FLAGS)"]
+        elif changed_since:
+            args = ["(UID FLAGS MODSEQ)", f"(CHANGEDSINCE {changed_since})"]
+        else:
+            args = ["(UID FLAGS MODSEQ)"]
+        with span("imap", command="UID FETCH"):
+            typ, data = conn.uid("FETCH", uid_set, *args)
+        if typ != "OK":
+            raise imaplib.IMAP4.error(f"UID FETCH failed: {data}")
+        changes = []
+        for item in data:
+            if not isinstance(item, bytes) or not FETCH_UID.search(item):
+                continue
+            flags = FETCH_FLAGS.search(item)
+            modseq = FETCH_MODSEQ.search(item)
+            changes.append({
+                "uid": int(FETCH_UID.search(item).group(1)),
+                "is_read": bool(flags) and b"\\Seen" in flags.group(1).split(),
+                "modseq": int(modseq.group(1)) if modseq else None,
+            })
+        return changes
+
+    def _fetch_messages(self, conn: imaplib.IMAP4, uids: Sequence[int], condstore: bool) -> List[Dict[str, Any]]:
+        records = []
+        for meta, parsed in stream_messages(conn, uids, "UID FLAGS MODSEQ" if condstore else "UID FLAGS",
+                                            spool_dir=self.spool_dir):
+            flags = FETCH_FLAGS.search(meta)
+            modseq = FETCH_MODSEQ.search(meta)
+            records.append(email_record(
+                parsed,
+                int(FETCH_UID.search(meta).group(1)),
+                flags.group(1).split() if flags else (),
+                int(modseq.group(1)) if modseq else None,
+            ))
+        return records
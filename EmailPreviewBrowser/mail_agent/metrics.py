@@ -0,0 +1,220 @@
+import bisect
+import functools
+import inspect
+import math
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Sequence, Tuple
+
+# Upper bounds in seconds, from a search of a small loaded index up to a slow
+# IMAP sync or LLM call.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Help text of the spans timed across the agent; see `span`.
+SPANS = {
+    "agent_run": "Seconds to produce an agent reply, from Agent.run or run_stream.",
+    "classify": "Seconds spent classifying emails.",
+    "tool_run": "Seconds spent in tool calls.",
+    "index_load": "Seconds to load or build a user's document index.",
+    "vectorize": "Seconds to turn queries into vectors.",
+    "score": "Seconds to score and rank documents against query vectors.",
+    "imap": "Seconds per IMAP round trip.",
+}
+
+Sample = Tuple[str, Tuple[str, ...], Tuple[Tuple[str, str], ...], float]
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    """A count that only goes up, per combination of label values."""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield "", key, (), value
+
+
+class Histogram:
+    """
+    Observations counted into fixed buckets, with their sum and count, per
+    combination of label values. Observing is a bisect and three additions
+    under a lock.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label values: a count per bucket plus one for +Inf, then the sum.
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bucket] += 1
+            series[-1] += value
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), series):
+                cumulative += count
+                yield "_bucket", key, (("le", _number(bound)),), cumulative
+            yield "_sum", key, (), series[-1]
+            yield "_count", key, (), cumulative
+
+
+class Gauge:
+    """A value read from `func` whenever the metrics are rendered."""
+
+    type = "gauge"
+    labelnames = ()
+
+    def __init__(self, name: str, help: str, func: Callable[[], float]):
+        self.name = name
+        self.help = help
+        self.func = func
+
+    def samples(self) -> Iterator[Sample]:
+        yield "", (), (), self.func()
+
+
+class Registry:
+    """The metrics of a process, by name, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name: str, *args):
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.setdefault(name, cls(name, *args))
+        if not isinstance(metric, cls):
+            raise ValueError(f"{name} is already registered as a {metric.type}")
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        """The counter called `name`, registered on first use."""
+        return self._get(Counter, name, help, labelnames)
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        """The histogram called `name`, registered on first use."""
+        return self._get(Histogram, name, help, labelnames, buckets)
+
+    def gauge(self, name: str, help: str, func: Callable[[], float]) -> Gauge:
+        """Registers a gauge read from `func`, replacing any earlier one of that name."""
+        with self._lock:
+            gauge = self._metrics[name] = Gauge(name, help, func)
+        return gauge
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        for name, metric in metrics:
+            lines.append(f"# HELP {name} {_escape(metric.help)}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            for suffix, key, extra, value in metric.samples():
+                pairs = [*zip(metric.labelnames, key), *extra]
+                labels = "{" + ",".join(f'{label}="{_escape(v)}"' for label, v in pairs) + "}" if pairs else ""
+                lines.append(f"{name}{suffix}{labels} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+_span_histograms: Dict[str, Histogram] = {}
+
+
+class span:
+    """
+    Times a block into the `<name>_seconds` histogram of REGISTRY, with the
+    given labels; blocks that raise are also counted in `<name>_errors_total`.
+    Every span of a name must be given the same label names.
+
+        with span("index_load", source="disk"):
+            index = DocumentIndex.load(index_dir)
+
+    Metrics live in the process that records them, so calls run on a
+    process pool (AGENT_POOL=process) aren't seen by the server's /metrics.
+    """
+
+    __slots__ = ("name", "labels", "start")
+
+    def __init__(self, name: str, **labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self) -> "span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        histogram = _span_histograms.get(self.name)
+        if histogram is None:
+            histogram = _span_histograms[self.name] = REGISTRY.histogram(
+                f"{self.name}_seconds", SPANS.get(self.name, f"Seconds spent in {self.name}."), tuple(self.labels))
+        histogram.observe(seconds, **self.labels)
+        if exc_type is not None and issubclass(exc_type, Exception):
+            REGISTRY.counter(f"{self.name}_errors_total", f"Errors raised in {self.name}.",
+                             tuple(self.labels)).inc(**self.labels)
+        return False
+
+
+def timed(name: str, **labels):
+    """
+    Decorator running the function in a `span`. A generator function is
+    timed from its first item until it is exhausted or closed.
+    """
+    def decorator(func):
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator(*args, **kwargs):
+                with span(name, **labels):
+                    yield from func(*args, **kwargs)
+            return generator
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,312 @@
+import binascii
+import codecs
+import imaplib
+import os
+import re
+import tempfile
+from email.feedparser import BytesFeedParser
+from email.message import Message
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from .imap import message_set
+from .metrics import span
+
+HTML_TAG = re.compile(r"<[^>]+>")
+WHITESPACE = re.compile(r"\s+")
+FETCH_UID = re.compile(rb"UID (\d+)")
+FETCH_SIZE = re.compile(rb"RFC822\.SIZE (\d+)")
+PREVIEW_CHARS = 100
+WRITE_BYTES = 64 * 1024
+
+
+class ParsedMessage(NamedTuple):
+    """A message parsed by `parse_message`."""
+    headers: Message
+    text_preview: str
+    body: str
+    attachments: List[Dict[str, Any]]
+
+
+def iter_lines(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Re-splits a stream of byte chunks of any size into lines, keeping their line endings."""
+    pending: List[bytes] = []
+    for chunk in chunks:
+        start = 0
+        end = chunk.find(b"\n")
+        while end != -1:
+            if pending:
+                pending.append(chunk[start:end + 1])
+                yield b"".join(pending)
+                pending = []
+            else:
+                yield chunk[start:end + 1]
+            start = end + 1
+            end = chunk.find(b"\n", start)
+        if start < len(chunk):
+            pending.append(chunk[start:])
+    if pending:
+        yield b"".join(pending)
+
+
+class _Base64Decoder:
+    def __init__(self):
+        self._rest = b""
+
+    def __call__(self, lines: bytes) -> bytes:
+        data = self._rest + lines.translate(None, b" \t\r\n")
+        usable = len(data) - len(data) % 4
+        self._rest = data[usable:]
+        try:
+            return binascii.a2b_base64(data[:usable])
+        except binascii.Error:
+            return b""
+
+
+def _transfer_decoder(encoding: str):
+    encoding = (encoding or "7bit").strip().lower()
+    if encoding == "base64":
+        return _Base64Decoder()
+    if encoding == "quoted-printable":
+        return binascii.a2b_qp
+    return lambda line: line
+
+
+class _TextSink:
+    """Decodes a text part incrementally, keeping at most max_chars of it."""
+
+    def __init__(self, part: Message, max_chars: int):
+        charset = part.get_content_charset() or "utf-8"
+        try:
+            self._decoder = codecs.getincrementaldecoder(charset)(errors="replace")
+        except LookupError:
+            self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._pieces: List[str] = []
+        self._room = max_chars
+
+    def write(self, data: bytes):
+        if self._room <= 0:
+            return
+        text = self._decoder.decode(data)[:self._room]
+        self._pieces.append(text)
+        self._room -= len(text)
+
+    def close(self) -> str:
+        if self._room > 0:
+            self._pieces.append(self._decoder.decode(b"", final=True)[:self._room])
+        return "".join(self._pieces)
+
+
+class _AttachmentSink:
+    """Counts an attachment's bytes and, given a spool directory, writes them to a file there."""
+
+    def __init__(self, part: Message, spool_dir: Optional[str]):
+        self.info: Dict[str, Any] = {
+            "filename": part.get_filename(),
+            "content_type": part.get_content_type(),
+            "size": 0,
+            "path": None,
+        }
+        self._file: Optional[BinaryIO] = None
+        if spool_dir:
+            fd, self.info["path"] = tempfile.mkstemp(dir=spool_dir, prefix="attachment-")
+            self._file = os.fdopen(fd, "wb")
+
+    def write(self, data: bytes):
+        self.info["size"] += len(data)
+        if self._file:
+            self._file.write(data)
+
+    def close(self) -> Dict[str, Any]:
+        if self._file:
+            self._file.close()
+        return self.info
+
+
+class _StreamParser:
+    def __init__(self, lines: Iterator[bytes], spool_dir: Optional[str], max_body_chars: int):
+        self.lines = lines
+        self.spool_dir = spool_dir
+        self.max_body_chars = max_body_chars
+        self.plain: Optional[str] = None
+        self.html: Optional[str] = None
+        self.attachments: List[Dict[str, Any]] = []
+
+    def headers(self) -> Message:
+        parser = BytesFeedParser()
+        for line in self.lines:
+            parser.feed(line)
+            if line in (b"\r\n", b"\n"):
+                break
+        return parser.close()
+
+    def entity(self, boundaries: Tuple[bytes, ...]) -> Tuple[Message, Optional[bytes]]:
+        """
+        Parses one entity whose header is next in the stream.
+
+        Returns its headers and the boundary line that ended it, or None at
+        the end of the stream.
+        """
+        part = self.headers()
+        boundary = part.get_boundary() if part.get_content_maintype() == "multipart" else None
+        if boundary is None:
+            return part, self.leaf(part, boundaries)
+
+        inner = ("--" + boundary).encode("ascii", "replace")
+        end = self.skip_to(boundaries + (inner,))
+        while end is not None and end.rstrip() == inner:
+            _, end = self.entity(boundaries + (inner,))
+        if end is not None and end.rstrip() == inner + b"--":
+            # Skip the epilogue up to the enclosing boundary.
+            end = self.skip_to(boundaries)
+        return part, end
+
+    def skip_to(self, boundaries: Tuple[bytes, ...]) -> Optional[bytes]:
+        for line in self.lines:
+            if self.is_boundary(line, boundaries):
+                return line
+        return None
+
+    @staticmethod
+    def is_boundary(line: bytes, boundaries: Tuple[bytes, ...]) -> bool:
+        if not line.startswith(b"--"):
+            return False
+        line = line.rstrip()
+        return any(line == b or line == b + b"--" for b in boundaries)
+
+    def leaf(self, part: Message, boundaries: Tuple[bytes, ...]) -> Optional[bytes]:
+        is_text = (part.get_content_type() in ("text/plain", "text/html")
+                   and part.get_content_disposition() != "attachment")
+        if is_text and (self.plain is None if part.get_content_type() == "text/plain" else self.html is None):
+            sink = _TextSink(part, self.max_body_chars)
+        else:
+            sink = _AttachmentSink(part, self.spool_dir) if not is_text else None
+        decode = _transfer_decoder(part.get("Content-Transfer-Encoding"))
+
+        # Lines are decoded in batches of about WRITE_BYTES, which is much
+        # faster than decoding them one by one.
+        end, batch, batch_bytes = None, [], 0
+        for line in self.lines:
+            if self.is_boundary(line, boundaries):
+                end = line
+                break
+            if sink is None:
+                continue
+            batch.append(line)
+            batch_bytes += len(line)
+            if batch_bytes >= WRITE_BYTES:
+                last = batch.pop()
+                sink.write(decode(b"".join(batch)))
+                batch, batch_bytes = [last], len(last)
+        if batch:
+            if end is not None:
+                # The line break before a boundary belongs to the boundary.
+                batch[-1] = batch[-1].rstrip(b"\r\n")
+            sink.write(decode(b"".join(batch)))
+
+        if isinstance(sink, _TextSink):
+            text = sink.close()
+            if part.get_content_type() == "text/plain":
+                self.plain = text
+            else:
+                self.html = HTML_TAG.sub(" ", text)
+        elif sink:
+            self.attachments.append(sink.close())
+        return end
+
+
+def parse_message(chunks: Iterable[bytes], spool_dir: Optional[str] = None, max_body_chars: int = 1_000_000,
+                  preview_chars: int = PREVIEW_CHARS) -> ParsedMessage:
+    """
+    Parses a raw RFC 822 message from a stream of byte chunks in bounded memory.
+
+    Headers are parsed with BytesFeedParser before any of the body is read.
+    Text parts are decoded incrementally and capped at max_body_chars;
+    attachments are decoded straight into files in spool_dir, or only counted
+    when it is None, so they are never held in memory.
+
+    Args:
+        chunks: The message, e.g. read from a file or fetched in pieces.
+        spool_dir: Directory attachments are written to.
+        max_body_chars: Text kept of the body.
+        preview_chars: Length of the whitespace-collapsed preview.
+    """
+    parser = _StreamParser(iter_lines(chunks), spool_dir, max_body_chars)
+    headers, _ = parser.entity(())
+    body = parser.plain if parser.plain is not None else parser.html or ""
+    preview = WHITESPACE.sub(" ", body[:preview_chars * 4]).strip()[:preview_chars]
+    return ParsedMessage(headers, preview, body, parser.attachments)
+
+
+def parse_messages(sources: Iterable[Iterable[bytes]], **kwargs) -> Iterator[ParsedMessage]:
+    """Parses each message of a stream of messages; see `parse_message` for the options."""
+    for chunks in sources:
+        yield parse_message(chunks, **kwargs)
+
+
+def read_chunks(stream: BinaryIO, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """Reads a binary file in chunks, for `parse_message`."""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def fetch_chunks(conn: imaplib.IMAP4, uid: int, start: int = 0, chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+    """Downloads a message in pieces with partial FETCHes of BODY.PEEK[]<start.chunk_size>."""
+    while True:
+        with span("imap", command="UID FETCH"):
+            typ, data = conn.uid("FETCH", str(uid), f"(BODY.PEEK[]<{start}.{chunk_size}>)")
+        if typ != "OK":
+            raise imaplib.IMAP4.error(f"UID FETCH failed: {data}")
+        chunk = next((item[1] for item in data if isinstance(item, tuple)), b"")
+        if chunk:
+            yield chunk
+        if len(chunk) < chunk_size:
+            return
+        start += chunk_size
+
+
+def stream_messages(conn: imaplib.IMAP4, uids: Sequence[int], items: str = "UID", inline_bytes: int = 64 * 1024,
+                    chunk_size: int = 1024 * 1024, **kwargs) -> Iterator[Tuple[bytes, ParsedMessage]]:
+    """
+    Fetches and parses messages without holding any of them whole in memory.
+
+    One FETCH returns the first `inline_bytes` of every message, which is all
+    of most messages; larger ones are then streamed with partial FETCHes.
+
+    Args:
+        conn: Connection with a mailbox selected.
+        uids: UIDs of the messages.
+        items: Further FETCH items, e.g. "UID FLAGS MODSEQ".
+        inline_bytes: Bytes of each message fetched in the first round trip.
+        chunk_size: Size of the partial FETCHes for the rest.
+        **kwargs: Options of `parse_message`.
+
+    Yields:
+        The FETCH response metadata (the line holding `items`) and the parsed message.
+    """
+    if not uids:
+        return
+    with span("imap", command="UID FETCH"):
+        typ, data = conn.uid("FETCH", message_set(uids), f"({items} RFC822.SIZE BODY.PEEK[]<0.{inline_bytes}>)")
+    if typ != "OK":
+        raise imaplib.IMAP4.error(f"UID FETCH failed: {data}")
+    for i, item in enumerate(data):
+        if not isinstance(item, tuple):
+            continue
+        meta, head = item
+        # Some servers send the items following the body after its literal.
+        if i + 1 < len(data) and isinstance(data[i + 1], bytes):
+            meta += data[i + 1]
+        size = int(FETCH_SIZE.search(meta).group(1))
+        chunks: Iterable[bytes] = [head]
+        if size > len(head):
+            uid = int(FETCH_UID.search(meta).group(1))
+            chunks = _chain(head, fetch_chunks(conn, uid, len(head), chunk_size))
+        yield meta, parse_message(chunks, **kwargs)
+
+
+def _chain(first: bytes, rest: Iterable[bytes]) -> Iterator[bytes]:
+    yield first
+    yield from rest
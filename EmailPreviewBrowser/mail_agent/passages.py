@@ -0,0 +1,382 @@
+import json
+import os
+import pickle
+import shutil
+import tempfile
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from sklearn.feature_extraction.text import HashingVectorizer
+
+from .metrics import span
+from .retrieval import ExactScorer
+from .shards import mark_changed
+
+CHUNK_CHARS = 1000
+OVERLAP_CHARS = 200
+# Extracted PDF text separates pages with form feeds; without them, pages are
+# estimated at this many characters.
+PAGE_CHARS = 3000
+N_FEATURES = 2 ** 20
+META_FILE = "meta.pkl"
+# Raw little-endian arrays of a saved passage index, memory-mapped on load.
+ARRAYS = {
+    "data": np.float32,      # L2-normalised TF-IDF weights of the CSR matrix
+    "indices": np.int32,     # term ids of the CSR matrix, positions in meta["columns"]
+    "indptr": np.int64,      # CSR row pointers, one row per passage
+    "document": np.int32,    # position in `documents` of each passage's document
+    "start": np.int64,       # character offsets of each passage in the document's content
+    "end": np.int64,
+    "page": np.int32,
+    "text_offsets": np.int64,  # byte offsets of each passage's text in text.bin
+}
+
+
+class Passage(NamedTuple):
+    start: int
+    end: int
+    page: int
+    text: str
+
+
+def chunk_text(text: str, chunk_chars: int = CHUNK_CHARS, overlap: int = OVERLAP_CHARS) -> Iterator[Passage]:
+    """
+    Splits text into passages of about chunk_chars, each overlapping the
+    previous one by about `overlap`. Passages end at a page break if there
+    is one, so they don't span pages, or else at a line break or a space.
+    """
+    has_pages = "\f" in text
+    page, counted_to = 1, 0
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_chars, len(text))
+        next_start = None
+        page_break = text.find("\f", start + 1, end)
+        if page_break != -1:
+            end, next_start = page_break, page_break + 1
+        elif end < len(text):
+            for separator in ("\n", " "):
+                cut = text.rfind(separator, start + chunk_chars // 2, end)
+                if cut != -1:
+                    end = cut
+                    break
+        if has_pages:
+            page += text.count("\f", counted_to, start)
+            counted_to = start
+        else:
+            page = start // PAGE_CHARS + 1
+        yield Passage(start, end, page, text[start:end])
+        if next_start is None:
+            if end >= len(text):
+                return
+            next_start = max(end - overlap, start + 1)
+            space = text.find(" ", next_start, end)
+            next_start = space + 1 if space != -1 else next_start
+        start = next_start
+
+
+def highlight(document: Dict[str, Any], passage: Passage, score: float) -> Dict[str, Any]:
+    """A passage as an entry of the `highlights` table, plus its offsets and score."""
+    return {
+        "documentId": document.get("id"),
+        "title": document.get("name", ""),
+        "content": passage.text.replace("\f", "\n").strip(),
+        "page": passage.page,
+        "start": passage.start,
+        "end": passage.end,
+        "score": round(score, 4),
+    }
+
+
+def _vectorizer() -> HashingVectorizer:
+    return HashingVectorizer(n_features=N_FEATURES, alternate_sign=False, norm=None, dtype=np.float32)
+
+
+class PassageIndexWriter:
+    """
+    Builds a passage index on disk from a stream of documents.
+
+    Documents are chunked as they are added, and every `batch_passages`
+    passages are hash-vectorised and appended to the index files, so only
+    one batch of text is ever in memory. Hashing needs no vocabulary fitted
+    up front; document frequencies are counted along the way and the idf
+    weighting and L2 normalisation are applied by `close`, which streams
+    over the written matrix in blocks.
+    """
+
+    def __init__(self, index_dir: str, chunk_chars: int = CHUNK_CHARS, overlap: int = OVERLAP_CHARS,
+                 batch_passages: int = 4096):
+        self.index_dir = index_dir
+        self.chunk_chars = chunk_chars
+        self.overlap = overlap
+        self.batch_passages = batch_passages
+        self._tmp_dir = index_dir + ".tmp"
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+        os.makedirs(self._tmp_dir)
+        self._files = {name: open(self._path(name), "wb") for name in ARRAYS}
+        self._text = open(self._path("text"), "wb")
+        self._vectorizer = _vectorizer()
+        self._df = np.zeros(N_FEATURES, dtype=np.int32)
+        self._documents: List[Dict[str, Any]] = []
+        self._batch: List[Tuple[int, Passage]] = []
+        self._nnz = 0
+        self._text_bytes = 0
+        self.n_passages = 0
+        self._files["indptr"].write(np.zeros(1, dtype=np.int64).tobytes())
+        self._files["text_offsets"].write(np.zeros(1, dtype=np.int64).tobytes())
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self._tmp_dir, f"{name}.bin")
+
+    def add(self, document: Dict[str, Any]):
+        """Chunks a document; documents without content are skipped."""
+        if not isinstance(document, dict) or not document.get("content"):
+            return
+        # Only the metadata is kept; passages carry the text.
+        self._documents.append({key: value for key, value in document.items() if key != "content"})
+        position = len(self._documents) - 1
+        for passage in chunk_text(document["content"], self.chunk_chars, self.overlap):
+            self._batch.append((position, passage))
+            if len(self._batch) >= self.batch_passages:
+                self._flush()
+
+    def _flush(self):
+        if not self._batch:
+            return
+        counts = self._vectorizer.transform([passage.text for _, passage in self._batch]).tocsr()
+        counts.sum_duplicates()
+        counts.data = 1 + np.log(counts.data)  # sublinear tf
+        self._df += np.bincount(counts.indices, minlength=N_FEATURES).astype(np.int32)
+
+        self._files["data"].write(counts.data.astype(np.float32).tobytes())
+        self._files["indices"].write(counts.indices.astype(np.int32).tobytes())
+        self._files["indptr"].write((counts.indptr[1:] + self._nnz).astype(np.int64).tobytes())
+        self._nnz += counts.nnz
+
+        texts = [passage.text.encode("utf-8") for _, passage in self._batch]
+        offsets = self._text_bytes + np.cumsum([len(text) for text in texts], dtype=np.int64)
+        self._text.write(b"".join(texts))
+        self._text_bytes = int(offsets[-1])
+        self._files["text_offsets"].write(offsets.tobytes())
+
+        for name, values in (
+            ("document", [position for position, _ in self._batch]),
+            ("start", [passage.start for _, passage in self._batch]),
+            ("end", [passage.end for _, passage in self._batch]),
+            ("page", [passage.page for _, passage in self._batch]),
+        ):
+            self._files[name].write(np.asarray(values, dtype=ARRAYS[name]).tobytes())
+        self.n_passages += len(self._batch)
+        self._batch = []
+
+    def close(self, block_rows: int = 8192, scorer=None) -> "PassageIndex":
+        """
+        Weights and normalises the written matrix, moves the index into place and opens it.
+
+        The hashed term ids are renumbered to the terms that occur, so the
+        matrix is only as wide as the vocabulary.
+        """
+        self._flush()
+        for f in list(self._files.values()) + [self._text]:
+            f.close()
+
+        n = self.n_passages
+        columns = np.flatnonzero(self._df).astype(np.int32)
+        idf = (np.log((1 + n) / (1 + self._df[columns])) + 1).astype(np.float32)
+        if self._nnz:
+            column_of = np.zeros(N_FEATURES, dtype=np.int32)
+            column_of[columns] = np.arange(len(columns), dtype=np.int32)
+            data = np.memmap(self._path("data"), dtype=np.float32, mode="r+")
+            indices = np.memmap(self._path("indices"), dtype=np.int32, mode="r+")
+            indptr = np.fromfile(self._path("indptr"), dtype=np.int64)
+            for first in range(0, n, block_rows):
+                last = min(first + block_rows, n)
+                lo, hi = indptr[first], indptr[last]
+                block_columns = column_of[indices[lo:hi]]
+                weights = data[lo:hi] * idf[block_columns]
+                squares = np.concatenate([[0], np.cumsum(weights.astype(np.float64) ** 2)])
+                bounds = indptr[first:last + 1] - lo
+                norms = np.sqrt(squares[bounds[1:]] - squares[bounds[:-1]])
+                norms[norms == 0] = 1
+                rows = np.repeat(np.arange(last - first), np.diff(bounds))
+                data[lo:hi] = weights / norms[rows]
+                indices[lo:hi] = block_columns
+            data.flush()
+            indices.flush()
+            del data, indices
+
+        with open(os.path.join(self._tmp_dir, META_FILE), "wb") as f:
+            pickle.dump({"n_passages": n, "nnz": self._nnz, "columns": columns, "idf": idf,
+                         "documents": self._documents,
+                         "chunk_chars": self.chunk_chars, "overlap": self.overlap},
+                        f, protocol=pickle.HIGHEST_PROTOCOL)
+        shutil.rmtree(self.index_dir, ignore_errors=True)
+        os.replace(self._tmp_dir, self.index_dir)
+        return PassageIndex.load(self.index_dir, scorer=scorer)
+
+
+class PassageIndex:
+    """
+    TF-IDF index of overlapping passages of the documents' content.
+
+    A search scores every passage, ranks documents by their best passage,
+    and returns each document's metadata with its best passages as
+    highlights, instead of the whole content, so a long file and a short
+    note compete on their best matching passage and the agent only receives
+    the relevant parts of each.
+
+    Built with PassageIndexWriter; all arrays are memory-mapped.
+
+    Attributes:
+        documents: Metadata (everything but the content) of the indexed documents.
+        matrix: CSR matrix of L2-normalised passage vectors.
+    """
+
+    def __init__(self, index_dir: str, meta: Dict[str, Any], arrays: Dict[str, np.ndarray], text: np.ndarray,
+                 scorer=None):
+        self.index_dir = index_dir
+        self.documents = meta["documents"]
+        self.columns = meta["columns"]
+        self.idf = meta["idf"]
+        self.arrays = arrays
+        self.text = text
+        self.matrix = csr_matrix((arrays["data"], arrays["indices"], arrays["indptr"]),
+                                 shape=(meta["n_passages"], len(self.columns)), copy=False)
+        self.scorer = (scorer or ExactScorer()).fit(self.matrix)
+        self._vectorizer = _vectorizer()
+
+    @classmethod
+    def build(cls, documents: Iterable[Dict[str, Any]], index_dir: str, scorer=None, **kwargs) -> "PassageIndex":
+        """Writes a passage index of the documents to index_dir; see PassageIndexWriter for the options."""
+        writer = PassageIndexWriter(index_dir, **kwargs)
+        for document in documents:
+            writer.add(document)
+        return writer.close(scorer=scorer)
+
+    @classmethod
+    def load(cls, index_dir: str, mmap: bool = True, scorer=None) -> "PassageIndex":
+        with open(os.path.join(index_dir, META_FILE), "rb") as f:
+            meta = pickle.load(f)
+        arrays = {name: cls._read(os.path.join(index_dir, f"{name}.bin"), dtype, mmap)
+                  for name, dtype in ARRAYS.items()}
+        text = cls._read(os.path.join(index_dir, "text.bin"), np.uint8, mmap)
+        return cls(index_dir, meta, arrays, text, scorer=scorer)
+
+    @staticmethod
+    def _read(path: str, dtype, mmap: bool) -> np.ndarray:
+        # np.memmap can't map empty files.
+        if not mmap or os.path.getsize(path) == 0:
+            return np.fromfile(path, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r")
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    @property
+    def nbytes(self) -> int:
+        return (sum(array.nbytes for array in self.arrays.values()) + self.text.nbytes
+                + self.columns.nbytes + self.idf.nbytes)
+
+    def passage(self, row: int) -> Passage:
+        offsets = self.arrays["text_offsets"]
+        text = self.text[offsets[row]:offsets[row + 1]].tobytes().decode("utf-8")
+        return Passage(int(self.arrays["start"][row]), int(self.arrays["end"][row]),
+                       int(self.arrays["page"][row]), text)
+
+    def _query_matrix(self, queries: List[str]):
+        counts = self._vectorizer.transform(queries).tocsr()
+        counts.sum_duplicates()
+        # Terms that no passage has are dropped.
+        columns = np.searchsorted(self.columns, counts.indices).clip(max=len(self.columns) - 1)
+        weights = (1 + np.log(counts.data)) * self.idf[columns]
+        weights[self.columns[columns] != counts.indices] = 0
+        query_matrix = csr_matrix((weights, columns, counts.indptr), shape=(len(queries), len(self.columns)))
+        query_matrix.eliminate_zeros()
+        norms = np.sqrt(np.asarray(query_matrix.multiply(query_matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        return csr_matrix(query_matrix.multiply(1 / norms[:, None]))
+
+    def search(self, query: str, k: int = 6, min_score: float = 0.0,
+               passages_per_document: int = 2) -> List[Tuple[Dict[str, Any], float]]:
+        """
+        Returns the k documents with the best matching passages.
+
+        Args:
+            query: The input query string.
+            k: Maximum number of documents.
+            min_score: Passages scoring below this are left out.
+            passages_per_document: Highlights returned per document.
+
+        Returns:
+            List of tuples (document, score), best first, where the document
+            is the entry without its content plus a "passages" list of
+            highlights, and the score is that of its best passage.
+        """
+        return self.search_many([query], k, min_score, passages_per_document)[0]
+
+    def search_many(self, queries: List[str], k: int = 6, min_score: float = 0.0,
+                    passages_per_document: int = 2) -> List[List[Tuple[Dict[str, Any], float]]]:
+        """Searches several queries at once, scoring all their passages in one product."""
+        if not queries or self.matrix.shape[0] == 0:
+            return [[] for _ in queries]
+        # Enough passages that k documents are found even when the best
+        # passages cluster in a few documents.
+        n_candidates = k * passages_per_document * 8
+        with span("vectorize", index="passages"):
+            query_matrix = self._query_matrix(queries)
+        with span("score", index="passages"):
+            ranked_passages = self.scorer.search_many(self.matrix, query_matrix, n_candidates, min_score)
+        results = []
+        for rows, scores in ranked_passages:
+            by_document: Dict[int, List[Tuple[int, float]]] = {}
+            for row, score in zip(rows, scores):
+                passages = by_document.setdefault(int(self.arrays["document"][row]), [])
+                if len(passages) < passages_per_document:
+                    passages.append((int(row), float(score)))
+                if len(by_document) >= k and all(len(p) >= passages_per_document for p in by_document.values()):
+                    break
+            ranked = sorted(by_document.items(), key=lambda item: -item[1][0][1])[:k]
+            hits = []
+            for position, passages in ranked:
+                document = self.documents[position]
+                entry = {**document, "passages": [highlight(document, self.passage(row), score)
+                                                  for row, score in passages]}
+                hits.append((entry, passages[0][1]))
+            results.append(hits)
+        return results
+
+
+def build_passage_shards(documents: Iterable[Dict[str, Any]], root_dir: str, **kwargs) -> Dict[str, int]:
+    """
+    Builds one passage index per `userId` from a stream of documents.
+
+    The stream is read once into a temporary spool file, remembering where
+    each user's documents are, and the shards are then written one user at a
+    time. Only one PassageIndexWriter, with its open files and document
+    frequency counts, exists at a time, however many users the corpus has.
+
+    Args:
+        documents: Document entries shaped like the `documents` table.
+        root_dir: Directory where the shards will be saved.
+        kwargs: Options of PassageIndexWriter.
+
+    Returns:
+        Number of indexed documents per user id.
+    """
+    offsets: Dict[str, List[int]] = {}
+    counts = {}
+    with tempfile.TemporaryFile() as spool:
+        for document in documents:
+            if isinstance(document, dict) and "userId" in document and document.get("content"):
+                offsets.setdefault(str(document["userId"]), []).append(spool.tell())
+                spool.write(json.dumps(document).encode("utf-8") + b"\n")
+        for user_id, user_offsets in offsets.items():
+            writer = PassageIndexWriter(os.path.join(root_dir, user_id), **kwargs)
+            for offset in user_offsets:
+                spool.seek(offset)
+                writer.add(json.loads(spool.readline()))
+            counts[user_id] = len(writer.close())
+    if counts:
+        mark_changed(root_dir)
+    return counts
@@ -0,0 +1,219 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from sklearn.preprocessing import normalize
+
+
+def top_k(rows: np.ndarray, scores: np.ndarray, k: int, min_score: float = 0.0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the rows with the k best scores at or above min_score, best first.
+
+    Only the k winners are sorted; argpartition finds them in linear time.
+    """
+    keep = scores >= min_score
+    rows, scores = rows[keep], scores[keep]
+    if len(scores) > k:
+        best = np.argpartition(-scores, k - 1)[:k]
+        rows, scores = rows[best], scores[best]
+    order = np.argsort(-scores, kind="stable")
+    return rows[order], scores[order]
+
+
+class ExactScorer:
+    """
+    Scores every row with a sparse dot product against the query.
+
+    Rows are L2-normalised, so the dot product is the cosine similarity. Only
+    rows sharing a term with the query (a positive score) are candidates for
+    top-k selection.
+
+    Attributes:
+        sparse_batch_min: Batches at least this large are scored with one
+            sparse query x document product, which transposes the matrix
+            once per call. Smaller ones, single queries included, are scored
+            as a dense (n_rows x batch) block, about twice as fast for one
+            query (6 ms vs 13 ms at 50k documents, bench_batch_search.py).
+        dense_max_bytes: Largest dense score block; small batches over a
+            matrix with more rows are scored as a sparse product instead.
+    """
+
+    sparse_batch_min = 32
+    dense_max_bytes = 16 * 2 ** 20
+
+    def fit(self, matrix) -> "ExactScorer":
+        return self
+
+    def search(self, matrix, query_vector, k: int, min_score: float = 0.0,
+               alive: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the matrix rows of the k best matches and their scores, best first.
+
+        Args:
+            matrix: CSR matrix of L2-normalised rows.
+            query_vector: 1 x n_terms sparse query.
+            k: Maximum number of results.
+            min_score: Rows scoring below this are dropped.
+            alive: Optional boolean mask of the rows that may be returned.
+        """
+        return self.search_many(matrix, query_vector, k, min_score, alive)[0]
+
+    def search_many(self, matrix, query_matrix, k: int, min_score: float = 0.0,
+                    alive: Optional[np.ndarray] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Scores a batch of queries against the matrix in one product.
+
+        Args:
+            query_matrix: n_queries x n_terms sparse queries.
+
+        Returns:
+            One (rows, scores) pair per query, as returned by `search`.
+        """
+        n_queries = query_matrix.shape[0]
+        if n_queries < self.sparse_batch_min and matrix.shape[0] * n_queries * 8 <= self.dense_max_bytes:
+            scores = matrix @ query_matrix.T.toarray()
+            candidates = []
+            for column in scores.T:
+                rows = np.flatnonzero(column > 0)
+                candidates.append((rows, column[rows]))
+        elif n_queries < self.sparse_batch_min:
+            scores = (matrix @ query_matrix.T).tocsc()
+            candidates = [
+                (scores.indices[start:end], scores.data[start:end])
+                for start, end in zip(scores.indptr[:-1], scores.indptr[1:])
+            ]
+        else:
+            scores = (query_matrix @ matrix.T).tocsr()
+            candidates = [
+                (scores.indices[start:end], scores.data[start:end])
+                for start, end in zip(scores.indptr[:-1], scores.indptr[1:])
+            ]
+
+        results = []
+        for rows, values in candidates:
+            if alive is not None:
+                rows, values = rows[alive[rows]], values[alive[rows]]
+            results.append(top_k(rows, values, k, min_score))
+        return results
+
+
+class IVFScorer:
+    """
+    Approximate scorer for large corpora, using an inverted-file index.
+
+    Rows are grouped by spherical k-means around sparse centroids, and a query
+    is only scored against the rows of the `n_probe` clusters whose centroids
+    are closest to it. Rows appended after `fit` are always scored exactly.
+
+    Attributes:
+        n_clusters: Number of clusters; defaults to sqrt(n_rows).
+        n_probe: Number of clusters scanned per query.
+        centroid_terms: Terms kept per centroid, which bounds centroid memory.
+        n_iter: k-means iterations.
+        sample_size: Rows k-means is trained on.
+        seed: Random seed for the sample and the initial centroids.
+    """
+
+    def __init__(self, n_clusters: Optional[int] = None, n_probe: int = 8, centroid_terms: int = 1000,
+                 n_iter: int = 5, sample_size: int = 20_000, seed: int = 0):
+        self.n_clusters = n_clusters
+        self.n_probe = n_probe
+        self.centroid_terms = centroid_terms
+        self.n_iter = n_iter
+        self.sample_size = sample_size
+        self.seed = seed
+
+    def fit(self, matrix) -> "IVFScorer":
+        n_rows = matrix.shape[0]
+        self.fitted_rows = n_rows
+        if n_rows == 0:
+            self.centroids = csr_matrix((0, matrix.shape[1]))
+            self.lists = np.zeros(0, dtype=np.int64)
+            self.offsets = np.zeros(1, dtype=np.int64)
+            return self
+
+        rng = np.random.default_rng(self.seed)
+        n_clusters = min(self.n_clusters or max(1, int(np.sqrt(n_rows))), n_rows)
+        sample = matrix[np.sort(rng.choice(n_rows, min(n_rows, self.sample_size), replace=False))]
+        centroids = sample[rng.choice(sample.shape[0], n_clusters, replace=False)]
+        for _ in range(self.n_iter):
+            centroids = self._update(sample, self._assign(sample, centroids), centroids)
+
+        assignment = self._assign(matrix, centroids)
+        self.centroids = centroids
+        self.lists = np.argsort(assignment, kind="stable")
+        self.offsets = np.searchsorted(assignment[self.lists], np.arange(n_clusters + 1))
+        return self
+
+    def search(self, matrix, query_vector, k: int, min_score: float = 0.0,
+               alive: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Same contract as `ExactScorer.search`, scanning only the probed clusters."""
+        if query_vector.nnz == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        centroid_scores = (self.centroids @ query_vector.T).toarray().ravel()
+        n_probe = min(self.n_probe, len(centroid_scores))
+        probes = np.argpartition(-centroid_scores, n_probe - 1)[:n_probe] if n_probe else []
+        candidates = [self.lists[self.offsets[c]:self.offsets[c + 1]] for c in probes]
+        candidates.append(np.arange(self.fitted_rows, matrix.shape[0]))
+        rows = np.concatenate(candidates)
+        if alive is not None:
+            rows = rows[alive[rows]]
+
+        scores = (matrix[rows] @ query_vector.T).toarray().ravel()
+        matched = scores > 0
+        return top_k(rows[matched], scores[matched], k, min_score)
+
+    def search_many(self, matrix, query_matrix, k: int, min_score: float = 0.0,
+                    alive: Optional[np.ndarray] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Same contract as `ExactScorer.search_many`; each query probes its own clusters."""
+        query_matrix = query_matrix.tocsr()
+        return [self.search(matrix, query_matrix[i], k, min_score, alive) for i in range(query_matrix.shape[0])]
+
+    @staticmethod
+    def _assign(matrix, centroids, batch_size: int = 10_000) -> np.ndarray:
+        assignment = np.empty(matrix.shape[0], dtype=np.int64)
+        for start in range(0, matrix.shape[0], batch_size):
+            batch = matrix[start:start + batch_size]
+            assignment[start:start + batch_size] = (batch @ centroids.T).toarray().argmax(axis=1)
+        return assignment
+
+    def _update(self, sample, assignment: np.ndarray, centroids):
+        n_clusters = centroids.shape[0]
+        members = csr_matrix(
+            (np.ones(len(assignment)), (assignment, np.arange(len(assignment)))),
+            shape=(n_clusters, sample.shape[0]),
+        )
+        sums = (members @ sample).tocsr()
+        # Empty clusters keep their previous centroid.
+        empty = np.flatnonzero(np.diff(sums.indptr) == 0)
+        if len(empty):
+            sums = sums.tolil()
+            for c in empty:
+                sums[c] = centroids[c]
+            sums = sums.tocsr()
+        return self._prune(normalize(sums))
+
+    def _prune(self, centroids):
+        """Keeps the `centroid_terms` heaviest terms of each centroid."""
+        rows, cols, data = [], [], []
+        for c in range(centroids.shape[0]):
+            start, end = centroids.indptr[c], centroids.indptr[c + 1]
+            values, terms = centroids.data[start:end], centroids.indices[start:end]
+            if len(values) > self.centroid_terms:
+                keep = np.argpartition(-values, self.centroid_terms - 1)[:self.centroid_terms]
+                values, terms = values[keep], terms[keep]
+            rows.append(np.full(len(values), c))
+            cols.append(terms)
+            data.append(values)
+        pruned = csr_matrix(
+            (np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+            shape=centroids.shape,
+        )
+        return normalize(pruned)
+
+
+SCORERS = {
+    "exact": ExactScorer,
+    "ivf": IVFScorer,
+}
@@ -0,0 +1,178 @@
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from .index import DocumentIndex
+from .metrics import span
+
+# Locks serialising shard loads, shared by users with the same hash.
+LOAD_LOCKS = 64
+# Replaced in a store's root directory whenever its shards change, see mark_changed.
+VERSION_FILE = "VERSION"
+
+
+class ShardedIndexStore:
+    """
+    One DocumentIndex per user, loaded on first use and evicted least recently
+    used first once the loaded shards exceed the memory budget.
+
+    Shards live in `root_dir/<user_id>/` in the format written by
+    `DocumentIndex.save`, or by the writer of another `index_class`.
+
+    Attributes:
+        root_dir: Directory holding one saved index per user.
+        memory_budget: Maximum bytes of loaded shards, see `DocumentIndex.nbytes`.
+        loader: Optional fallback called with the user id when no saved shard
+            exists; returns a DocumentIndex or None.
+        scorer: Optional factory returning a new scorer for each loaded shard.
+        index_class: Class whose `load(shard_dir, scorer=...)` opens saved
+            shards, e.g. PassageIndex.
+    """
+
+    def __init__(self, root_dir: str, memory_budget: int,
+                 loader: Optional[Callable[[str], Optional[DocumentIndex]]] = None,
+                 scorer: Optional[Callable[[], Any]] = None, index_class=DocumentIndex):
+        self.root_dir = root_dir
+        self.memory_budget = memory_budget
+        self.loader = loader
+        self.scorer = scorer
+        self.index_class = index_class
+        self._shards: "OrderedDict[str, DocumentIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Loads of a user's shard, which the loader may build and write to
+        # disk, never run concurrently. Users share a fixed set of locks,
+        # picked by hash, so the store holds no state per user it once saw.
+        self._load_locks = [threading.Lock() for _ in range(LOAD_LOCKS)]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def shard_dir(self, user_id) -> str:
+        return os.path.join(self.root_dir, str(user_id))
+
+    def get(self, user_id) -> Optional[DocumentIndex]:
+        """Returns the user's index, loading it if needed, or None if the user has no documents."""
+        user_id = str(user_id)
+        with self._lock:
+            index = self._shards.get(user_id)
+            if index is not None:
+                self._shards.move_to_end(user_id)
+                self.hits += 1
+                return index
+            self.misses += 1
+        load_lock = self._load_locks[hash(user_id) % len(self._load_locks)]
+
+        # Loading can take a while, so it happens outside the store's lock,
+        # under the user's load lock: other users' shards are served
+        # meanwhile, and a call for the same user waits for the load instead
+        # of repeating it.
+        with load_lock:
+            with self._lock:
+                index = self._shards.get(user_id)
+                if index is not None:
+                    self._shards.move_to_end(user_id)
+                    return index
+            index = self._load(user_id)
+            if index is None:
+                return None
+
+            with self._lock:
+                self._shards[user_id] = index
+                self._shards.move_to_end(user_id)
+                self._evict(keep=user_id)
+            return index
+
+    def invalidate(self, user_id):
+        """
+        Drops the user's shard so the next call reloads it, e.g. after it was
+        rebuilt on disk, and changes the store's `version`.
+        """
+        with self._lock:
+            self._shards.pop(str(user_id), None)
+        mark_changed(self.root_dir)
+
+    def version(self) -> str:
+        """
+        Changes whenever a shard is rebuilt or invalidated, by this process or
+        another one sharing `root_dir`, e.g. so cached replies drafted with
+        the old documents aren't served. Costs one stat.
+        """
+        try:
+            stat = os.stat(os.path.join(self.root_dir, VERSION_FILE))
+        except FileNotFoundError:
+            return "0"
+        return f"{stat.st_ino}.{stat.st_mtime_ns}"
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "shards": len(self._shards),
+                "bytes": sum(index.nbytes for index in self._shards.values()),
+                "memory_budget": self.memory_budget,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _load(self, user_id: str) -> Optional[DocumentIndex]:
+        if os.path.isdir(self.shard_dir(user_id)):
+            with span("index_load", source="disk"):
+                return self.index_class.load(self.shard_dir(user_id), scorer=self.scorer() if self.scorer else None)
+        if self.loader is not None:
+            with span("index_load", source="loader"):
+                return self.loader(user_id)
+        return None
+
+    def _evict(self, keep: str):
+        used = sum(index.nbytes for index in self._shards.values())
+        while used > self.memory_budget and len(self._shards) > 1:
+            user_id, index = next(iter(self._shards.items()))
+            if user_id == keep:
+                break
+            del self._shards[user_id]
+            used -= index.nbytes
+            self.evictions += 1
+
+
+def build_shards(documents: Iterable[Dict[str, Any]], root_dir: str, workers: int = 1,
+                 **vectorizer_kwargs) -> Dict[str, int]:
+    """
+    Builds and saves one index per `userId`.
+
+    Args:
+        documents: Document entries shaped like the `documents` table.
+        root_dir: Directory where the shards will be saved.
+        workers: Processes tokenising each user's documents.
+        vectorizer_kwargs: Extra arguments for TfidfVectorizer.
+
+    Returns:
+        Number of indexed documents per user id.
+    """
+    by_user: Dict[str, list] = {}
+    for doc in documents:
+        if isinstance(doc, dict) and "userId" in doc and doc.get("content"):
+            by_user.setdefault(str(doc["userId"]), []).append(doc)
+
+    counts = {}
+    for user_id, user_documents in by_user.items():
+        index = DocumentIndex.from_documents(user_documents, workers=workers, **vectorizer_kwargs)
+        index.save(os.path.join(root_dir, user_id))
+        counts[user_id] = len(index)
+    if counts:
+        mark_changed(root_dir)
+    return counts
+
+
+def mark_changed(root_dir: str):
+    """
+    Records that shards under root_dir changed, for `ShardedIndexStore.version`.
+
+    The version file is replaced rather than touched, so the change shows even
+    within the file system's timestamp granularity.
+    """
+    os.makedirs(root_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=root_dir, prefix=VERSION_FILE)
+    os.close(fd)
+    os.replace(tmp_path, os.path.join(root_dir, VERSION_FILE))
@@ -0,0 +1,350 @@
+import ast
+import json
+import operator
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    type TEXT NOT NULL,
+    description TEXT,
+    date TEXT NOT NULL,
+    content TEXT,
+    tags TEXT  -- JSON array; text[] in Postgres
+);
+CREATE INDEX IF NOT EXISTS documents_user ON documents (user_id, id);
+"""
+
+
+def iter_json_array(f, chunk_chars: int = 1 << 16) -> Iterator[Any]:
+    """
+    Decodes the items of a top-level JSON array from a text file, one at a
+    time, reading it `chunk_chars` at a time.
+
+    Raises:
+        json.JSONDecodeError: If the file isn't a JSON array.
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = "", 0, False
+
+    def fill(pos: int) -> int:
+        # Skips whitespace, reading more as needed; returns the next position.
+        nonlocal buffer, eof
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer) or eof:
+                return pos
+            chunk = f.read(chunk_chars)
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+
+    pos = fill(pos)
+    if buffer[pos:pos + 1] != "[":
+        raise json.JSONDecodeError("Expecting '['", buffer, pos)
+    pos = fill(pos + 1)
+    if buffer[pos:pos + 1] == "]":
+        return
+    while True:
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+            # A number at the end of the buffer may continue in the next chunk.
+            if end == len(buffer) and not eof:
+                raise json.JSONDecodeError("Item may be truncated", buffer, end)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # The item continues past the buffer; read at least as much again.
+            chunk = f.read(max(chunk_chars, len(buffer) - pos))
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+        yield item
+        buffer = buffer[end:]
+        pos = fill(0)
+        separator = buffer[pos:pos + 1]
+        if separator == "]":
+            return
+        if separator != ",":
+            raise json.JSONDecodeError("Expecting ',' delimiter", buffer, pos)
+        pos = fill(pos + 1)
+
+
+class JsonDocumentSource:
+    """Documents of a JSON file holding a list of entries, decoded as they are read."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        with open(self.path, "r", encoding="utf-8") as f:
+            for document in iter_json_array(f):
+                if isinstance(document, dict):
+                    yield document
+
+    def for_user(self, user_id) -> Iterator[Dict[str, Any]]:
+        return (doc for doc in self if str(doc.get("userId")) == str(user_id))
+
+
+class SqliteDocumentSource:
+    """
+    Documents of a SQLite table with the columns of `documents` in
+    shared/schema.ts; tags are stored as a JSON array.
+
+    Reads are paginated by id, `page_size` rows per query, so iterating holds
+    one page at a time and a write between pages doesn't shift the next one.
+    """
+
+    def __init__(self, path: str, page_size: int = 500):
+        self.path = path
+        self.page_size = page_size
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def add(self, documents: Iterable[Dict[str, Any]], batch_size: int = 1000) -> int:
+        """Inserts entries shaped like `documents.json`; entries with an `id` replace that row. Returns the count."""
+        count = 0
+        batch: List[tuple] = []
+        for document in documents:
+            batch.append((
+                document.get("id"), document["userId"], document["name"], document.get("type", ""),
+                document.get("description"), document.get("date") or datetime.now(timezone.utc).isoformat(),
+                document.get("content"), json.dumps(document.get("tags") or []),
+            ))
+            if len(batch) >= batch_size:
+                count += self._insert(batch)
+                batch = []
+        return count + self._insert(batch)
+
+    def _insert(self, rows: List[tuple]) -> int:
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO documents (id, user_id, name, type, description, date, content, tags)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def count(self, user_id=None) -> int:
+        with self._lock:
+            if user_id is None:
+                return self._db.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+            return self._db.execute("SELECT COUNT(*) FROM documents WHERE user_id = ?", (int(user_id),)).fetchone()[0]
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return self._pages("", ())
+
+    def for_user(self, user_id) -> Iterator[Dict[str, Any]]:
+        return self._pages("user_id = ? AND", (int(user_id),))
+
+    def _pages(self, where: str, params: tuple) -> Iterator[Dict[str, Any]]:
+        last_id = -1
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    f"SELECT * FROM documents WHERE {where} id > ? ORDER BY id LIMIT ?",
+                    (*params, last_id, self.page_size),
+                ).fetchall()
+            for row in rows:
+                yield {
+                    "id": row["id"], "userId": row["user_id"], "name": row["name"], "type": row["type"],
+                    "description": row["description"], "date": row["date"], "content": row["content"],
+                    "tags": json.loads(row["tags"]) if row["tags"] else [],
+                }
+            if len(rows) < self.page_size:
+                return
+            last_id = rows[-1]["id"]
+
+
+def open_source(path: str):
+    """A SqliteDocumentSource for .db/.sqlite files, otherwise a JsonDocumentSource."""
+    if path.endswith((".db", ".sqlite", ".sqlite3")):
+        return SqliteDocumentSource(path)
+    return JsonDocumentSource(path)
+
+
+class _TypeScriptLiteral:
+    """
+    Parses the array and object literals of sample data in TypeScript:
+    quoted or bare keys, strings, numbers, booleans, nested arrays and
+    objects, trailing commas and comments. `new Date(...)` is evaluated when
+    it's the current time plus or minus arithmetic on integers, as in
+    `new Date(new Date().getTime() - 2 * 24 * 60 * 60 * 1000)`; any other
+    expression is None.
+    """
+
+    _operators = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul}
+
+    def __init__(self, text: str, now: Optional[float] = None):
+        self.text = text
+        self.pos = 0
+        self.now = time.time() if now is None else now
+
+    def _skip(self):
+        text = self.text
+        while self.pos < len(text):
+            if text[self.pos].isspace():
+                self.pos += 1
+            elif text.startswith("//", self.pos):
+                end = text.find("\n", self.pos)
+                self.pos = len(text) if end == -1 else end
+            elif text.startswith("/*", self.pos):
+                self.pos = text.index("*/", self.pos) + 2
+            else:
+                return
+
+    def _error(self, message: str):
+        line = self.text.count("\n", 0, self.pos) + 1
+        return ValueError(f"{message} at line {line}")
+
+    def value(self) -> Any:
+        self._skip()
+        char = self.text[self.pos:self.pos + 1]
+        if char == "[":
+            return self._items("]", self.value)
+        if char == "{":
+            return dict(self._items("}", self._member))
+        if char in ("'", '"', "`"):
+            return self._string()
+        return self._expression()
+
+    def _items(self, close: str, item) -> List[Any]:
+        self.pos += 1
+        items = []
+        while True:
+            self._skip()
+            if self.text.startswith(close, self.pos):
+                self.pos += 1
+                return items
+            items.append(item())
+            self._skip()
+            if self.text.startswith(",", self.pos):
+                self.pos += 1
+            elif not self.text.startswith(close, self.pos):
+                raise self._error(f"Expecting ',' or '{close}'")
+
+    def _member(self):
+        self._skip()
+        if self.text[self.pos] in ("'", '"'):
+            key = self._string()
+        else:
+            start = self.pos
+            while self.pos < len(self.text) and (self.text[self.pos].isalnum() or self.text[self.pos] in "_$"):
+                self.pos += 1
+            key = self.text[start:self.pos]
+            if not key:
+                raise self._error("Expecting a key")
+        self._skip()
+        if not self.text.startswith(":", self.pos):
+            raise self._error("Expecting ':'")
+        self.pos += 1
+        return key, self.value()
+
+    def _string(self) -> str:
+        quote = self.text[self.pos]
+        chars = []
+        self.pos += 1
+        while self.text[self.pos] != quote:
+            if self.text[self.pos] == "\\":
+                self.pos += 1
+                escaped = self.text[self.pos]
+                if escaped == "u":
+                    chars.append(chr(int(self.text[self.pos + 1:self.pos + 5], 16)))
+                    self.pos += 4
+                else:
+                    chars.append({"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f"}.get(escaped, escaped))
+            else:
+                chars.append(self.text[self.pos])
+            self.pos += 1
+        self.pos += 1
+        return "".join(chars)
+
+    def _expression(self) -> Any:
+        # Everything up to the next comma or closing bracket at this depth.
+        start, depth = self.pos, 0
+        while self.pos < len(self.text):
+            char = self.text[self.pos]
+            if char in "([{":
+                depth += 1
+            elif char in ")]}":
+                if depth == 0:
+                    break
+                depth -= 1
+            elif char == "," and depth == 0:
+                break
+            elif char in ("'", '"', "`"):
+                self._string()
+                continue
+            self.pos += 1
+        expression = self.text[start:self.pos].strip()
+        if expression in ("true", "false"):
+            return expression == "true"
+        if expression in ("null", "undefined"):
+            return None
+        try:
+            return json.loads(expression)
+        except ValueError:
+            pass
+        if expression.startswith("new Date(") and expression.endswith(")"):
+            return self._date(expression[len("new Date("):-1].strip())
+        return None
+
+    def _date(self, argument: str) -> Optional[str]:
+        if argument in ("", "new Date().getTime()", "Date.now()"):
+            offset = 0
+        else:
+            for now in ("new Date().getTime()", "Date.now()"):
+                if argument.startswith(now):
+                    try:
+                        offset = self._arithmetic(ast.parse("0" + argument[len(now):], mode="eval").body)
+                    except (SyntaxError, ValueError):
+                        return None
+                    break
+            else:
+                try:
+                    return json.loads(argument)  # new Date("2025-05-09T01:38:00.000Z")
+                except ValueError:
+                    return None
+        moment = datetime.fromtimestamp(self.now + offset / 1000, tz=timezone.utc)
+        return moment.isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+    def _arithmetic(self, node) -> int:
+        if isinstance(node, ast.Constant) and isinstance(node.value, int):
+            return node.value
+        if isinstance(node, ast.BinOp) and type(node.op) in self._operators:
+            return self._operators[type(node.op)](self._arithmetic(node.left), self._arithmetic(node.right))
+        raise ValueError("Unsupported expression")
+
+
+def documents_from_storage_ts(ts_file: str, variable: str = "sampleDocuments",
+                              now: Optional[float] = None) -> List[Dict[str, Any]]:
+    """
+    Reads the array literal assigned to `variable` in a TypeScript file,
+    such as the sample documents of server/storage.ts, as entries shaped
+    like `documents.json`. Ids are numbered from 1 in order, as
+    MemStorage.createDocument does.
+
+    Raises:
+        ValueError: If the variable's declaration isn't found or its literal
+            can't be parsed.
+    """
+    with open(ts_file, "r", encoding="utf-8") as f:
+        text = f.read()
+    # The declaration, with an optional type annotation, rather than the
+    # first mention of the name, which may be a comment or a use.
+    declaration = re.search(rf"\b(?:export\s+)?(?:const|let|var)\s+{re.escape(variable)}\b[^=;]*=", text)
+    if declaration is None:
+        raise ValueError(f"No declaration of {variable} in {ts_file}")
+    parser = _TypeScriptLiteral(text, now=now)
+    parser.pos = declaration.end()
+    items = parser.value()
+    if not isinstance(items, list):
+        raise ValueError(f"{variable} in {ts_file} isn't an array")
+    return [{"id": i, **item} for i, item in enumerate(items, 1) if isinstance(item, dict)]
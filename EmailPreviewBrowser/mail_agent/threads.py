@@ -0,0 +1,156 @@
+import hashlib
+import re
+from bisect import insort
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+SUBJECT_PREFIX = re.compile(r"^\s*(((re|r|fwd?|i|aw|sv)(\[\d+\])?\s*:|\[[^\]]*\])\s*)+", re.IGNORECASE)
+MESSAGE_ID = re.compile(r"<[^<>\s]+>")
+WHITESPACE = re.compile(r"\s+")
+NON_WORD = re.compile(r"[^a-z0-9]+")
+
+
+def normalize_subject(subject: str) -> str:
+    """Strips reply/forward prefixes and list tags, for grouping by subject."""
+    return WHITESPACE.sub(" ", SUBJECT_PREFIX.sub("", subject or "")).strip().casefold()
+
+
+def is_reply_subject(subject: str) -> bool:
+    return bool(SUBJECT_PREFIX.match(subject or ""))
+
+
+def message_ids(header: Optional[str]) -> List[str]:
+    """The <message-ids> in a References or In-Reply-To header, in order."""
+    return MESSAGE_ID.findall(header or "")
+
+
+def make_thread_id(subject_key: str, message_id: str) -> str:
+    """A readable, stable id like thread-project-timeline-1a2b3c4d."""
+    slug = NON_WORD.sub("-", " ".join(subject_key.split()[:5])).strip("-")[:40] or "untitled"
+    return f"thread-{slug}-{hashlib.sha1(message_id.encode()).hexdigest()[:8]}"
+
+
+class Thread:
+    """Members of one conversation, ordered by timestamp."""
+
+    __slots__ = ("id", "members", "message_ids", "merged_into")
+
+    def __init__(self, thread_id: str):
+        self.id = thread_id
+        self.members: List[Tuple[str, int, str]] = []  # (timestamp, arrival, message_id)
+        self.message_ids: Set[str] = set()  # members, plus referenced messages not seen yet
+        self.merged_into: Optional["Thread"] = None
+
+
+class ThreadIndex:
+    """
+    Incremental JWZ-style threading over Message-ID, In-Reply-To and References.
+
+    Each message joins the thread of any message it references or that
+    references it, including messages that haven't arrived yet, so replies
+    received before their parents still end up in one thread. Messages
+    without any references fall back to the thread of the last message with
+    the same normalised subject, if their own subject is a reply.
+
+    Message to thread lookups are a dict lookup; when two threads merge, the
+    smaller one is folded into the larger, and the merged thread keeps the id
+    of the one that started first.
+    """
+
+    def __init__(self):
+        self._thread_of: Dict[str, Thread] = {}
+        self._threads: Dict[str, Thread] = {}
+        self._by_subject: Dict[str, Thread] = {}
+        self._seen: Set[str] = set()
+        self._arrivals = 0
+
+    def __len__(self) -> int:
+        return len(self._threads)
+
+    def add(self, message_id: str, in_reply_to: Sequence[str] = (), references: Sequence[str] = (),
+            subject: str = "", timestamp: str = "") -> Tuple[str, List[str]]:
+        """
+        Threads a message.
+
+        Args:
+            message_id: The message's Message-ID.
+            in_reply_to: Message ids of its In-Reply-To header.
+            references: Message ids of its References header, oldest first.
+            subject: Its subject, for the fallback.
+            timestamp: Sortable timestamp, e.g. ISO 8601 in UTC.
+
+        Returns:
+            The message's thread id, and the ids of threads merged into it,
+            which no longer exist.
+        """
+        if message_id in self._seen:
+            return self._thread_of[message_id].id, []
+
+        linked_ids = list(references) + [i for i in in_reply_to if i not in references]
+        threads = [self._thread_of[i] for i in linked_ids + [message_id] if i in self._thread_of]
+        subject_key = normalize_subject(subject)
+        if not linked_ids and not threads and subject_key and is_reply_subject(subject):
+            previous = self._by_subject.get(subject_key)
+            if previous is not None:
+                threads.append(self._live(previous))
+
+        merged = []
+        if not threads:
+            thread = Thread(make_thread_id(subject_key, message_id))
+            self._threads[thread.id] = thread
+        else:
+            thread = threads[0]
+            for other in threads[1:]:
+                other = self._live(other)
+                if other is not thread:
+                    thread, dropped_id = self._merge(thread, other)
+                    merged.append(dropped_id)
+
+        for i in linked_ids + [message_id]:
+            if i not in self._thread_of:
+                self._thread_of[i] = thread
+                thread.message_ids.add(i)
+        self._arrivals += 1
+        insort(thread.members, (timestamp, self._arrivals, message_id))
+        self._seen.add(message_id)
+        if subject_key:
+            self._by_subject[subject_key] = thread
+        return thread.id, merged
+
+    def thread_of(self, message_id: str) -> Optional[str]:
+        """The id of a message's thread, or None for unknown messages."""
+        thread = self._thread_of.get(message_id)
+        return thread.id if thread is not None and message_id in self._seen else None
+
+    def members(self, thread_id: str) -> List[str]:
+        """Message ids of a thread's messages, oldest first."""
+        thread = self._threads.get(thread_id)
+        return [message_id for _, _, message_id in thread.members] if thread else []
+
+    def _merge(self, a: Thread, b: Thread) -> Tuple[Thread, str]:
+        keep_id = a.id if a.members[0] <= b.members[0] else b.id
+        big, small = (a, b) if len(a.message_ids) >= len(b.message_ids) else (b, a)
+        for message_id in small.message_ids:
+            self._thread_of[message_id] = big
+        big.message_ids |= small.message_ids
+        for member in small.members:
+            insort(big.members, member)
+        del self._threads[a.id], self._threads[b.id]
+        dropped_id = b.id if keep_id == a.id else a.id
+        big.id = keep_id
+        self._threads[keep_id] = big
+        small.merged_into = big
+        return big, dropped_id
+
+    @staticmethod
+    def _live(thread: Thread) -> Thread:
+        while thread.merged_into is not None:
+            thread = thread.merged_into
+        return thread
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict]) -> "ThreadIndex":
+        """Rebuilds the index from records with the keys of `add`'s arguments, in arrival order."""
+        index = cls()
+        for record in records:
+            index.add(**record)
+        return index
@@ -0,0 +1,122 @@
+import itertools
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix, vstack
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer, TfidfVectorizer
+
+# TfidfVectorizer options that depend on the whole corpus; they are applied
+# once the chunks' counts are merged.
+CORPUS_PARAMS = {"min_df": 1, "max_df": 1.0, "max_features": None}
+
+
+def _count_chunk(params: Dict[str, Any], texts: List[str]) -> Tuple[List[str], csr_matrix]:
+    """Map step: the chunk's terms, sorted, and its term counts with columns in that order."""
+    counter = CountVectorizer(**params)
+    try:
+        counts = counter.fit_transform(texts)
+    except ValueError:
+        # Every text of the chunk is empty or stop words.
+        return [], csr_matrix((len(texts), 0), dtype=np.int64)
+    return list(counter.get_feature_names_out()), counts.tocsr()
+
+
+def _merge(chunks: List[Tuple[List[str], csr_matrix]]) -> Tuple[Dict[str, int], csr_matrix]:
+    """Reduce step: one sorted vocabulary and the stacked counts, renumbered to it."""
+    terms = sorted(set().union(*(chunk_terms for chunk_terms, _ in chunks)))
+    if not terms:
+        raise ValueError("empty vocabulary; perhaps the documents only contain stop words")
+    vocabulary = {term: column for column, term in enumerate(terms)}
+    blocks = []
+    for chunk_terms, counts in chunks:
+        # Both vocabularies are sorted, so renumbered indices stay sorted.
+        column_of = np.fromiter((vocabulary[term] for term in chunk_terms), dtype=np.int32, count=len(chunk_terms))
+        blocks.append(csr_matrix((counts.data, column_of[counts.indices], counts.indptr),
+                                 shape=(counts.shape[0], len(terms))))
+    return vocabulary, vstack(blocks, format="csr")
+
+
+def _limit_features(vectorizer: TfidfVectorizer, counts: csr_matrix,
+                    vocabulary: Dict[str, int]) -> Tuple[Dict[str, int], csr_matrix]:
+    """Applies min_df, max_df and max_features the way TfidfVectorizer.fit does."""
+    n_docs = counts.shape[0]
+    high = vectorizer.max_df if isinstance(vectorizer.max_df, (int, np.integer)) else vectorizer.max_df * n_docs
+    low = vectorizer.min_df if isinstance(vectorizer.min_df, (int, np.integer)) else vectorizer.min_df * n_docs
+    if high < low:
+        raise ValueError("max_df corresponds to < documents than min_df")
+    if (high, low, vectorizer.max_features) == (n_docs, 1, None):
+        return vocabulary, counts
+
+    df = np.bincount(counts.indices, minlength=counts.shape[1])
+    mask = (df <= high) & (df >= low)
+    if vectorizer.max_features is not None and mask.sum() > vectorizer.max_features:
+        tf = np.asarray(counts.sum(axis=0)).ravel()
+        kept = np.flatnonzero(mask)[(-tf[mask]).argsort()[:vectorizer.max_features]]
+        mask = np.zeros(len(df), dtype=bool)
+        mask[kept] = True
+    if not mask.any():
+        raise ValueError("After pruning, no terms remain. Try a lower min_df or a higher max_df.")
+    new_column = np.cumsum(mask) - 1
+    vocabulary = {term: int(new_column[column]) for term, column in vocabulary.items() if mask[column]}
+    return vocabulary, counts[:, np.flatnonzero(mask)]
+
+
+def parallel_fit_transform(vectorizer: TfidfVectorizer, texts: Iterable[str], workers: int,
+                           chunk_size: int = 2000) -> csr_matrix:
+    """
+    Fits a TfidfVectorizer and returns the document matrix, tokenising on a
+    pool of processes.
+
+    Texts are read from the iterable in chunks of `chunk_size`, with at most
+    two chunks per worker in flight. Each worker counts its chunk's terms
+    with its own vocabulary (map); the vocabularies are then merged into the
+    sorted one a single-process fit would have found, the counts are
+    renumbered to it and stacked, and document frequencies, the corpus-wide
+    options (min_df, max_df, max_features) and the tf-idf weighting are
+    computed once over the merged counts (reduce). The vectorizer and the
+    matrix are the same as `vectorizer.fit_transform(list(texts))` returns.
+
+    Falls back to fit_transform in this process when there's a single chunk,
+    a fixed vocabulary or use_idf=False. Custom analyzers, tokenizers and
+    preprocessors must be picklable.
+
+    Args:
+        vectorizer: Unfitted vectorizer, fitted in place.
+        texts: The documents' text, in matrix row order.
+        workers: Number of worker processes.
+        chunk_size: Texts per task.
+
+    Returns:
+        CSR matrix of shape (n_texts, n_terms).
+    """
+    texts = iter(texts)
+    first = list(itertools.islice(texts, chunk_size))
+    second = list(itertools.islice(texts, chunk_size))
+    if workers <= 1 or not second or vectorizer.vocabulary is not None or not vectorizer.use_idf:
+        return vectorizer.fit_transform(itertools.chain(first, second, texts)).tocsr()
+
+    params = {name: value for name, value in vectorizer.get_params().items()
+              if name in CountVectorizer().get_params()}
+    params.update(CORPUS_PARAMS, dtype=np.int64)
+    futures: List[Future] = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for chunk in itertools.chain([first, second], iter(lambda: list(itertools.islice(texts, chunk_size)), [])):
+            # Wait for the oldest chunk before submitting past two per worker,
+            # so texts are only read as fast as they are counted.
+            if len(futures) >= 2 * workers:
+                futures[-2 * workers].result()
+            futures.append(pool.submit(_count_chunk, params, chunk))
+        del first, second
+        chunks = [future.result() for future in futures]
+
+    vocabulary, counts = _merge(chunks)
+    del chunks
+    vocabulary, counts = _limit_features(vectorizer, counts, vocabulary)
+    counts = counts.astype(vectorizer.dtype)
+    transformer = TfidfTransformer(norm=vectorizer.norm, use_idf=vectorizer.use_idf,
+                                   smooth_idf=vectorizer.smooth_idf, sublinear_tf=vectorizer.sublinear_tf)
+    transformer.fit(counts)
+    vectorizer.vocabulary_ = vocabulary
+    vectorizer.idf_ = transformer.idf_
+    return transformer.transform(counts, copy=False).tocsr()
@@ -1,76 +1,65 @@
 import os
-import json
-from typing import Dict, List
-from sklearn.feature_extraction.text import TfidfVectorizer
-import pickle
-import re
+import sys
 
-#from your_module_path import MemStorage  # Adjust this import path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
 
-#storage = MemStorage()
+from mail_agent.index import DocumentIndex
+from mail_agent.sources import SqliteDocumentSource, documents_from_storage_ts, open_source
 
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
 
 
-def compute_tfidf_vectors_for_documents(user_id: int, output_file: str):
+def convert_storage_ts(ts_file: str, db_file: str):
     """
-    Computes TF-IDF vectors for documents of a given user and saves them to a JSON file.
+    One-off conversion of the sample documents of storage.ts into a SQLite
+    table shaped like `documents` in shared/schema.ts.
 
     Args:
-        user_id: The ID of the user whose documents to process.
-        output_file: The path to the file where the TF-IDF vectors will be saved.
+        ts_file: Path to storage.ts.
+        db_file: SQLite database to write to; rows with the same id are replaced.
     """
-    
-    database_path = os.path.join(os.path.dirname(__file__), "storage.ts")
-    #with open(database_path, 'rb') as f:
-    #    database = json.load(f)
-    '''
-    with open("storage.ts", "r", encoding="utf-8") as f:
-        database = f.read()
-
-    documents = database.get_documents(user_id)  # Assuming returns a list of Document objects
-    contents = [doc.content for doc in documents]
-    doc_ids = [doc.id for doc in documents]
-    '''
+    try:
+        documents = documents_from_storage_ts(ts_file)
+    except FileNotFoundError:
+        print(f"Error: File not found at {ts_file}")
+        return
+    except ValueError as e:
+        print(f"Error: Could not read the documents of {ts_file}: {e}")
+        return
 
+    count = SqliteDocumentSource(db_file).add(documents)
+    print(f"Copied {count} documents from {ts_file} to {db_file}")
 
-    with open("storage.ts", "r", encoding="utf-8") as f:
-        storage = f.read()
-    #print(storage)
-    # Extract the contents of the documents array
-    match = re.search(r"export const documents\s*=\s*(\[[\s\S]*?\]);", storage)
 
-    if match:
-        documents_str = match.group(1)
+def compute_tfidf_vectors_for_documents(user_id: int, output_file: str, source_file: str):
+    """
+    Computes TF-IDF vectors for documents of a given user and saves them as a sparse binary index.
 
-    # Make TypeScript into valid JSON (quotes around keys, etc.)
-    json_compatible = re.sub(r"(\w+):", r'"\1":', documents_str)  # quote keys
-    json_compatible = json_compatible.replace("'", '"')            # single to double quotes
+    Args:
+        user_id: The ID of the user whose documents to process.
+        output_file: The directory holding the per-user indexes; this user's is saved in a subdirectory named after the user ID.
+        source_file: documents.json, or a SQLite database written by `convert_storage_ts`.
+    """
+    if not os.path.exists(source_file):
+        print(f"Error: File not found at {source_file}")
+        return
 
-    try:
-        documents = json.loads(json_compatible)
-        print("Extracted documents:", documents)
-    except json.JSONDecodeError as e:
-        print("Error parsing JSON:", e)
-    else:
-        print("No documents array found.")
-    tfidf_vectors: Dict[int, List[float]] = {}
+    contents = [doc for doc in open_source(source_file).for_user(user_id) if doc.get("content")]
 
     if not contents:
         print(f"No documents found for user ID: {user_id}")
         return
 
-    vectorizer = TfidfVectorizer()
-    tfidf_matrix = vectorizer.fit_transform(contents)
+    index = DocumentIndex.from_documents(contents)
+    shard_path = os.path.join(output_file, str(user_id))
+    index.save(shard_path)
 
-    # Convert the TF-IDF matrix (sparse) to a dictionary of lists
-    for i, doc_id in enumerate(doc_ids):
-        vector = tfidf_matrix.getrow(i).toarray().flatten().tolist()
-        tfidf_vectors[doc_id] = vector
+    print(f"Saved TF-IDF vectors for {len(index)} documents to {shard_path}")
 
-    with open(output_file, "w") as f:
-        json.dump(tfidf_vectors, f, indent=2)
 
-    print(f"Saved TF-IDF vectors for {len(tfidf_vectors)} documents to {output_file}")
-
-
-compute_tfidf_vectors_for_documents(user_id=1, output_file="tfidf_vectors.json")
\ No newline at end of file
+if __name__ == "__main__":
+    if sys.argv[1:] == ["--from-storage-ts"]:
+        convert_storage_ts(os.path.join(SERVER_DIR, "storage.ts"), os.path.join(SERVER_DIR, "documents.db"))
+    else:
+        compute_tfidf_vectors_for_documents(user_id=1, output_file=os.path.join(SERVER_DIR, "tfidf_index"),
+                                            source_file=os.path.join(SERVER_DIR, "documents.db"))
@@ -1,20 +1,30 @@
 import json
 import os
-from typing import Dict, List
-from sklearn.feature_extraction.text import TfidfVectorizer
+import sys
 
-def compute_tfidf_from_json(json_file: str, output_file: str):
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mail_agent.index import DocumentIndex, convert_legacy_vectors
+from mail_agent.passages import build_passage_shards
+from mail_agent.shards import build_shards, mark_changed
+from mail_agent.sources import JsonDocumentSource
+
+# Processes tokenising documents when an index is built from scratch.
+BUILD_WORKERS = int(os.getenv("INDEX_BUILD_WORKERS", str(os.cpu_count() or 1)))
+
+
+def compute_tfidf_from_json(json_file: str, output_dir: str):
     """
-    Reads documents from a JSON file, computes TF-IDF vectors,
-    and saves them to another JSON file.
+    Streams documents from a JSON file, computes TF-IDF vectors,
+    and saves them as one sparse binary index per user.
 
     Args:
         json_file: Path to the JSON file containing the documents.
-        output_file: Path to the file where the TF-IDF vectors will be saved.
+        output_dir: Directory where the per-user indexes will be saved.
     """
+    output_path = os.path.join(os.path.dirname(__file__), output_dir)
     try:
-        with open(json_file, 'r') as f:
-            documents = json.load(f)
+        counts = build_shards(JsonDocumentSource(json_file), output_path, workers=BUILD_WORKERS)
     except FileNotFoundError:
         print(f"Error: File not found at {json_file}")
         return
@@ -22,26 +32,91 @@ def compute_tfidf_from_json(json_file: str, output_file: str):
         print(f"Error: Could not decode JSON from {json_file}")
         return
 
-    contents = [doc.get("content") for doc in documents if isinstance(doc, dict) and "content" in doc]
-    doc_ids = [doc.get("name") for doc in documents if isinstance(doc, dict) and "name" in doc]
-
-    if not contents:
+    if not counts:
         print("No document content found.")
         return
 
-    vectorizer = TfidfVectorizer()
-    tfidf_matrix = vectorizer.fit_transform(contents)
-    tfidf_vectors: Dict[str, List[float]] = {}
+    print(f"Saved TF-IDF vectors for {sum(counts.values())} documents of {len(counts)} users to {output_path}")
+
+def update_tfidf_from_json(json_file: str, output_dir: str):
+    """
+    Applies added, edited and deleted documents to the existing per-user
+    indexes instead of rebuilding them; users without an index get a new one.
+
+    Args:
+        json_file: Path to the JSON file containing the documents.
+        output_dir: Directory where the per-user indexes are saved.
+    """
+    output_path = os.path.join(os.path.dirname(__file__), output_dir)
+    if not os.path.isdir(output_path):
+        compute_tfidf_from_json(json_file, output_dir)
+        return
+
+    by_user = {}
+    try:
+        for doc in JsonDocumentSource(json_file):
+            if "userId" in doc:
+                by_user.setdefault(str(doc["userId"]), []).append(doc)
+    except FileNotFoundError:
+        print(f"Error: File not found at {json_file}")
+        return
+    except json.JSONDecodeError:
+        print(f"Error: Could not decode JSON from {json_file}")
+        return
+    # Users whose documents were all deleted still need their shard emptied.
+    for user_id in os.listdir(output_path):
+        if os.path.isdir(os.path.join(output_path, user_id)):
+            by_user.setdefault(user_id, [])
+
+    for user_id, user_documents in by_user.items():
+        shard_path = os.path.join(output_path, user_id)
+        if os.path.isdir(shard_path):
+            index = DocumentIndex.load(shard_path)
+            index.sync(user_documents)
+        elif any(doc.get("content") for doc in user_documents):
+            index = DocumentIndex.from_documents(user_documents, workers=BUILD_WORKERS)
+        else:
+            continue
+        index.save(shard_path)
 
-    for i, doc_id in enumerate(doc_ids):
-        vector = tfidf_matrix.getrow(i).toarray().flatten().tolist()
-        tfidf_vectors[doc_id] = vector
+        print(f"Updated TF-IDF vectors for {len(index)} documents of user {user_id} (drift {index.drift:.2f})")
+    # Running servers drop the replies they cached with the old documents.
+    mark_changed(output_path)
+
+def compute_passages_from_json(json_file: str, output_dir: str):
+    """
+    Streams documents from a JSON file, splits their content into overlapping
+    passages and saves one passage index per user.
+
+    Args:
+        json_file: Path to the JSON file containing the documents.
+        output_dir: Directory where the per-user passage indexes will be saved.
+    """
+    output_path = os.path.join(os.path.dirname(__file__), output_dir)
+    try:
+        counts = build_passage_shards(JsonDocumentSource(json_file), output_path)
+    except FileNotFoundError:
+        print(f"Error: File not found at {json_file}")
+        return
+    except json.JSONDecodeError:
+        print(f"Error: Could not decode JSON from {json_file}")
+        return
 
-    output_path = os.path.join(os.path.dirname(__file__), output_file)
-    with open(output_path, 'w') as f:
-        json.dump(tfidf_vectors, f, indent=2)
+    if not counts:
+        print("No document content found.")
+        return
 
-    print(f"Saved TF-IDF vectors for {len(tfidf_vectors)} documents to {output_path}")
+    print(f"Saved passage indexes for {sum(counts.values())} documents of {len(counts)} users to {output_path}")
 
 if __name__ == "__main__":
-    compute_tfidf_from_json("documents.json", "tfidf_vectors.json")
\ No newline at end of file
+    if sys.argv[1:] == ["--convert"]:
+        # One-off migration of a dense tfidf_vectors.json written by older
+        # versions, which only held the demo user's documents.
+        convert_legacy_vectors("tfidf_vectors.json", "documents.json", os.path.join("tfidf_index", "1"))
+        mark_changed("tfidf_index")
+    elif sys.argv[1:] == ["--update"]:
+        update_tfidf_from_json("documents.json", "tfidf_index")
+    elif sys.argv[1:] == ["--passages"]:
+        compute_passages_from_json("documents.json", "tfidf_index_passages")
+    else:
+        compute_tfidf_from_json("documents.json", "tfidf_index")
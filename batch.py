@@ -0,0 +1,279 @@
+"""
+Bulk processing of cached emails by the agent.
+
+A job is a set of messages of the mail cache, picked by id or by an IMAP
+SEARCH query. The agent classifies each message and drafts a reply; labels
+and drafts are written back to the cache's `emails` and `replies` tables.
+Jobs are checkpointed in the cache as they go, so a job that was
+interrupted resumes with the messages it hadn't finished.
+
+Usage:
+    python batch.py --ids 12,13,14
+    python batch.py --query 'UNSEEN SINCE 1-Oct-2026'
+    python batch.py --resume <job_id>
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+from classifier import normalize_labels
+from reply_cache import ReplyCache, reply_cache_key
+
+# The mail cache lives in the mail_agent package.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "EmailPreviewBrowser"))
+from mail_agent.imap import ImapConnectionPool, select
+from mail_agent.mailbox import MailCache, MailboxSync
+from mail_agent.threads import is_reply_subject
+
+logger = logging.getLogger(__name__)
+
+
+def email_text(record: Dict[str, Any]) -> str:
+    """What the agent is given for a cached message: its subject and body."""
+    return f"Subject: {record['subject']}\n\n{record['body']}"
+
+
+def merge_labels(stored: Sequence[str], agent_labels: Sequence[str]) -> List[str]:
+    """Adds the agent's labels, like "(work)", to a message's stored ones, like "Work"."""
+    labels = list(stored)
+    for label in normalize_labels(agent_labels):
+        if label not in normalize_labels(labels):
+            labels.append(label.capitalize())
+    return labels
+
+
+def create_job(cache: MailCache, user_id: int, email_ids: Optional[Sequence[int]] = None,
+               query: Optional[str] = None, folder: str = "INBOX", pool: Optional[ImapConnectionPool] = None,
+               sync: Optional[MailboxSync] = None) -> str:
+    """
+    Creates a batch job over cached messages and returns its id.
+
+    Args:
+        cache: Mail cache holding the messages.
+        user_id: Owner of the messages.
+        email_ids: Row ids of the messages; ids that aren't cached messages
+            of the user are left out.
+        query: IMAP SEARCH criteria, e.g. 'UNSEEN', run in `folder` instead;
+            the folder is synced over `pool` with `sync` first, so all the
+            matches are in the cache.
+    """
+    if (email_ids is None) == (query is None):
+        raise ValueError("Give either email ids or an IMAP query")
+    if query is not None:
+        if pool is None or sync is None:
+            raise ValueError("An IMAP query needs a connection pool and a mailbox sync")
+        sync.refresh(pool, folder)
+        with pool.connection() as conn:
+            select(conn, folder)
+            typ, data = conn.uid("SEARCH", None, query)
+        if typ != "OK":
+            raise ValueError(f"IMAP search failed: {data}")
+        email_ids = cache.ids(user_id, folder, [int(uid) for uid in data[0].split()])
+        source = {"query": query, "folder": folder}
+    else:
+        requested = len(email_ids)
+        # Unknown ids could never be processed, so the job would never finish.
+        email_ids = cache.known_ids(user_id, list(email_ids))
+        if requested and not email_ids:
+            raise ValueError("None of the given emails are in the mail cache")
+        source = {"ids": len(email_ids), "unknown": requested - len(email_ids)}
+    job_id = uuid.uuid4().hex
+    cache.create_job(job_id, user_id, email_ids, json.dumps(source))
+    return job_id
+
+
+class BatchRunner:
+    """
+    Runs an agent over the messages of batch jobs on a bounded pool of workers.
+
+    Messages are taken in chunks of `chunk_size`. Each chunk is classified in
+    one call of the agent's classifier, messages with the same normalised
+    content share one agent call (and the reply cache, when given), and the
+    chunk's labels, replies and checkpoint are written in one transaction.
+    At most `workers` agent calls run at once, and the next chunk is queued
+    while the previous one is written, so the workers never wait on the
+    database.
+
+    Attributes:
+        progress: Per job, counts of messages done and left, processed by
+            the current run, agent calls, escalations to the LLM and failed
+            messages with the last error, and the run's elapsed seconds and
+            emails per minute. A failed message stays pending, so resuming
+            the job retries it.
+    """
+
+    def __init__(self, agent, cache: MailCache, workers: int = 4, chunk_size: int = 64,
+                 reply_cache: Optional[ReplyCache] = None):
+        self.agent = agent
+        self.cache = cache
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.reply_cache = reply_cache
+        self.progress: Dict[str, Dict[str, Any]] = {}
+        self._running: Dict[str, threading.Thread] = {}
+        self._lock = threading.Lock()
+
+    def start(self, job_id: str) -> bool:
+        """Runs a job in a background thread; False if it's already running."""
+        with self._lock:
+            if job_id in self._running and self._running[job_id].is_alive():
+                return False
+            thread = threading.Thread(target=self._run_in_background, args=(job_id,), daemon=True)
+            self._running[job_id] = thread
+        thread.start()
+        return True
+
+    def run(self, job_id: str, on_progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """
+        Processes the messages of a job that aren't done yet.
+
+        Args:
+            job_id: Id returned by `create_job`.
+            on_progress: Called with the job's progress after each chunk.
+
+        Returns:
+            The job's final progress.
+        """
+        job = self.cache.job(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        pending = self.cache.pending_items(job_id)
+        progress = self.progress[job_id] = {
+            "job_id": job_id, "total": job["total"], "done": job["total"] - len(pending), "left": len(pending),
+            "processed": 0, "agent_calls": 0, "escalated": 0, "errors": 0, "last_error": None,
+            "seconds": 0.0, "emails_per_min": 0.0,
+        }
+        start = time.perf_counter()
+        in_flight: Deque[Tuple[List[Dict[str, Any]], Dict[str, Future], Dict[str, Dict[str, Any]]]] = deque()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for offset in range(0, len(pending), self.chunk_size):
+                chunk = pending[offset:offset + self.chunk_size]
+                records = self.cache.records(job["user_id"], chunk)
+                if len(records) < len(chunk):
+                    # Messages removed from the cache since the job was created can't be processed.
+                    gone = set(chunk) - {record["id"] for record in records}
+                    self.cache.drop_items(job_id, gone)
+                    progress["total"] -= len(gone)
+                    progress["left"] -= len(gone)
+                in_flight.append((records, *self._submit(pool, records, progress)))
+                if len(in_flight) > 1:
+                    self._save(job_id, job["user_id"], *in_flight.popleft(), progress, start, on_progress)
+            while in_flight:
+                self._save(job_id, job["user_id"], *in_flight.popleft(), progress, start, on_progress)
+        return progress
+
+    def _run_in_background(self, job_id: str):
+        try:
+            self.run(job_id)
+        except Exception as e:
+            # Nobody waits on the thread, so the error is only seen in the logs and the job's progress.
+            logger.exception("Batch job %s stopped", job_id)
+            self.progress.setdefault(job_id, {"job_id": job_id})["last_error"] = repr(e)
+
+    def _submit(self, pool: ThreadPoolExecutor, records: List[Dict[str, Any]],
+                progress: Dict[str, Any]) -> Tuple[Dict[str, Future], Dict[str, Dict[str, Any]]]:
+        """
+        Starts one agent call per distinct message of a chunk that isn't in
+        the reply cache; returns the calls and the cached replies, by reply
+        cache key.
+        """
+        texts = [email_text(record) for record in records]
+        classifier = getattr(self.agent, "classifier", None)
+        classifications = classifier.classify(texts) if classifier else [None] * len(texts)
+        futures: Dict[str, Future] = {}
+        cached: Dict[str, Dict[str, Any]] = {}
+        for record, text, classification in zip(records, texts, classifications):
+            key = record["reply_key"] = reply_cache_key(text, self.agent)
+            if key in futures or key in cached:
+                continue
+            response = self.reply_cache.get(key) if self.reply_cache else None
+            if response is not None:
+                cached[key] = response
+            else:
+                futures[key] = pool.submit(self.agent.run, text, None, None, classification)
+                progress["agent_calls"] += 1
+        return futures, cached
+
+    def _save(self, job_id: str, user_id: int, records: List[Dict[str, Any]], futures: Dict[str, Future],
+              cached: Dict[str, Dict[str, Any]], progress: Dict[str, Any], start: float, on_progress: Optional[Callable[[Dict[str, Any]], None]]):
+        """Waits for a chunk's agent calls and writes its results and checkpoint."""
+        results = []
+        for record in records:
+            key = record["reply_key"]
+            try:
+                response = cached[key] if key in cached else futures[key].result()
+            except Exception as e:
+                logger.exception("Batch job %s: the agent failed on email %s", job_id, record["id"])
+                progress["errors"] += 1
+                progress["last_error"] = f"Email {record['id']}: {e!r}"
+                continue
+            classification = response.get("classification") or {"labels": [], "source": "local"}
+            subject = record["subject"] if is_reply_subject(record["subject"]) else f"Re: {record['subject']}"
+            results.append({
+                "email_id": record["id"],
+                "labels": merge_labels(record["labels"], classification["labels"]),
+                "subject": subject,
+                "content": response.get(self.agent.output_key, ""),
+            })
+            progress["escalated"] += classification["source"] == "llm"
+        self.cache.save_results(job_id, user_id, results)
+        if self.reply_cache:
+            for key, future in futures.items():
+                if future.exception() is None:
+                    self.reply_cache.put(key, future.result())
+
+        progress["done"] += len(results)
+        progress["left"] -= len(results)
+        progress["processed"] += len(results)
+        progress["seconds"] = round(time.perf_counter() - start, 3)
+        progress["emails_per_min"] = round(progress["processed"] * 60 / max(progress["seconds"], 1e-9), 1)
+        if on_progress:
+            on_progress(progress)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify and draft replies for many cached emails at once.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--ids", help="Comma-separated ids of cached emails")
+    source.add_argument("--query", help="IMAP SEARCH criteria, e.g. 'UNSEEN'")
+    source.add_argument("--resume", metavar="JOB_ID", help="Finish an interrupted job")
+    parser.add_argument("--folder", default="INBOX", help="Folder searched by --query")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("BATCH_WORKERS", "4")))
+    parser.add_argument("--chunk-size", type=int, default=int(os.getenv("BATCH_CHUNK_SIZE", "64")))
+    args = parser.parse_args()
+
+    # Imported here: main imports this module for its /batch routes.
+    from main import reply_cache, root_agent
+    from mail_agent.agent import mail_cache, mail_pool, mailbox_sync
+    from mail_agent.logs import configure_logging
+
+    configure_logging()
+
+    if args.resume:
+        job_id = args.resume
+        if mail_cache.job(job_id) is None:
+            print(f"Error: No batch job {job_id}")
+            return
+    else:
+        ids = [int(i) for i in args.ids.split(",")] if args.ids else None
+        job_id = create_job(mail_cache, mailbox_sync.user_id, ids, args.query, args.folder,
+                            pool=mail_pool() if args.query else None, sync=mailbox_sync)
+        print(f"Batch job {job_id}")
+
+    runner = BatchRunner(root_agent, mail_cache, workers=args.workers, chunk_size=args.chunk_size,
+                         reply_cache=reply_cache)
+    progress = runner.run(job_id, on_progress=lambda p: print(
+        f"{p['done']}/{p['total']} emails, {p['emails_per_min']} emails/min", file=sys.stderr))
+    print(json.dumps(progress, indent=2))
+
+
+if __name__ == "__main__":
+    main()
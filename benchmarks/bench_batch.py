@@ -0,0 +1,114 @@
+"""
+Throughput of processing a backlog of cached emails: one agent call and
+one write per email, the way a loop over POST /run would, vs batch jobs on
+worker pools of growing size. Also interrupts a job halfway and checks that
+resuming it processes every email exactly once. The agent is a stub that
+blocks like an LLM call would.
+
+Usage: python benchmarks/bench_batch.py
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch import BatchRunner, create_job, email_text, merge_labels
+from classifier import EmailClassifier
+from corpus import make_emails
+from mail_agent.mailbox import MailCache, email_record
+from mail_agent.mime import parse_message
+
+EMAILS = 1_000
+AGENT_SECONDS = 0.02
+WORKERS = [1, 4, 16]
+USER_ID = 1
+
+
+class StubAgent:
+    output_key = "email_assistant_output"
+    instruction = "Answer with short sentences."
+    model = "stub"
+    tools = []
+
+    def __init__(self, fail_after=None):
+        self.classifier = EmailClassifier()
+        self.fail_after = fail_after
+        self.calls = 0
+
+    def run(self, user_input: str, history=None, documents=None, classification=None):
+        self.calls += 1
+        if self.fail_after is not None and self.calls > self.fail_after:
+            raise RuntimeError("worker crashed")
+        if classification is None:
+            classification = self.classifier.classify([user_input])[0]
+        time.sleep(AGENT_SECONDS)
+        return {
+            self.output_key: f"Thanks for your email about {user_input.splitlines()[0][9:]}.",
+            "documents": [],
+            "classification": {"labels": [f"({label})" for label in classification.labels],
+                               "source": "llm" if classification.escalate else "local"},
+        }
+
+
+def _cache(path: str) -> MailCache:
+    cache = MailCache(path)
+    records = [email_record(parse_message([raw]), uid) for uid, raw in enumerate(make_emails(EMAILS), 1)]
+    cache.add(USER_ID, "INBOX", records)
+    return cache
+
+
+def one_by_one(cache: MailCache, ids):
+    agent = StubAgent()
+    job_id = create_job(cache, USER_ID, ids)
+    start = time.perf_counter()
+    for record in cache.records(USER_ID, ids):
+        response = agent.run(email_text(record))
+        cache.save_results(job_id, USER_ID, [{
+            "email_id": record["id"],
+            "labels": merge_labels(record["labels"], response["classification"]["labels"]),
+            "subject": f"Re: {record['subject']}",
+            "content": response[agent.output_key],
+        }])
+    elapsed = time.perf_counter() - start
+    return {"seconds": round(elapsed, 2), "emails_per_min": round(len(ids) * 60 / elapsed)}
+
+
+def batched(cache: MailCache, ids, workers: int):
+    runner = BatchRunner(StubAgent(), cache, workers=workers)
+    progress = runner.run(create_job(cache, USER_ID, ids))
+    return {key: progress[key] for key in ("seconds", "emails_per_min", "agent_calls")}
+
+
+def resumed(cache: MailCache, ids):
+    job_id = create_job(cache, USER_ID, ids)
+    replies_before = cache._db.execute("SELECT COUNT(*) FROM replies").fetchone()[0]
+    # Failed messages are counted and left pending, for the resumed run to retry.
+    failed_run = BatchRunner(StubAgent(fail_after=len(ids) // 2), cache, workers=4).run(job_id)
+    done_before_crash = cache.job(job_id)["done"]
+    progress = BatchRunner(StubAgent(), cache, workers=4).run(job_id)
+    replies = cache._db.execute("SELECT COUNT(*) FROM replies").fetchone()[0] - replies_before
+    return {
+        "done_before_crash": done_before_crash,
+        "failed_before_crash": failed_run["errors"],
+        "processed_on_resume": progress["processed"],
+        "replies_written": replies,
+        "each_email_once": replies == len(ids) == progress["done"],
+    }
+
+
+def run():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = _cache(os.path.join(tmp, "mail_cache.db"))
+        ids = cache.ids(USER_ID, "INBOX", range(1, EMAILS + 1))
+        results = {"emails": EMAILS, "agent_seconds": AGENT_SECONDS, "one_by_one": one_by_one(cache, ids)}
+        for workers in WORKERS:
+            results[f"batch_{workers}_workers"] = batched(cache, ids, workers)
+        results["crash_and_resume"] = resumed(cache, ids)
+    return results
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=2))
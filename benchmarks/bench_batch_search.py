@@ -0,0 +1,38 @@
+"""
+Query throughput of batched search_many vs one search call per query.
+
+Usage: python benchmarks/bench_batch_search.py
+"""
+import json
+import time
+
+from corpus import make_documents, make_queries
+from mail_agent.index import DocumentIndex
+
+N_DOCUMENTS = 50_000
+BATCH_SIZES = [1, 2, 4, 8, 16, 32, 64, 128, 256]
+
+
+def run(n_documents: int = N_DOCUMENTS, batch_sizes=BATCH_SIZES, n_queries: int = 512):
+    index = DocumentIndex.from_documents(make_documents(n_documents))
+    queries = make_queries(n_queries)
+
+    start = time.perf_counter()
+    for query in queries:
+        index.search(query)
+    sequential_qps = n_queries / (time.perf_counter() - start)
+
+    results = []
+    for batch_size in batch_sizes:
+        start = time.perf_counter()
+        for i in range(0, n_queries, batch_size):
+            index.search_many(queries[i:i + batch_size])
+        results.append({
+            "batch_size": batch_size,
+            "queries_per_s": round(n_queries / (time.perf_counter() - start), 1),
+        })
+    return {"documents": n_documents, "sequential_queries_per_s": round(sequential_qps, 1), "batched": results}
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=2))
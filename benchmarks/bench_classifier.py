@@ -0,0 +1,51 @@
+"""
+Local pre-classification of an email backlog: batch throughput, the share
+of emails still escalated to the LLM, and the accuracy of the labels
+decided locally, with the rules alone and with the trained model.
+
+Usage: python benchmarks/bench_classifier.py
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from classifier import EmailClassifier
+from corpus import make_labelled_emails
+
+N_TRAIN = 2_000
+N_BACKLOG = 10_000
+
+
+def _evaluate(classifier: EmailClassifier, texts, truth):
+    start = time.perf_counter()
+    results = classifier.classify(texts)
+    elapsed = time.perf_counter() - start
+    local = [(r, t) for r, t in zip(results, truth) if not r.escalate]
+    return {
+        "batch_seconds": round(elapsed, 3),
+        "emails_per_s": round(len(texts) / elapsed),
+        "llm_call_rate": round(1 - len(local) / len(texts), 4),
+        "local_exact_match": round(sum(set(r.labels) == set(t) for r, t in local) / len(local), 4) if local else None,
+    }
+
+
+def run(n_train: int = N_TRAIN, n_backlog: int = N_BACKLOG):
+    train_texts, train_labels = make_labelled_emails(n_train, seed=1)
+    texts, truth = make_labelled_emails(n_backlog, seed=2)
+
+    start = time.perf_counter()
+    trained = EmailClassifier().fit(train_texts, train_labels)
+    train_seconds = time.perf_counter() - start
+
+    return {
+        "backlog": n_backlog,
+        "rules_only": _evaluate(EmailClassifier(), texts, truth),
+        "rules_and_model": {"train_seconds": round(train_seconds, 2), **_evaluate(trained, texts, truth)},
+    }
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=2))
@@ -0,0 +1,40 @@
+"""
+Query latency of the persistent DocumentIndex as the corpus grows.
+
+Usage: python benchmarks/bench_document_index.py
+"""
+import json
+import time
+
+from corpus import make_documents, make_queries
+from mail_agent.index import DocumentIndex
+
+SCALES = [1_000, 10_000, 50_000]
+
+
+def run(scales=SCALES, n_queries: int = 200):
+    queries = make_queries(n_queries)
+    results = []
+    for n in scales:
+        documents = make_documents(n)
+
+        start = time.perf_counter()
+        index = DocumentIndex.from_documents(documents)
+        build_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for query in queries:
+            index.search(query)
+        query_ms = (time.perf_counter() - start) / n_queries * 1000
+
+        results.append({
+            "documents": n,
+            "terms": len(index.vectorizer.vocabulary_),
+            "build_s": round(build_s, 4),
+            "query_ms": round(query_ms, 4),
+        })
+    return results
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=2))
@@ -0,0 +1,86 @@
+"""
+DocumentSearchTool end to end, as the agent calls it: the user's shard is
+built and saved by build_shards, then opened through the ShardedIndexStore
+the tool searches. Reports build time, index size on disk and in memory,
+the first call (which loads the shard), and the latency and throughput of
+later calls with one query and with BATCH queries per call, for growing
+corpora.
+
+Usage: python benchmarks/bench_document_search.py
+"""
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from corpus import make_documents, make_queries
+import mail_agent.agent as agent
+from mail_agent.shards import ShardedIndexStore, build_shards
+
+SCALES = [1_000, 10_000, 50_000]
+N_CALLS = 200
+BATCH = 8
+USER_ID = "1"
+
+
+class _ToolContext:
+    # The part of the ADK's ToolContext the tool reads.
+    user_id = USER_ID
+
+
+def _disk_bytes(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def _latency(calls, queries_per_call: int):
+    seconds = []
+    for call in calls:
+        start = time.perf_counter()
+        call()
+        seconds.append(time.perf_counter() - start)
+    ms = np.array(seconds) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "queries_per_s": round(len(seconds) * queries_per_call / sum(seconds), 1),
+    }
+
+
+def run_one(n: int, tmp: str):
+    root_dir = os.path.join(tmp, str(n))
+    start = time.perf_counter()
+    build_shards(make_documents(n), root_dir)
+    build_s = time.perf_counter() - start
+
+    # The tool searches the store agent.document_shards() returns; point it at this corpus.
+    agent._document_shards = ShardedIndexStore(root_dir, memory_budget=2 ** 40, scorer=agent.search_scorer)
+    context = _ToolContext()
+    queries = make_queries(N_CALLS * BATCH)
+
+    start = time.perf_counter()
+    agent.DocumentSearchTool(queries[:1], context)
+    first_call_ms = (time.perf_counter() - start) * 1000
+
+    single = _latency([lambda q=q: agent.DocumentSearchTool([q], context) for q in queries[:N_CALLS]], 1)
+    batches = [queries[i:i + BATCH] for i in range(0, len(queries), BATCH)]
+    batched = _latency([lambda b=b: agent.DocumentSearchTool(b, context) for b in batches], BATCH)
+    return {
+        "documents": n,
+        "build_s": round(build_s, 3),
+        "index_disk_mb": round(_disk_bytes(root_dir) / 2 ** 20, 2),
+        "index_memory_mb": round(agent.document_shards().get(USER_ID).nbytes / 2 ** 20, 2),
+        "first_call_ms": round(first_call_ms, 2),
+        "single_query": single,
+        f"batch_of_{BATCH}": batched,
+    }
+
+
+def run(scales=SCALES):
+    with tempfile.TemporaryDirectory() as tmp:
+        return [run_one(n, tmp) for n in scales]
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=2))
@@ -0,0 +1,93 @@
+"""
+Relevance and latency of hybrid retrieval (BM25 over all document fields,
+LSA embeddings and reciprocal rank fusion) against the content-only TF-IDF
+index, on a synthetic corpus where relevant documents are known. Also
+compares the memory and relevance of float32, float16 and int8 embeddings,
+and index builds with a cold and a warm embedding cache.
+
+Usage: python benchmarks/bench_hybrid.py
+"""
+import json
+import tempfile
+import time
+
+import numpy as np
+
+from corpus import make_search_corpus
+from mail_agent.hybrid import EmbeddingCache, HybridIndex, LSAEncoder, QuantizedVectors, document_text
+from mail_agent.index import DocumentIndex
+from mail_agent.retrieval import top_k
+
+SCALES = [10_000, 100_000]
+N_QUERIES = 200
+K = 10
+RECALL_AT = 50
+
+
+def _relevance(found, relevant):
+    """Precision@K, recall@RECALL_AT and mean reciprocal rank of the ids found per query."""
+    precision = np.mean([len(set(ids[:K]) & rel) / K for ids, rel in zip(found, relevant)])
+    recall = np.mean([len(set(ids[:RECALL_AT]) & rel) / len(rel) for ids, rel in zip(found, relevant)])
+    mrr = np.mean([next((1 / (rank + 1) for rank, i in enumerate(ids) if i in rel), 0.0)
+                   for ids, rel in zip(found, relevant)])
+    return {"precision_at_10": round(float(precision), 4), "recall_at_50": round(float(recall), 4),
+            "mrr": round(float(mrr), 4)}
+
+
+def _measure(search_many, queries, relevant):
+    start = time.perf_counter()
+    for query in queries[:50]:
+        search_many([query])
+    single_ms = (time.perf_counter() - start) / 50 * 1000
+    start = time.perf_counter()
+    found = search_many(queries)
+    batch_ms = (time.perf_counter() - start) / len(queries) * 1000
+    return {**_relevance(found, relevant), "ms_per_query": round(single_ms, 3), "batched_ms_per_query": round(batch_ms, 3)}
+
+
+def run_one(n: int):
+    documents, queries, relevant = make_search_corpus(n, N_QUERIES)
+    result = {"documents": n}
+
+    tfidf = DocumentIndex.from_documents(documents)
+    result["tfidf_content_only"] = _measure(
+        lambda qs: [[doc["id"] for doc, _ in hits] for hits in tfidf.search_many(qs, RECALL_AT)], queries, relevant)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        start = time.perf_counter()
+        index = HybridIndex.from_documents(documents, cache=EmbeddingCache(cache_dir))
+        cold = time.perf_counter() - start
+        start = time.perf_counter()
+        warm_cache = EmbeddingCache(cache_dir)
+        HybridIndex.from_documents(documents, cache=warm_cache)
+        warm = time.perf_counter() - start
+        result["build_s"] = {"cold_cache": round(cold, 2), "warm_cache": round(warm, 2),
+                             "encoded_on_warm_build": warm_cache.encoded}
+
+    ids = np.array([doc["id"] for doc in documents])
+    result["bm25_fields"] = _measure(
+        lambda qs: [ids[rows].tolist() for rows, _ in index.bm25.search_many(qs, RECALL_AT)], queries, relevant)
+
+    def dense(qs, vectors):
+        scores = vectors.dot(index.encoder.encode(qs))
+        return [ids[top_k(np.arange(len(ids)), column, RECALL_AT, -np.inf)[0]].tolist() for column in scores.T]
+
+    result["lsa_dense"] = _measure(lambda qs: dense(qs, index.vectors), queries, relevant)
+    result["hybrid_rrf"] = _measure(
+        lambda qs: [[doc["id"] for doc, _ in hits] for hits in index.search_many(qs, RECALL_AT)], queries, relevant)
+
+    float32 = index.encoder.encode([document_text(doc) for doc in documents])
+    result["embeddings"] = {}
+    for dtype in ("float32", "float16", "int8"):
+        vectors = QuantizedVectors.quantize(float32, dtype)
+        result["embeddings"][dtype] = {"mb": round(vectors.nbytes / 2 ** 20, 2),
+                                       **_relevance(dense(queries, vectors), relevant)}
+    return result
+
+
+def run(scales=SCALES):
+    return [run_one(n) for n in scales]
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=2))
@@ -0,0 +1,62 @@
+"""
+Round trips, bytes and latency of get_latest_emails-style fetches: a new
+login and one RFC822 FETCH per message, vs a pooled connection and one
+header-only FETCH for the whole range. Runs against a local IMAP stand-in.
+
+Usage: python benchmarks/bench_imap.py
+"""
+import email
+import imaplib
+import json
+import time
+
+from corpus import make_emails
+from imap_server import ImapStandIn
+from mail_agent.imap import ImapConnectionPool, latest_headers
+
+N_MESSAGES = 2_000
+BODY_WORDS = 5_000
+CALLS = 20
+LATEST = 5
+CRITERIA = 'OR SUBJECT "Re:" SUBJECT "R:"'
+
+
+def legacy_fetch(port: int, n: int):
+    """What get_latest_emails used to do on every call."""
+    mail = imaplib.IMAP4("127.0.0.1", port)
+    mail.login("user", "password")
+    mail.select("inbox")
+    _, data = mail.search(None, CRITERIA)
+    result = []
+    for eid in data[0].split()[-n:]:
+        _, msg_data = mail.fetch(eid, "(RFC822)")
+        result.append(email.message_from_bytes(msg_data[0][1]))
+    mail.logout()
+    return result
+
+
+def _measure(server: ImapStandIn, fetch):
+    server.reset_counters()
+    start = time.perf_counter()
+    for _ in range(CALLS):
+        headers = [(msg["From"], msg["Subject"]) for msg in fetch()]
+    elapsed = time.perf_counter() - start
+    return headers, {
+        "round_trips_per_call": server.round_trips / CALLS,
+        "bytes_per_call": server.bytes_sent // CALLS,
+        "ms_per_call": round(elapsed / CALLS * 1000, 2),
+    }
+
+
+def run(n_messages: int = N_MESSAGES, latest: int = LATEST):
+    with ImapStandIn(make_emails(n_messages, body_words=BODY_WORDS)) as server:
+        pool = ImapConnectionPool("127.0.0.1", "user", "password", port=server.port, ssl=False)
+        legacy_headers, legacy = _measure(server, lambda: legacy_fetch(server.port, latest))
+        pooled_headers, pooled = _measure(server, lambda: latest_headers(pool, CRITERIA, latest))
+        pool.close()
+    assert legacy_headers == pooled_headers
+    return {"messages": n_messages, "latest": latest, "calls": CALLS, "legacy": legacy, "pooled": pooled}
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=2))
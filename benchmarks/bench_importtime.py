@@ -0,0 +1,103 @@
+"""
+Cold-start cost of the agent's modules: each is imported in a fresh
+interpreter under `python -X importtime`, and the cumulative import time of
+the module (median of REPEATS runs) is checked against a budget. Heavy
+dependencies (the ADK, google.genai, scikit-learn) must only load on first
+use, so importing any of these modules must not pull them in. The heaviest
+modules each import brings in are listed, to show what a regression added.
+
+With --warm-up, also times main.warm_up(), which loads what the server's
+first request would otherwise wait for.
+
+Exits with status 1 when a budget is exceeded or a heavy dependency is
+imported eagerly, so it can run as a check.
+
+Usage: python benchmarks/bench_importtime.py [--warm-up]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPEATS = 5
+TOP = 5
+
+# Milliseconds; generous enough for slow machines, far below an eager import
+# of scikit-learn or the ADK (about a second each).
+BUDGETS_MS = {
+    "mail_agent": 50,
+    "mail_agent.agent": 300,
+    "AgentEmail.agent": 300,
+    "classifier": 400,
+    "batch": 400,
+    "main": 1500,
+}
+LAZY = ["google.adk", "google.genai", "sklearn"]
+
+
+def _env():
+    env = dict(os.environ)
+    paths = [os.path.join(ROOT, "EmailPreviewBrowser"), ROOT]
+    env["PYTHONPATH"] = os.pathsep.join(paths + ([env["PYTHONPATH"]] if env.get("PYTHONPATH") else []))
+    return env
+
+
+def import_profile(module: str):
+    """Cumulative microseconds of each module imported by `import module` in a fresh interpreter."""
+    statement = f"import {module}" if module else "pass"
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                               cwd=ROOT, env=_env(), capture_output=True, text=True, check=True)
+    cumulative = {}
+    for line in completed.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, total, name = line[len("import time:"):].split("|")
+        if total.strip().isdigit():
+            cumulative[name.strip()] = int(total)
+    return cumulative
+
+
+def run(repeats: int = REPEATS):
+    result, failures = {}, []
+    # Modules the interpreter imports at startup (site, .pth files) aren't the app's.
+    startup = set(import_profile(""))
+    for module, budget in BUDGETS_MS.items():
+        profiles = [import_profile(module) for _ in range(repeats)]
+        profile = {name: us for name, us in profiles[-1].items() if name not in startup}
+        milliseconds = statistics.median(p[module] for p in profiles) / 1000
+        eager = [lazy for lazy in LAZY if any(name == lazy or name.startswith(lazy + ".") for name in profile)]
+        heaviest = sorted(((us, name) for name, us in profile.items() if name != module
+                           and "." not in name), reverse=True)[:TOP]
+        result[module] = {
+            "ms": round(milliseconds, 1),
+            "budget_ms": budget,
+            "modules": len(profile),
+            "heaviest_ms": {name: round(us / 1000, 1) for us, name in heaviest},
+            "eager_heavy_imports": eager,
+        }
+        if milliseconds > budget:
+            failures.append(f"import {module} took {milliseconds:.0f} ms, over its {budget} ms budget")
+        if eager:
+            failures.append(f"import {module} loads {', '.join(eager)}")
+    return {"modules": result, "failures": failures}
+
+
+def warm_up_seconds():
+    """Timings of main.warm_up() in a fresh interpreter."""
+    completed = subprocess.run(
+        [sys.executable, "-c", "import json, main; print(json.dumps(main.warm_up()))"],
+        cwd=ROOT, env=_env(), capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    result = run()
+    if "--warm-up" in sys.argv[1:]:
+        result["warm_up_s"] = warm_up_seconds()
+    print(json.dumps(result, indent=2))
+    for failure in result["failures"]:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    sys.exit(1 if result["failures"] else 0)
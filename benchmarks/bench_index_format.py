@@ -0,0 +1,60 @@
+"""
+Size and load time of the binary index format vs the legacy dense JSON vectors.
+
+Usage: python benchmarks/bench_index_format.py
+"""
+import json
+import os
+import tempfile
+import time
+
+from corpus import make_documents
+from mail_agent.index import DocumentIndex
+
+SCALES = [1_000, 10_000, 100_000]
+# Dense JSON holds one float per (document, term) pair, about 9 bytes each with
+# indent=2; beyond this it is estimated instead of written.
+MAX_DENSE_CELLS = 50_000_000
+
+
+def _dir_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def run(scales=SCALES):
+    results = []
+    for n in scales:
+        index = DocumentIndex.from_documents(make_documents(n))
+        n_terms = index.matrix.shape[1]
+        result = {"documents": n, "terms": n_terms}
+
+        with tempfile.TemporaryDirectory() as tmp:
+            index_dir = os.path.join(tmp, "tfidf_index")
+            index.save(index_dir)
+            result["binary_bytes"] = _dir_size(index_dir)
+
+            for mmap in (True, False):
+                start = time.perf_counter()
+                DocumentIndex.load(index_dir, mmap=mmap)
+                result[f"binary_load_s{'_mmap' if mmap else ''}"] = round(time.perf_counter() - start, 4)
+
+            if n * n_terms <= MAX_DENSE_CELLS:
+                vectors_file = os.path.join(tmp, "tfidf_vectors.json")
+                with open(vectors_file, "w") as f:
+                    json.dump({i: index.matrix.getrow(row).toarray().ravel().tolist()
+                               for row, i in enumerate(index.ids)}, f, indent=2)
+                result["legacy_json_bytes"] = os.path.getsize(vectors_file)
+
+                start = time.perf_counter()
+                with open(vectors_file, "r") as f:
+                    json.load(f)
+                result["legacy_json_load_s"] = round(time.perf_counter() - start, 4)
+            else:
+                result["legacy_json_bytes_estimate"] = n * n_terms * 9
+
+        results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=2))
@@ -0,0 +1,85 @@
+"""
+Cost of the instrumentation on the request path: a span around an empty
+block, rendering /metrics, and writing one per-request log line with
+print() vs the sync, async, sampled and off logging modes. Log output goes
+to a temporary file, standing in for a terminal or pipe.
+
+Usage: python benchmarks/bench_instrumentation.py
+"""
+import json
+import logging
+import sys
+import tempfile
+import time
+
+from corpus import make_documents  # noqa: F401  (puts mail_agent on sys.path)
+from mail_agent.logs import configure_logging
+from mail_agent.metrics import REGISTRY, span
+
+N_SPANS = 200_000
+N_LINES = 50_000
+MESSAGE = "Received request for app 'mail_agent' from user '1', session s1: Message about the project report"
+
+
+def span_overhead_us(n: int = N_SPANS) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        pass
+    empty = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(n):
+        with span("bench", index="tfidf"):
+            pass
+    return (time.perf_counter() - start - empty) / n * 1e6
+
+
+def render_ms() -> float:
+    for i in range(50):
+        with span("bench_render", route=f"/route{i}"):
+            pass
+    start = time.perf_counter()
+    text = REGISTRY.render()
+    return round((time.perf_counter() - start) * 1000, 2), len(text.splitlines())
+
+
+def log_line_us(mode, n: int = N_LINES) -> float:
+    """Microseconds per line on the calling thread, until the output is flushed."""
+    with tempfile.TemporaryFile("w") as out:
+        stderr, sys.stderr = sys.stderr, out
+        try:
+            if mode in ("print", "print, flushed"):
+                # Flushed per line is how print() behaves on a terminal.
+                flush = mode == "print, flushed"
+                start = time.perf_counter()
+                for i in range(n):
+                    print(f"{MESSAGE} {i}", file=out, flush=flush)
+                calling = time.perf_counter() - start
+            else:
+                configure_logging(*mode)
+                logger = logging.getLogger("bench")
+                start = time.perf_counter()
+                for i in range(n):
+                    logger.info("%s %d", MESSAGE, i)
+                calling = time.perf_counter() - start
+                configure_logging("off")  # stops the listener, writing what's queued
+        finally:
+            sys.stderr = stderr
+    return round(calling / n * 1e6, 2)
+
+
+def run():
+    result = {"span_overhead_us": round(span_overhead_us(), 2)}
+    result["render_ms"], result["render_lines"] = render_ms()
+    result["log_line_us"] = {
+        "print": log_line_us("print"),
+        "print, flushed": log_line_us("print, flushed"),
+        "sync": log_line_us(("sync", 1.0)),
+        "async": log_line_us(("async", 1.0)),
+        "async, 1% sampled": log_line_us(("async", 0.01)),
+        "off": log_line_us(("off", 1.0)),
+    }
+    return result
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=2))
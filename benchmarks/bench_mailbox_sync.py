@@ -0,0 +1,86 @@
+"""
+Cost of keeping a local mailbox cache up to date: a full first sync, then
+incremental syncs that each see a few new messages and flag changes, for
+growing inbox sizes. Also compares a reply query against the cache with the
+server-side SEARCH it replaces. Runs against a local IMAP stand-in.
+
+Usage: python benchmarks/bench_mailbox_sync.py
+"""
+import json
+import os
+import tempfile
+import time
+
+from corpus import make_emails
+from imap_server import ImapStandIn
+from mail_agent.imap import ImapConnectionPool, latest_headers
+from mail_agent.mailbox import MailCache, MailboxSync
+
+INBOX_SIZES = [1_000, 5_000, 20_000]
+NEW_PER_SYNC = 10
+FLAG_CHANGES_PER_SYNC = 5
+SYNCS = 10
+CRITERIA = 'OR SUBJECT "Re:" SUBJECT "R:"'
+
+
+def _timed(server, fn):
+    server.reset_counters()
+    start = time.perf_counter()
+    result = fn()
+    return result, {
+        "ms": round((time.perf_counter() - start) * 1000, 2),
+        "round_trips": server.round_trips,
+        "bytes": server.bytes_sent,
+    }
+
+
+def run_one(inbox_size: int):
+    emails = make_emails(inbox_size + NEW_PER_SYNC * SYNCS, body_words=100)
+    with ImapStandIn(emails[:inbox_size]) as server, tempfile.TemporaryDirectory() as tmp:
+        pool = ImapConnectionPool("127.0.0.1", "user", "password", port=server.port, ssl=False)
+        cache = MailCache(os.path.join(tmp, "mail.db"))
+        sync = MailboxSync(cache)
+        with pool.connection() as conn:
+            _, first = _timed(server, lambda: sync.sync(conn))
+
+            incremental = []
+            for i in range(SYNCS):
+                for raw in emails[inbox_size + i * NEW_PER_SYNC:inbox_size + (i + 1) * NEW_PER_SYNC]:
+                    server.mailbox.append(raw)
+                for uid in server.mailbox.uids[i * FLAG_CHANGES_PER_SYNC:(i + 1) * FLAG_CHANGES_PER_SYNC]:
+                    server.mailbox.set_flags(uid, ["\\Seen"])
+                counts, cost = _timed(server, lambda: sync.sync(conn))
+                assert counts == {"added": NEW_PER_SYNC, "updated": FLAG_CHANGES_PER_SYNC, "removed": 0}
+                incremental.append(cost)
+
+            # With CONDSTORE, a sync that finds nothing new fetches nothing at
+            # all; without it, it refetches the flags of the whole inbox.
+            counts, unchanged = _timed(server, lambda: sync.sync(conn))
+            assert counts == {"added": 0, "updated": 0, "removed": 0}
+            assert not [c for c in server.commands if "FETCH" in c.upper()], server.commands
+
+        _, server_query = _timed(server, lambda: latest_headers(pool, CRITERIA, 5))
+        start = time.perf_counter()
+        cached = cache.latest_replies(sync.user_id, 5)
+        cache_query_ms = round((time.perf_counter() - start) * 1000, 2)
+        assert [m["subject"] for m in cached] == [m["Subject"] for m in latest_headers(pool, CRITERIA, 5)]
+        pool.close()
+
+    return {
+        "inbox_size": inbox_size,
+        "first_sync": first,
+        # Fetching, parsing and caching every message of the inbox.
+        "first_sync_messages_per_s": round(inbox_size / first["ms"] * 1000, 1),
+        "first_sync_mb_per_s": round(first["bytes"] / 2 ** 20 / first["ms"] * 1000, 2),
+        "incremental_sync": {key: round(sum(c[key] for c in incremental) / SYNCS, 2) for key in first},
+        "unchanged_sync": unchanged,
+        "reply_query_ms": {"server": server_query["ms"], "cache": cache_query_ms},
+    }
+
+
+def run(inbox_sizes=INBOX_SIZES):
+    return [run_one(size) for size in inbox_sizes]
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=2))
@@ -0,0 +1,93 @@
+"""
+Peak memory and time of parsing messages with multi-MB attachments:
+email.message_from_bytes on the whole message vs the streaming parser
+reading it in chunks, plus the cost of syncing such a mailbox over a local
+IMAP stand-in with partial FETCHes.
+
+Usage: python benchmarks/bench_mime.py
+"""
+import email
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from corpus import make_email_with_attachment
+from imap_server import ImapStandIn
+from mail_agent.imap import ImapConnectionPool
+from mail_agent.mailbox import MailCache, MailboxSync
+from mail_agent.mime import parse_message, read_chunks
+
+ATTACHMENT_MB = [1, 5, 20]
+MESSAGES = 5
+
+
+def _peak(fn):
+    # Timed separately, since tracing allocations slows the parsers down unevenly.
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    result = fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {"peak_mb": round(peak / 2 ** 20, 2), "ms": round(elapsed * 1000, 1)}
+
+
+def legacy_parse(path: str):
+    with open(path, "rb") as f:
+        msg = email.message_from_bytes(f.read())
+    return msg["Subject"], msg["From"]
+
+
+def streaming_parse(path: str, spool_dir: str):
+    with open(path, "rb") as f:
+        parsed = parse_message(read_chunks(f), spool_dir=spool_dir)
+    return parsed.headers["Subject"], parsed.headers["From"]
+
+
+def run_one(attachment_mb: int):
+    emails = [make_email_with_attachment(i, attachment_mb * 2 ** 20) for i in range(MESSAGES)]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "message.eml")
+        with open(path, "wb") as f:
+            f.write(emails[0])
+        spool_dir = os.path.join(tmp, "spool")
+        os.makedirs(spool_dir)
+        legacy_headers, legacy = _peak(lambda: legacy_parse(path))
+        streaming_headers, streaming = _peak(lambda: streaming_parse(path, spool_dir))
+        assert legacy_headers == streaming_headers
+
+        with ImapStandIn(emails) as server:
+            pool = ImapConnectionPool("127.0.0.1", "user", "password", port=server.port, ssl=False)
+            sync = MailboxSync(MailCache(os.path.join(tmp, "mail.db")))
+            server.reset_counters()
+            start = time.perf_counter()
+            with pool.connection() as conn:
+                counts = sync.sync(conn)
+            seconds = time.perf_counter() - start
+            imap_sync = {
+                "ms": round(seconds * 1000, 1),
+                "round_trips": server.round_trips,
+                "mb_received": round(server.bytes_sent / 2 ** 20, 2),
+                "mb_per_s": round(server.bytes_sent / 2 ** 20 / seconds, 1),
+            }
+            assert counts["added"] == MESSAGES
+            pool.close()
+
+    return {
+        "attachment_mb": attachment_mb,
+        "message_mb": round(len(emails[0]) / 2 ** 20, 2),
+        "parse": {"message_from_bytes": legacy, "streaming": streaming},
+        "streaming_parse_mb_per_s": round(len(emails[0]) / 2 ** 20 / streaming["ms"] * 1000, 1),
+        "imap_sync": imap_sync,
+    }
+
+
+def run(attachment_mb=ATTACHMENT_MB):
+    return [run_one(size) for size in attachment_mb]
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=2))
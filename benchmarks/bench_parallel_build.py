@@ -0,0 +1,73 @@
+"""
+Build time of the TF-IDF index when tokenising on 1, 2, 4 and 8 processes
+(map-reduce of per-chunk vocabularies), against a single-process
+TfidfVectorizer.fit_transform, for 100k documents read from a stream.
+Checks that every build finds the same vocabulary, idf and matrix.
+
+Speed-ups are bounded by the cores available, reported as "cpus". The
+map (tokenising chunks) and reduce (merging vocabularies, weighting) steps
+are also timed in one process, which gives the speed-up expected on N
+cores as single / (map / N + reduce) when fewer are available.
+
+Usage: python benchmarks/bench_parallel_build.py
+"""
+import json
+import os
+import time
+
+import numpy as np
+from sklearn.feature_extraction.text import TfidfTransformer, TfidfVectorizer
+
+from corpus import make_documents
+from mail_agent.vectorize import _count_chunk, _merge, parallel_fit_transform
+
+N_DOCUMENTS = 100_000
+WORDS_PER_DOC = 200
+WORKERS = [1, 2, 4, 8]
+CHUNK_SIZE = 2000
+
+
+def map_reduce_seconds(texts):
+    """Seconds spent in the map and reduce steps, run one after the other in this process."""
+    start = time.perf_counter()
+    chunks = [_count_chunk({"dtype": np.int64}, texts[i:i + CHUNK_SIZE]) for i in range(0, len(texts), CHUNK_SIZE)]
+    mapped = time.perf_counter()
+    _, counts = _merge(chunks)
+    TfidfTransformer().fit_transform(counts.astype(np.float64))
+    return mapped - start, time.perf_counter() - mapped
+
+
+def run(n: int = N_DOCUMENTS, workers=WORKERS):
+    texts = [doc["content"] for doc in make_documents(n, words_per_doc=WORDS_PER_DOC)]
+    result = {"documents": n, "words_per_doc": WORDS_PER_DOC, "cpus": os.cpu_count()}
+
+    reference = TfidfVectorizer()
+    start = time.perf_counter()
+    expected = reference.fit_transform(texts)
+    single = time.perf_counter() - start
+    result["single_process_s"] = round(single, 2)
+    expected.sort_indices()
+    map_s, reduce_s = map_reduce_seconds(texts)
+    result["map_s"], result["reduce_s"] = round(map_s, 2), round(reduce_s, 2)
+
+    for count in workers:
+        vectorizer = TfidfVectorizer()
+        start = time.perf_counter()
+        matrix = parallel_fit_transform(vectorizer, iter(texts), count, chunk_size=CHUNK_SIZE)
+        seconds = time.perf_counter() - start
+        matrix.sort_indices()
+        result[f"{count}_workers"] = {
+            "seconds": round(seconds, 2),
+            "speedup": round(single / seconds, 2),
+            "expected_speedup_on_enough_cores": round(single / (map_s / count + reduce_s), 2),
+            "same_vocabulary": vectorizer.vocabulary_ == reference.vocabulary_,
+            "same_idf": bool(np.array_equal(vectorizer.idf_, reference.idf_)),
+            "same_structure": bool(np.array_equal(matrix.indptr, expected.indptr)
+                                   and np.array_equal(matrix.indices, expected.indices)),
+            "max_abs_diff": float(abs(matrix - expected).max()),
+        }
+    return result
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=2))
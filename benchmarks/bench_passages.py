@@ -0,0 +1,93 @@
+"""
+Whole-document TF-IDF vs passage retrieval on long, paginated documents:
+relevance of the documents found, whether the passages returned are the
+relevant section and on its page, how much text the agent is handed per
+query, query latency, and the build's time and peak memory. The passage
+index is built from a stream of documents; the whole-document index needs
+them all in memory.
+
+Usage: python benchmarks/bench_passages.py
+"""
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from corpus import make_long_corpus
+from mail_agent.index import DocumentIndex
+from mail_agent.passages import PassageIndex
+
+SCALES = [1_000, 4_000]
+N_QUERIES = 200
+K = 5
+
+
+def _build(build):
+    """Builds twice: timed, then traced for peak memory, which tracing slows down."""
+    start = time.perf_counter()
+    build()
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    result = build()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, {"seconds": round(seconds, 2), "peak_mb": round(peak / 2 ** 20, 1)}
+
+
+def _measure(search_many, queries, relevant, context, page_of):
+    start = time.perf_counter()
+    hits = [search_many([query])[0] for query in queries]
+    ms = (time.perf_counter() - start) / len(queries) * 1000
+
+    precision, mrr, pages, chars = [], [], [], []
+    for found, rel in zip(hits, relevant):
+        ids = [doc["id"] for doc, _ in found]
+        precision.append(len(set(ids) & set(rel)) / K)
+        mrr.append(next((1 / (rank + 1) for rank, i in enumerate(ids) if i in rel), 0.0))
+        pages.extend(page_of(doc) == rel[doc["id"]] for doc, _ in found if doc["id"] in rel)
+        chars.append(sum(context(doc) for doc, _ in found))
+    return {
+        "precision_at_5": round(float(np.mean(precision)), 4),
+        "mrr": round(float(np.mean(mrr)), 4),
+        "right_page": round(float(np.mean(pages)), 4) if pages else None,
+        "context_chars_per_query": round(float(np.mean(chars))),
+        "ms_per_query": round(ms, 3),
+    }
+
+
+def run_one(n: int):
+    _, queries, relevant = make_long_corpus(n, N_QUERIES)
+    result = {"documents": n}
+
+    # Both builds include generating the documents, so their memory is
+    # what holding the corpus costs.
+    tfidf, result["whole_documents_build"] = _build(
+        lambda: DocumentIndex.from_documents(list(make_long_corpus(n, N_QUERIES)[0])))
+    result["whole_documents"] = _measure(
+        lambda qs: tfidf.search_many(qs, K), queries, relevant,
+        context=lambda doc: len(doc["content"]), page_of=lambda doc: None)
+    result["whole_documents"]["right_page"] = None
+    del tfidf
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index, result["passages_build"] = _build(
+            lambda: PassageIndex.build(make_long_corpus(n, N_QUERIES)[0], os.path.join(tmp, "1")))
+        result["passages_build"]["passages"] = index.matrix.shape[0]
+        result["passages_build"]["disk_mb"] = round(index.nbytes / 2 ** 20, 1)
+        result["passages"] = _measure(
+            lambda qs: index.search_many(qs, K), queries, relevant,
+            context=lambda doc: sum(len(p["content"]) for p in doc["passages"]),
+            page_of=lambda doc: doc["passages"][0]["page"])
+        del index
+    return result
+
+
+def run(scales=SCALES):
+    return [run_one(n) for n in scales]
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=2))
@@ -0,0 +1,64 @@
+"""
+Recall@k and latency of the exact and IVF scorers, against the previous
+dense cosine_similarity + full argsort path.
+
+Usage: python benchmarks/bench_retrieval.py
+"""
+import json
+import time
+
+import numpy as np
+
+from corpus import make_documents, make_queries
+from mail_agent.index import DocumentIndex
+from mail_agent.retrieval import ExactScorer, IVFScorer
+
+SCALES = [10_000, 100_000]
+N_PROBES = [1, 4, 8, 16, 32]
+K = 10
+
+
+def _dense_argsort(index, query, k):
+    query_vector = index.vectorizer.transform([query])
+    similarities = (index.matrix @ query_vector.T).toarray().ravel()
+    return similarities.argsort()[::-1][:k]
+
+
+def _time(search, queries):
+    start = time.perf_counter()
+    results = [search(query) for query in queries]
+    return results, (time.perf_counter() - start) / len(queries) * 1000
+
+
+def run(scales=SCALES, n_queries: int = 200, k: int = K):
+    queries = make_queries(n_queries)
+    results = []
+    for n in scales:
+        index = DocumentIndex.from_documents(make_documents(n))
+        query_vectors = [index.vectorizer.transform([query]) for query in queries]
+        result = {"documents": n, "k": k}
+
+        _, result["dense_argsort_ms"] = _time(lambda q: _dense_argsort(index, q, k), queries)
+
+        exact = ExactScorer().fit(index.matrix)
+        truth, result["exact_ms"] = _time(lambda q: exact.search(index.matrix, q, k)[0], query_vectors)
+
+        start = time.perf_counter()
+        ivf = IVFScorer().fit(index.matrix)
+        result["ivf_build_s"] = round(time.perf_counter() - start, 3)
+        result["ivf"] = []
+        for n_probe in N_PROBES:
+            ivf.n_probe = n_probe
+            found, latency_ms = _time(lambda q: ivf.search(index.matrix, q, k)[0], query_vectors)
+            recall = np.mean([len(set(f) & set(t)) / max(len(t), 1) for f, t in zip(found, truth)])
+            result["ivf"].append({"n_probe": n_probe, "recall_at_k": round(float(recall), 4),
+                                  "ms": round(latency_ms, 4)})
+
+        result["dense_argsort_ms"] = round(result["dense_argsort_ms"], 4)
+        result["exact_ms"] = round(result["exact_ms"], 4)
+        results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=2))
@@ -0,0 +1,140 @@
+"""
+Latency of POST /run under concurrent users, against a stub agent that
+blocks like a real LLM call would, and time to first byte of /run vs
+/run_sse.
+
+Usage: python benchmarks/bench_run_endpoint.py
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+
+import httpx
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+from classifier import EmailClassifier
+
+CONCURRENCY = [1, 8, 32, 64]
+AGENT_SECONDS = 0.05
+REPLY_TOKENS = 20
+
+
+class StubAgent:
+    # What reply_cache_key reads off the agent.
+    name = "stub"
+    model = "stub"
+    instruction = ""
+    tools = []
+    output_key = "email_assistant_output"
+    # Classifies like Agent does, locally unless the rules are unsure.
+    classifier = EmailClassifier()
+
+    def classify(self, user_input: str):
+        local = self.classifier.classify([user_input])[0]
+        return {"labels": [f"({label})" for label in local.labels], "source": "llm" if local.escalate else "local"}
+
+    def run(self, user_input: str, history=None, documents=None, classification=None):
+        time.sleep(AGENT_SECONDS)
+        # Shaped like Agent.run's result, which /run stores in the reply cache.
+        return {self.output_key: f"Reply to: {user_input}", "documents": [],
+                "classification": self.classify(user_input)}
+
+    def run_stream(self, user_input: str, history=None, documents=None, classification=None):
+        # The same total time as run, spread over the reply's tokens.
+        yield {"type": "classification", **self.classify(user_input)}
+        for i in range(REPLY_TOKENS):
+            time.sleep(AGENT_SECONDS / REPLY_TOKENS)
+            yield {"type": "token", "text": f"token{i} "}
+
+
+def _payload(i: int):
+    return {
+        "app_name": "mail_agent",
+        "user_id": "1",
+        "session_id": f"s{i}",
+        "new_message": {"role": "user", "parts": [{"text": f"Message {i} about the project report"}]},
+    }
+
+
+async def _user(client, i, n_requests, latencies, statuses):
+    for j in range(n_requests):
+        start = time.perf_counter()
+        response = await client.post("/run", json=_payload(i * n_requests + j))
+        latencies.append((response.status_code, time.perf_counter() - start))
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+
+async def _load(concurrency: int, n_requests: int):
+    # Every phase sends the same messages, so each starts without cached replies.
+    main.reply_cache.invalidate()
+    latencies, statuses = [], {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(_user(client, i, n_requests, latencies, statuses) for i in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    # Rejections return immediately, so percentiles only cover answered requests.
+    answered_ms = np.array([latency for status, latency in latencies if status == 200]) * 1000
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "statuses": statuses,
+        "p50_ms": round(float(np.percentile(answered_ms, 50)), 2),
+        "p99_ms": round(float(np.percentile(answered_ms, 99)), 2),
+        "answered_per_s": round(len(answered_ms) / elapsed, 1),
+    }
+
+
+async def _first_byte(path: str, n_requests: int):
+    # httpx's ASGI transport buffers whole responses, so the app is driven
+    # directly and the time of the first body chunk is taken from `send`.
+    main.reply_cache.invalidate()
+    first, total = [], []
+    for i in range(n_requests):
+        body = json.dumps(_payload(i)).encode()
+        received = asyncio.Event()
+        chunks = []
+
+        async def receive():
+            if not received.is_set():
+                received.set()
+                return {"type": "http.request", "body": body, "more_body": False}
+            await asyncio.Event().wait()  # the client never disconnects
+
+        async def send(message):
+            if message["type"] == "http.response.body" and message.get("body"):
+                chunks.append(time.perf_counter())
+
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+            "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+            "headers": [(b"content-type", b"application/json")], "client": ("bench", 1), "server": ("bench", 80),
+        }
+        start = time.perf_counter()
+        await main.app(scope, receive, send)
+        first.append(chunks[0] - start)
+        total.append(chunks[-1] - start)
+    return {
+        "path": path,
+        "ttfb_p50_ms": round(float(np.percentile(np.array(first) * 1000, 50)), 2),
+        "total_p50_ms": round(float(np.percentile(np.array(total) * 1000, 50)), 2),
+    }
+
+
+def run(concurrency_levels=CONCURRENCY, n_requests: int = 10):
+    main.root_agent = StubAgent()
+    # The first classification imports scikit-learn; keep it out of the timings.
+    main.root_agent.classify("warm up")
+    return {
+        "load": [asyncio.run(_load(c, n_requests)) for c in concurrency_levels],
+        "first_byte": [asyncio.run(_first_byte(path, n_requests)) for path in ("/run", "/run_sse")],
+    }
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=2))
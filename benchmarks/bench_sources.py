@@ -0,0 +1,66 @@
+"""
+Reading the document store for indexing: json.load of the whole
+documents.json vs the streaming JSON source, and one user's documents from
+the JSON file vs the paginated SQLite source. Reports seconds and peak
+memory; the streaming readers should stay flat as the store grows.
+
+Usage: python benchmarks/bench_sources.py
+"""
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from corpus import make_documents
+from mail_agent.sources import JsonDocumentSource, SqliteDocumentSource
+
+SCALES = [10_000, 50_000]
+WORDS_PER_DOC = 400
+N_USERS = 50
+
+
+def _measure(read):
+    """Seconds of an untraced read, and peak traced memory of a second one."""
+    start = time.perf_counter()
+    count = read()
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    read()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"documents": count, "seconds": round(seconds, 2), "peak_mb": round(peak / 2 ** 20, 1)}
+
+
+def _load_all(path):
+    with open(path, "r") as f:
+        documents = json.load(f)
+    return sum(1 for doc in documents if doc.get("content"))
+
+
+def run_one(n: int, tmp: str):
+    json_file = os.path.join(tmp, f"documents_{n}.json")
+    with open(json_file, "w") as f:
+        json.dump(make_documents(n, words_per_doc=WORDS_PER_DOC, n_users=N_USERS), f)
+    db = SqliteDocumentSource(os.path.join(tmp, f"documents_{n}.db"))
+    db.add(JsonDocumentSource(json_file))
+    source = JsonDocumentSource(json_file)
+
+    return {
+        "documents": n,
+        "file_mb": round(os.path.getsize(json_file) / 2 ** 20, 1),
+        "all_json_load": _measure(lambda: _load_all(json_file)),
+        "all_json_stream": _measure(lambda: sum(1 for doc in source if doc.get("content"))),
+        "all_sqlite_pages": _measure(lambda: sum(1 for doc in db if doc.get("content"))),
+        "one_user_json_stream": _measure(lambda: sum(1 for _ in source.for_user(7))),
+        "one_user_sqlite_pages": _measure(lambda: sum(1 for _ in db.for_user(7))),
+    }
+
+
+def run(scales=SCALES):
+    with tempfile.TemporaryDirectory() as tmp:
+        return [run_one(n, tmp) for n in scales]
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=2))
@@ -0,0 +1,80 @@
+"""
+Threading throughput and accuracy: building the thread index incrementally
+as messages arrive, looking up a message's conversation, and the mailbox
+rescan by subject it replaces.
+
+Usage: python benchmarks/bench_threads.py
+"""
+import email
+import json
+import time
+from email.utils import parsedate_to_datetime
+
+from corpus import make_emails
+from mail_agent.threads import ThreadIndex, message_ids, normalize_subject
+
+SIZES = [10_000, 100_000]
+LOOKUPS = 1_000
+
+
+def _headers(raw_emails):
+    headers = []
+    for raw in raw_emails:
+        msg = email.message_from_bytes(raw.split(b"\r\n\r\n", 1)[0])
+        headers.append({
+            "message_id": msg["Message-ID"],
+            "in_reply_to": message_ids(msg["In-Reply-To"]),
+            "references": message_ids(msg["References"]),
+            "subject": msg["Subject"],
+            "timestamp": parsedate_to_datetime(msg["Date"]).isoformat(),
+            "conversation": msg["X-Conversation"],
+        })
+    return headers
+
+
+def run_one(n: int):
+    headers = _headers(make_emails(n, body_words=5))
+
+    index = ThreadIndex()
+    start = time.perf_counter()
+    for h in headers:
+        index.add(h["message_id"], h["in_reply_to"], h["references"], h["subject"], h["timestamp"])
+    build_s = time.perf_counter() - start
+
+    sample = headers[::max(1, n // LOOKUPS)][:LOOKUPS]
+    start = time.perf_counter()
+    for h in sample:
+        index.members(index.thread_of(h["message_id"]))
+    lookup_us = (time.perf_counter() - start) / len(sample) * 1e6
+
+    # What the agents could do before: rescan every message for the subject.
+    start = time.perf_counter()
+    for h in sample[:20]:
+        key = normalize_subject(h["subject"])
+        [other["message_id"] for other in headers if normalize_subject(other["subject"]) == key]
+    rescan_us = (time.perf_counter() - start) / 20 * 1e6
+
+    # A message is threaded correctly when its thread holds exactly its conversation.
+    conversations = {}
+    for h in headers:
+        conversations.setdefault(h["conversation"], set()).add(h["message_id"])
+    correct = sum(
+        set(index.members(index.thread_of(h["message_id"]))) == conversations[h["conversation"]] for h in headers
+    )
+    return {
+        "messages": n,
+        "threads": len(index),
+        "conversations": len(conversations),
+        "build_messages_per_s": round(n / build_s),
+        "lookup_us": round(lookup_us, 1),
+        "subject_rescan_us": round(rescan_us, 1),
+        "correctly_threaded": round(correct / n, 4),
+    }
+
+
+def run(sizes=SIZES):
+    return [run_one(n) for n in sizes]
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=2))
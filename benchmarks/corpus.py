@@ -0,0 +1,268 @@
+"""Synthetic corpora shaped like the app's data, for offline benchmarks."""
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List
+
+# Make the mail_agent package importable when running from the repository root.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "EmailPreviewBrowser"))
+
+WORDS = [
+    "project", "timeline", "meeting", "notes", "budget", "deadline", "report", "quarter",
+    "review", "design", "requirements", "client", "contract", "invoice", "schedule", "team",
+    "resource", "allocation", "milestone", "release", "feedback", "proposal", "roadmap", "risk",
+    "sales", "marketing", "launch", "hiring", "onboarding", "training", "policy", "security",
+    "audit", "compliance", "vendor", "support", "ticket", "incident", "deployment", "server",
+    "database", "migration", "analytics", "dashboard", "metrics", "forecast", "revenue", "cost",
+    "family", "holiday", "dinner", "birthday", "travel", "flight", "hotel", "booking",
+]
+# Documents and queries are drawn mostly from one topic's slice of WORDS, so the
+# corpus has the kind of cluster structure real document stores have.
+TOPICS = [WORDS[i:i + 8] for i in range(0, len(WORDS), 8)]
+TYPES = ["pdf", "docx", "xlsx", "pptx", "txt"]
+TAGS = ["Document", "Team", "Project", "Requirements", "Finance", "Personal"]
+
+
+def _text(rng: random.Random, n_words: int, vocabulary: List[str]) -> str:
+    return " ".join(rng.choice(vocabulary) for _ in range(n_words))
+
+
+def make_documents(n: int, seed: int = 0, words_per_doc: int = 80, n_users: int = 1) -> List[Dict[str, Any]]:
+    """
+    Generates documents shaped like entries of `documents.json`.
+
+    Each document mixes words of one topic with the shared vocabulary and a
+    few rare tokens, so the vocabulary grows with the corpus as it does for
+    real document stores.
+    """
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1)
+    documents = []
+    for i in range(n):
+        topic = rng.choice(TOPICS)
+        vocabulary = topic * 6 + WORDS + [f"term{rng.randrange(max(n, 1) * 4)}" for _ in range(8)]
+        doc_type = rng.choice(TYPES)
+        documents.append({
+            "id": i + 1,
+            "userId": i % n_users + 1,
+            "name": f"Document {i + 1}.{doc_type}",
+            "type": doc_type,
+            "description": _text(rng, 12, WORDS).capitalize() + ".",
+            "date": (start + timedelta(minutes=i)).isoformat() + "Z",
+            "content": _text(rng, words_per_doc, vocabulary),
+            "tags": rng.sample(TAGS, 2),
+        })
+    return documents
+
+
+def make_queries(n: int, seed: int = 1, words_per_query: int = 4) -> List[str]:
+    """Generates short keyword queries, each about one topic."""
+    rng = random.Random(seed)
+    return [_text(rng, words_per_query, rng.choice(TOPICS)) for _ in range(n)]
+
+
+def make_emails(n: int, seed: int = 0, body_words: int = 200, reply_ratio: float = 0.5,
+                stripped_ratio: float = 0.1) -> List[bytes]:
+    """
+    Generates raw RFC 822 emails; about `reply_ratio` of them are replies to
+    a recent message, with a "Re:" subject and In-Reply-To/References
+    headers. `stripped_ratio` of the replies lose those headers, as with
+    some clients. The true conversation is in an X-Conversation header.
+    """
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1)
+    emails, sent = [], []
+    for i in range(n):
+        message_id = f"<{i + 1}@example.com>"
+        if sent and rng.random() < reply_ratio:
+            parent_id, base, topic, references, conversation = rng.choice(sent[-50:])
+            references = references + [parent_id]
+            subject = f"Re: {base}"
+            threading = "" if rng.random() < stripped_ratio else (
+                f"In-Reply-To: {parent_id}\r\nReferences: {' '.join(references[-10:])}\r\n"
+            )
+        else:
+            topic = rng.choice(TOPICS)
+            base = _text(rng, 4, topic).capitalize()
+            subject, references, conversation, threading = base, [], message_id, ""
+        sent.append((message_id, base, topic, references, conversation))
+        body = _text(rng, body_words, topic * 3 + WORDS)
+        emails.append((
+            f"Message-ID: {message_id}\r\n"
+            f"{threading}"
+            f"X-Conversation: {conversation}\r\n"
+            f"From: Sender {i % 17} <sender{i % 17}@example.com>\r\n"
+            f"To: me@example.com\r\n"
+            f"Subject: {subject}\r\n"
+            f"Date: {(start + timedelta(minutes=i)).strftime('%a, %d %b %Y %H:%M:%S +0000')}\r\n"
+            f"Content-Type: text/plain; charset=utf-8\r\n"
+            f"\r\n{body}\r\n"
+        ).encode())
+    return emails
+
+
+def make_email_with_attachment(i: int, attachment_bytes: int, seed: int = 0, body_words: int = 200) -> bytes:
+    """Generates a raw multipart email with a text body and a base64 PDF attachment of the given size."""
+    from email.message import EmailMessage
+
+    rng = random.Random(seed + i)
+    msg = EmailMessage()
+    msg["Message-ID"] = f"<att{i}@example.com>"
+    msg["From"] = f"Sender {i % 17} <sender{i % 17}@example.com>"
+    msg["To"] = "me@example.com"
+    msg["Subject"] = f"Re: {_text(rng, 4, rng.choice(TOPICS)).capitalize()}"
+    msg.set_content(_text(rng, body_words, WORDS))
+    msg.add_attachment(rng.randbytes(attachment_bytes), maintype="application", subtype="pdf",
+                       filename=f"report{i}.pdf")
+    return msg.as_bytes(policy=msg.policy.clone(linesep="\r\n"))
+
+
+
+LABEL_WORDS = {
+    "important": ["urgent", "asap", "critical", "priority", "escalation", "blocker", "attention", "now"],
+    "work": ["project", "client", "budget", "stakeholder", "spreadsheet", "kpi", "vendor", "quarter"],
+    "family": ["mom", "dad", "kids", "grandma", "dinner", "birthday", "cousin", "picnic"],
+    "deadline": ["deadline", "due", "submit", "cutoff", "latest", "overdue", "expiry", "final"],
+    "meeting": ["meeting", "agenda", "invite", "call", "standup", "room", "slot", "attendees"],
+}
+FILLER = [
+    "hi", "hello", "thanks", "please", "see", "below", "let", "me", "know", "if", "you", "have", "any",
+    "questions", "about", "the", "this", "that", "we", "our", "will", "can", "should", "would", "just",
+    "quick", "note", "update", "attached", "here", "is", "are", "on", "for", "with", "and", "best",
+    "regards", "cheers", "also", "think", "good", "great", "sounds", "plan", "idea", "some", "more",
+]
+
+
+def make_labelled_emails(n: int, seed: int = 0, words: int = 60, signal: float = 0.08):
+    """
+    Generates email texts with 0-2 true labels each, as (texts, labels).
+
+    Each label contributes words from its own vocabulary in LABEL_WORDS, only
+    some of which the classifier's rules know; `signal` is the share of such
+    words per label, the rest is filler.
+    """
+    rng = random.Random(seed)
+    labels = list(LABEL_WORDS)
+    texts, truth = [], []
+    for _ in range(n):
+        chosen = rng.sample(labels, rng.choice([0, 1, 1, 2]))
+        tokens = []
+        for _ in range(words):
+            if chosen and rng.random() < signal * len(chosen):
+                tokens.append(rng.choice(LABEL_WORDS[rng.choice(chosen)]))
+            else:
+                tokens.append(rng.choice(FILLER))
+        texts.append(" ".join(tokens).capitalize() + ".")
+        truth.append(sorted(chosen))
+    return texts, truth
+
+
+def make_search_corpus(n: int, n_queries: int = 200, seed: int = 0, docs_per_topic: int = 40,
+                       words_per_doc: int = 80):
+    """
+    Generates documents shaped like entries of `documents.json` together with
+    queries whose relevant documents are known, as (documents, queries, relevant).
+
+    Each topic has 20 words of its own and borrows 5 from the next topic, so
+    a query word can point to two topics. A document uses only 6 of its
+    topic's words: two in its name, two in its description and the rest in
+    its content, which is mostly filler. Queries are 2 words of a topic, so
+    most relevant documents share no word with them, and documents matching
+    only by name or description are invisible to a content-only index.
+    Relevant documents of a query are all those of its topic.
+    """
+    rng = random.Random(seed)
+    n_topics = max(1, n // docs_per_topic)
+    own = [[f"{WORDS[t % len(WORDS)]}{t}x{j}" for j in range(20)] for t in range(n_topics)]
+    vocabularies = [own[t] + own[(t + 1) % n_topics][:5] for t in range(n_topics)]
+    start = datetime(2025, 1, 1)
+
+    documents, by_topic = [], {}
+    for i in range(n):
+        topic = rng.randrange(n_topics)
+        words = rng.sample(vocabularies[topic], 6)
+        doc_type = rng.choice(TYPES)
+        documents.append({
+            "id": i + 1,
+            "userId": 1,
+            "name": f"{' '.join(words[:2]).title()} {i + 1}.{doc_type}",
+            "type": doc_type,
+            "description": f"{words[2]} {_text(rng, 4, WORDS)} {words[3]}.".capitalize(),
+            "date": (start + timedelta(minutes=i)).isoformat() + "Z",
+            "content": " ".join(rng.choice(words[3:]) if rng.random() < 0.1 else rng.choice(WORDS)
+                               for _ in range(words_per_doc)),
+            "tags": rng.sample(TAGS, 2),
+        })
+        by_topic.setdefault(topic, set()).add(i + 1)
+
+    queries, relevant = [], []
+    for _ in range(n_queries):
+        topic = rng.choice(sorted(by_topic))
+        queries.append(" ".join(rng.sample(own[topic], 2)))
+        relevant.append(by_topic[topic])
+    return documents, queries, relevant
+
+
+def make_long_corpus(n: int, n_queries: int = 200, seed: int = 0, max_pages: int = 20, page_words: int = 450,
+                     docs_per_topic: int = 10, short_ratio: float = 0.3):
+    """
+    Generates long, paginated documents with queries whose relevant documents
+    and pages are known, as (documents, queries, relevant).
+
+    Most documents have up to max_pages pages of filler separated by form
+    feeds, as extracted PDF text has, and one section about their topic, on
+    a random page, dense with that topic's words. The others are one-page
+    notes mentioning a few words of some topic in passing. Queries are 2
+    words of a topic; `relevant` maps the ids of its long documents to the
+    page of their section.
+
+    `documents` is a generator, so a corpus larger than memory can be
+    streamed; call the function again to iterate it again.
+    """
+    rng = random.Random(seed)
+    n_topics = max(1, n // docs_per_topic)
+    own = [[f"{WORDS[t % len(WORDS)]}{t}x{j}" for j in range(12)] for t in range(n_topics)]
+    plan = []
+    for i in range(n):
+        topic = rng.randrange(n_topics)
+        pages = 1 if rng.random() < short_ratio else rng.randint(max_pages // 2, max_pages)
+        plan.append((topic, pages, rng.randrange(pages)))
+
+    def documents() -> Iterator[Dict[str, Any]]:
+        start = datetime(2025, 1, 1)
+        for i, (topic, pages, section_page) in enumerate(plan):
+            doc_rng = random.Random(seed * 1_000_003 + i)
+            texts = [" ".join(doc_rng.choices(WORDS + FILLER, k=page_words)) for _ in range(pages)]
+            if pages == 1:
+                words = texts[0].split()
+                for word in doc_rng.sample(own[topic], 2):
+                    words[doc_rng.randrange(len(words))] = word
+                texts[0] = " ".join(words)
+            else:
+                section = [doc_rng.choice(own[topic]) if doc_rng.random() < 0.25 else doc_rng.choice(FILLER)
+                           for _ in range(80)]
+                words = texts[section_page].split()
+                at = doc_rng.randrange(len(words))
+                texts[section_page] = " ".join(words[:at] + section + words[at:])
+            yield {
+                "id": i + 1,
+                "userId": 1,
+                "name": f"Document {i + 1}.pdf",
+                "type": "pdf",
+                "description": _text(doc_rng, 8, WORDS).capitalize() + ".",
+                "date": (start + timedelta(minutes=i)).isoformat() + "Z",
+                "content": "\f".join(texts),
+                "tags": doc_rng.sample(TAGS, 2),
+            }
+
+    by_topic: Dict[int, Dict[int, int]] = {}
+    for i, (topic, pages, section_page) in enumerate(plan):
+        if pages > 1:
+            by_topic.setdefault(topic, {})[i + 1] = section_page + 1
+    queries, relevant = [], []
+    for _ in range(n_queries):
+        topic = rng.choice(sorted(by_topic))
+        queries.append(" ".join(rng.sample(own[topic], 2)))
+        relevant.append(by_topic[topic])
+    return documents(), queries, relevant
@@ -0,0 +1,279 @@
+"""
+Minimal in-process IMAP4rev1 server for offline benchmarks.
+
+Implements just what the app's IMAP client uses: CAPABILITY, LOGIN,
+ENABLE, SELECT/EXAMINE, SEARCH and FETCH (RFC822, BODY[] / BODY.PEEK[] and partial <start.length>
+fetches of it, HEADER.FIELDS, UID, FLAGS, MODSEQ, RFC822.SIZE and
+CHANGEDSINCE), their UID forms, NOOP and LOGOUT. Like Gmail and Dovecot,
+it only advertises CONDSTORE after LOGIN and only reports HIGHESTMODSEQ
+once a client has enabled it (RFC 7162). Each command is counted as a
+round trip, and kept in `commands`, and every byte written to clients is
+counted, so benchmarks can compare access patterns.
+"""
+import functools
+import re
+import shlex
+import socketserver
+import threading
+from email.parser import BytesHeaderParser
+from typing import FrozenSet, Iterable, List, Optional, Set
+
+CHANGED_SINCE = re.compile(r"\(CHANGEDSINCE (\d+)\)", re.IGNORECASE)
+FETCH_ITEM = re.compile(
+    r"(RFC822(?![.\w])|BODY(?:\.PEEK)?\[(?:HEADER\.FIELDS \(([^)]*)\))?\](?:<(\d+)\.(\d+)>)?)", re.IGNORECASE
+)
+
+
+def header_fields(raw: bytes, fields: List[str]) -> bytes:
+    """The requested header lines of a message, followed by the blank line."""
+    wanted = {f.lower() for f in fields}
+    header = raw.split(b"\r\n\r\n", 1)[0]
+    lines, keep = [], False
+    for line in header.split(b"\r\n"):
+        if line[:1] in (b" ", b"\t"):
+            if keep:
+                lines.append(line)
+            continue
+        keep = line.split(b":", 1)[0].decode("ascii", "replace").lower() in wanted
+        if keep:
+            lines.append(line)
+    return b"\r\n".join(lines) + b"\r\n\r\n"
+
+
+def sequence_set(spec: str, highest: int) -> List[int]:
+    numbers = []
+    for part in spec.split(","):
+        start, _, end = part.partition(":")
+        start = highest if start == "*" else int(start)
+        end = start if not end else highest if end == "*" else int(end)
+        numbers.extend(range(min(start, end), max(start, end) + 1))
+    return numbers
+
+
+@functools.lru_cache(maxsize=16)
+def _uid_set(spec: str, highest: int) -> FrozenSet[int]:
+    return frozenset(sequence_set(spec, highest))
+
+
+class Mailbox:
+    """Messages with UIDs, flags and CONDSTORE mod-sequences."""
+
+    def __init__(self, messages: Optional[List[bytes]] = None, uidvalidity: int = 1):
+        self.uidvalidity = uidvalidity
+        self.next_uid = 1
+        self.highest_modseq = 1
+        self.messages: List[bytes] = []
+        self.subjects: List[str] = []
+        self.uids: List[int] = []
+        self.flags: List[Set[str]] = []
+        self.modseqs: List[int] = []
+        for raw in messages or []:
+            self.append(raw)
+
+    def append(self, raw: bytes, flags: Iterable[str] = ()) -> int:
+        self.highest_modseq += 1
+        self.messages.append(raw)
+        self.subjects.append(BytesHeaderParser().parsebytes(raw).get("Subject", "").lower())
+        self.uids.append(self.next_uid)
+        self.flags.append(set(flags))
+        self.modseqs.append(self.highest_modseq)
+        self.next_uid += 1
+        return self.uids[-1]
+
+    def set_flags(self, uid: int, flags: Iterable[str]):
+        i = self.uids.index(uid)
+        self.highest_modseq += 1
+        self.flags[i] = set(flags)
+        self.modseqs[i] = self.highest_modseq
+
+    def expunge(self, uid: int):
+        i = self.uids.index(uid)
+        for column in (self.messages, self.subjects, self.uids, self.flags, self.modseqs):
+            del column[i]
+        self.highest_modseq += 1
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    # Responses are buffered and flushed once per command, so multi-line
+    # responses don't stall on Nagle's algorithm and delayed ACKs.
+    wbufsize = -1
+
+    def send(self, data: bytes):
+        self.wfile.write(data)
+        with self.server.lock:
+            self.server.bytes_sent += len(data)
+
+    def handle(self):
+        self.authenticated = False
+        self.condstore = False
+        self.send(b"* OK IMAP4rev1 stand-in ready\r\n")
+        self.wfile.flush()
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            tag, _, rest = line.decode().rstrip("\r\n").partition(" ")
+            command, _, args = rest.partition(" ")
+            with self.server.lock:
+                self.server.round_trips += 1
+                self.server.commands.append(rest)
+            handler = getattr(self, f"do_{command.upper()}", None)
+            if handler is None:
+                self.send(f"{tag} BAD unknown command\r\n".encode())
+            elif handler(tag, args) is False:
+                self.wfile.flush()
+                return
+            self.wfile.flush()
+
+    def do_CAPABILITY(self, tag, args):
+        capabilities = "IMAP4rev1 ENABLE CONDSTORE" if self.authenticated else "IMAP4rev1"
+        self.send(f"* CAPABILITY {capabilities}\r\n{tag} OK CAPABILITY completed\r\n".encode())
+
+    def do_LOGIN(self, tag, args):
+        self.authenticated = True
+        self.send(f"{tag} OK LOGIN completed\r\n".encode())
+
+    def do_ENABLE(self, tag, args):
+        enabled = "CONDSTORE" in args.upper().split()
+        self.condstore = self.condstore or enabled
+        self.send(f"* ENABLED{' CONDSTORE' if enabled else ''}\r\n{tag} OK ENABLE completed\r\n".encode())
+
+    def do_NOOP(self, tag, args):
+        self.send(f"{tag} OK NOOP completed\r\n".encode())
+
+    def do_LOGOUT(self, tag, args):
+        self.send(f"* BYE logging out\r\n{tag} OK LOGOUT completed\r\n".encode())
+        return False
+
+    def do_SELECT(self, tag, args, mode="READ-WRITE", command="SELECT"):
+        mailbox = self.server.mailbox
+        # SELECT ... (CONDSTORE) enables it as well.
+        self.condstore = self.condstore or "(CONDSTORE)" in args.upper()
+        modseq = f"* OK [HIGHESTMODSEQ {mailbox.highest_modseq}] highest mod-sequence\r\n" if self.condstore else ""
+        self.send((
+            f"* {len(mailbox.messages)} EXISTS\r\n* 0 RECENT\r\n"
+            f"* OK [UIDVALIDITY {mailbox.uidvalidity}] UIDs valid\r\n"
+            f"* OK [UIDNEXT {mailbox.next_uid}] next UID\r\n"
+            f"{modseq}"
+            f"{tag} OK [{mode}] {command} completed\r\n"
+        ).encode())
+
+    def do_EXAMINE(self, tag, args):
+        self.do_SELECT(tag, args, "READ-ONLY", "EXAMINE")
+
+    def do_UID(self, tag, args):
+        command, _, args = args.partition(" ")
+        if command.upper() == "SEARCH":
+            self.do_SEARCH(tag, args, by_uid=True)
+        elif command.upper() == "FETCH":
+            self.do_FETCH(tag, args, by_uid=True)
+        else:
+            self.send(f"{tag} BAD unsupported UID command\r\n".encode())
+
+    def do_SEARCH(self, tag, args, by_uid=False):
+        mailbox = self.server.mailbox
+        tokens = shlex.split(args)
+        if tokens and tokens[0].upper() == "CHARSET":
+            tokens = tokens[2:]
+        highest_uid = mailbox.uids[-1] if mailbox.uids else 0
+        matches = [
+            mailbox.uids[i] if by_uid else i + 1
+            for i, subject in enumerate(mailbox.subjects)
+            if self._matches(tokens, subject, mailbox.uids[i], highest_uid)
+        ]
+        self.send(f"* SEARCH {' '.join(map(str, matches))}\r\n{tag} OK SEARCH completed\r\n".encode())
+
+    @staticmethod
+    def _matches(tokens: List[str], subject: str, uid: int, highest_uid: int) -> bool:
+        def parse(pos):
+            key = tokens[pos].upper()
+            if key == "OR":
+                left, pos = parse(pos + 1)
+                right, pos = parse(pos)
+                return left or right, pos
+            if key == "SUBJECT":
+                return tokens[pos + 1].lower() in subject, pos + 2
+            if key == "UID":
+                return uid in _uid_set(tokens[pos + 1], highest_uid), pos + 2
+            return True, pos + 1  # ALL and anything unsupported match everything
+
+        pos, matched = 0, True
+        while pos < len(tokens):
+            result, pos = parse(pos)
+            matched = matched and result
+        return matched
+
+    def do_FETCH(self, tag, args, by_uid=False):
+        mailbox = self.server.mailbox
+        spec, _, items = args.partition(" ")
+        changed_since = CHANGED_SINCE.search(items)
+        changed_since = int(changed_since.group(1)) if changed_since else None
+        if by_uid:
+            wanted = _uid_set(spec, mailbox.uids[-1] if mailbox.uids else 0)
+            numbers = [i + 1 for i, uid in enumerate(mailbox.uids) if uid in wanted]
+        else:
+            numbers = sequence_set(spec, len(mailbox.messages))
+        for number in numbers:
+            i = number - 1
+            if changed_since is not None and mailbox.modseqs[i] <= changed_since:
+                continue
+            raw = mailbox.messages[i]
+            parts = []
+            if by_uid or re.search(r"\bUID\b", items, re.IGNORECASE):
+                parts.append(f"UID {mailbox.uids[i]}".encode())
+            if re.search(r"\bFLAGS\b", items, re.IGNORECASE):
+                parts.append(f"FLAGS ({' '.join(sorted(mailbox.flags[i]))})".encode())
+            if re.search(r"\bMODSEQ\b", items, re.IGNORECASE) or changed_since is not None:
+                parts.append(f"MODSEQ ({mailbox.modseqs[i]})".encode())
+            if re.search(r"\bRFC822\.SIZE\b", items, re.IGNORECASE):
+                parts.append(f"RFC822.SIZE {len(raw)}".encode())
+            for match in FETCH_ITEM.finditer(items):
+                if match.group(2) is not None:
+                    name, data = f"BODY[HEADER.FIELDS ({match.group(2)})]", header_fields(raw, match.group(2).split())
+                elif match.group(1).upper() == "RFC822":
+                    name, data = "RFC822", raw
+                elif match.group(3) is not None:
+                    offset, length = int(match.group(3)), int(match.group(4))
+                    name, data = f"BODY[]<{offset}>", raw[offset:offset + length]
+                else:
+                    name, data = "BODY[]", raw
+                parts.append(f"{name} {{{len(data)}}}\r\n".encode() + data)
+            self.send(f"* {number} FETCH (".encode() + b" ".join(parts) + b")\r\n")
+        self.send(f"{tag} OK FETCH completed\r\n".encode())
+
+
+class ImapStandIn(socketserver.ThreadingTCPServer):
+    """
+    Serves one mailbox on localhost in a background thread.
+
+    Use as a context manager; `port` is picked by the OS.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, messages: Optional[List[bytes]] = None):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.mailbox = Mailbox(messages)
+        self.lock = threading.Lock()
+        self.round_trips = 0
+        self.bytes_sent = 0
+        self.commands: List[str] = []
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def reset_counters(self):
+        with self.lock:
+            self.round_trips = 0
+            self.bytes_sent = 0
+            self.commands = []
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,208 @@
+"""
+Runs the offline benchmarks and writes their results to one JSON file,
+together with the commit they ran on and the machine, so that runs on two
+commits can be compared.
+
+Every benchmark is a bench_*.py module in this directory, run on synthetic
+corpora (see corpus.py) and, for IMAP, against the local stand-in server
+(see imap_server.py). There are two scales:
+- "quick" (the default) uses small corpora and takes a few minutes.
+- "full" uses the scales each module runs with on its own.
+A benchmark that fails is recorded with its error, and the others still run.
+
+--compare prints the numbers that changed by more than --threshold
+(10% by default) between two result files.
+
+Usage:
+    python benchmarks/run_all.py [--scale quick|full] [--only name,...] [--output file.json]
+    python benchmarks/run_all.py --compare old.json new.json [--threshold 0.1]
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import traceback
+from datetime import datetime, timezone
+from importlib import metadata
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS_DIR)
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, "results")
+PACKAGES = ["numpy", "scipy", "scikit-learn", "fastapi", "httpx", "google-adk"]
+
+# Benchmark name: (module, arguments of its run() at the quick scale). At the
+# full scale run() is called without arguments.
+SUITE = {
+    # Index build time, size and DocumentSearchTool latency and throughput.
+    "document_search": ("bench_document_search", {"scales": [1_000, 10_000]}),
+    "document_index": ("bench_document_index", {"scales": [1_000, 10_000]}),
+    "index_format": ("bench_index_format", {"scales": [1_000, 10_000]}),
+    "batch_search": ("bench_batch_search", {"n_documents": 10_000, "batch_sizes": [1, 8, 64]}),
+    "retrieval": ("bench_retrieval", {"scales": [10_000]}),
+    "hybrid": ("bench_hybrid", {"scales": [10_000]}),
+    "passages": ("bench_passages", {"scales": [1_000]}),
+    "parallel_build": ("bench_parallel_build", {"n": 20_000, "workers": [1, 2]}),
+    # Ingestion: document sources, MIME parsing and IMAP sync against the stand-in.
+    "sources": ("bench_sources", {"scales": [10_000]}),
+    "mime": ("bench_mime", {"attachment_mb": [1, 5]}),
+    "mailbox_sync": ("bench_mailbox_sync", {"inbox_sizes": [1_000]}),
+    "imap": ("bench_imap", {"n_messages": 500}),
+    "threads": ("bench_threads", {"sizes": [10_000]}),
+    # The agent server: /run under concurrency, classification, batch jobs.
+    "run_endpoint": ("bench_run_endpoint", {"concurrency_levels": [1, 8, 32], "n_requests": 5}),
+    "classifier": ("bench_classifier", {"n_train": 1_000, "n_backlog": 2_000}),
+    "batch": ("bench_batch", {}),
+    "importtime": ("bench_importtime", {"repeats": 3}),
+    "instrumentation": ("bench_instrumentation", {}),
+}
+
+
+def _git(*args: str) -> Optional[str]:
+    try:
+        return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> Dict[str, Any]:
+    """The commit, interpreter, machine and package versions results were measured with."""
+    packages = {}
+    for package in PACKAGES:
+        try:
+            packages[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            packages[package] = None
+    status = _git("status", "--porcelain", "--untracked-files=no")
+    return {
+        "commit": _git("rev-parse", "HEAD"),
+        "dirty": bool(status) if status is not None else None,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "packages": packages,
+    }
+
+
+def run_benchmark(name: str, scale: str) -> Dict[str, Any]:
+    module_name, quick_kwargs = SUITE[name]
+    start = time.perf_counter()
+    try:
+        module = importlib.import_module(module_name)
+        result = {"result": module.run(**(quick_kwargs if scale == "quick" else {}))}
+    except Exception:
+        result = {"error": traceback.format_exc()}
+    result["seconds"] = round(time.perf_counter() - start, 2)
+    return result
+
+
+def run(names=None, scale: str = "quick") -> Dict[str, Any]:
+    report = {**environment(), "scale": scale, "benchmarks": {}}
+    for name in names or SUITE:
+        print(f"{name}...", file=sys.stderr, flush=True)
+        report["benchmarks"][name] = outcome = run_benchmark(name, scale)
+        status = "failed" if "error" in outcome else "done"
+        print(f"{name}: {status} in {outcome['seconds']} s", file=sys.stderr, flush=True)
+    return report
+
+
+def flatten(value: Any, path: str = "") -> Iterator[Tuple[str, float]]:
+    """
+    The numbers of a result with their paths. A list item that is a dict is
+    named by its first field when that's a scale, e.g. `documents=1000`,
+    so the same measurement has the same path when scales are added.
+    """
+    if isinstance(value, bool):
+        return
+    if isinstance(value, (int, float)):
+        yield path, value
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            yield from flatten(item, f"{path}.{key}" if path else str(key))
+    elif isinstance(value, list):
+        for i, item in enumerate(value):
+            label = str(i)
+            if isinstance(item, dict) and item:
+                key, first = next(iter(item.items()))
+                if isinstance(first, (int, str)) and not isinstance(first, bool):
+                    label = f"{key}={first}"
+            yield from flatten(item, f"{path}[{label}]")
+
+
+def _state(outcome: Dict[str, Any]) -> str:
+    return "failed" if "error" in outcome else ("ok" if outcome else "not run")
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any], threshold: float = 0.1) -> str:
+    """
+    The numbers that changed by more than `threshold`, as a relative change,
+    largest first, and the benchmarks that failed in either run. Benchmarks
+    only one of the runs has are left out, e.g. after --only.
+    """
+    lines = [f"{(old.get('commit') or '?')[:12]} -> {(new.get('commit') or '?')[:12]} ({new.get('scale')} scale)"]
+    for name in sorted(set(old["benchmarks"]) | set(new["benchmarks"])):
+        before = old["benchmarks"].get(name, {})
+        after = new["benchmarks"].get(name, {})
+        if "error" in before or "error" in after:
+            lines.append(f"{name}: {_state(before)} -> {_state(after)}")
+        if "result" not in before or "result" not in after:
+            continue
+        old_values = dict(flatten(before["result"]))
+        changes = []
+        for path, value in flatten(after["result"]):
+            previous = old_values.get(path)
+            if previous is None or previous == value:
+                continue
+            change = (value - previous) / abs(previous) if previous else float("inf")
+            if abs(change) > threshold:
+                changes.append((abs(change), f"  {path}: {previous} -> {value} ({change:+.0%})"))
+        if changes:
+            lines.append(f"{name}:")
+            lines.extend(line for _, line in sorted(changes, reverse=True))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scale", choices=["quick", "full"], default="quick")
+    parser.add_argument("--only", help="Comma-separated benchmark names: " + ", ".join(SUITE))
+    parser.add_argument("--output", help="Result file; benchmarks/results/<time>-<commit>-<scale>.json by default")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two result files")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f, open(args.compare[1]) as g:
+            print(compare(json.load(f), json.load(g), args.threshold))
+        return
+
+    names = args.only.split(",") if args.only else None
+    unknown = set(names or ()) - set(SUITE)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    # Per-request log lines of the server would drown the progress output.
+    os.environ.setdefault("LOG_MODE", "off")
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, BENCHMARKS_DIR)
+    report = run(names, args.scale)
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"{stamp}-{(report['commit'] or 'nocommit')[:12]}-{args.scale}.json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    failed = [name for name, outcome in report["benchmarks"].items() if "error" in outcome]
+    print(f"Wrote {output}" + (f"; failed: {', '.join(failed)}" if failed else ""), file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
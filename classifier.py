@@ -0,0 +1,209 @@
+"""
+Local email classification that runs before the LLM.
+
+Keyword and regex rules, optionally backed by a TF-IDF + logistic
+regression model trained on labelled emails, give each label a confidence.
+Only emails with a label the classifier is unsure about are escalated to
+the LLM.
+
+Usage:
+    python classifier.py train --db EmailPreviewBrowser/server/mail_cache.db --out email_classifier.pkl
+"""
+import argparse
+import json
+import pickle
+import re
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence
+
+import numpy as np
+
+# scikit-learn takes about a second to import, so it's imported where it's
+# first used rather than when the server starts.
+if TYPE_CHECKING:
+    from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+    from sklearn.multiclass import OneVsRestClassifier
+
+LABELS = ["important", "work", "family", "deadline", "meeting"]
+# Labels used in the `emails` table that map onto the agent's labels.
+LABEL_ALIASES = {"urgent": "important", "calendar": "meeting"}
+
+KEYWORDS = {
+    "important": ["urgent", "important", "asap", "immediately", "critical", "priority", "action required",
+                  "time sensitive"],
+    "work": ["project", "client", "report", "budget", "invoice", "contract", "quarter", "team", "deployment",
+             "release", "requirements", "roadmap", "review", "proposal", "milestone"],
+    "family": ["mom", "dad", "family", "birthday", "dinner", "kids", "holiday", "grandma", "wedding", "brother",
+               "sister", "love"],
+    "deadline": ["deadline", "due", "overdue", "expires", "submit", "no later than", "end of day", "eod",
+                 "cutoff"],
+    "meeting": ["meeting", "call", "agenda", "calendar", "invite", "zoom", "teams", "standup", "sync",
+                "reschedule", "minutes"],
+}
+PATTERNS = {
+    "deadline": [r"\bby (monday|tuesday|wednesday|thursday|friday|saturday|sunday|tomorrow|tonight|noon)\b",
+                 r"\bdue (on|by|date)\b", r"\b\d{1,2}/\d{1,2}(/\d{2,4})?\b"],
+    "meeting": [r"\b\d{1,2}(:\d{2})?\s*(am|pm)\b", r"\b(mon|tues|wednes|thurs|fri)day at\b"],
+    "important": [r"!{2,}", r"\b(URGENT|IMPORTANT)\b"],
+}
+
+
+@dataclass
+class Classification:
+    """Labels of one email, each label's confidence, and whether the LLM should decide."""
+    labels: List[str]
+    confidences: Dict[str, float] = field(default_factory=dict)
+    escalate: bool = False
+
+
+def normalize_labels(labels: Sequence[str]) -> List[str]:
+    """Maps stored labels like "Work" or "(work)" to the classifier's label names."""
+    names = [LABEL_ALIASES.get(label.strip("() ").lower(), label.strip("() ").lower()) for label in labels]
+    return sorted({name for name in names if name in LABELS})
+
+
+class EmailClassifier:
+    """
+    Multi-label email classifier with escalation to the LLM.
+
+    Rules count keyword and regex hits per label in one sparse product over
+    the whole batch: two hits make a label confidently present, none
+    confidently absent, and a single hit is a guess. When a model is
+    trained, its probabilities replace the guesses and the absences, while
+    two or more rule hits still win.
+
+    An email is escalated when any label's confidence falls between `low`
+    and `high`.
+    """
+
+    def __init__(self, low: float = 0.2, high: float = 0.8):
+        self.low = low
+        self.high = high
+        # Single words are counted by a unigram vectorizer, which is much
+        # faster than one over n-grams; phrases are matched like patterns.
+        words = sorted({k for keywords in KEYWORDS.values() for k in keywords if " " not in k})
+        self._words = words
+        self._keywords: Optional["CountVectorizer"] = None
+        self._keyword_weights = np.zeros((len(words), len(LABELS)))
+        for j, label in enumerate(LABELS):
+            for keyword in KEYWORDS[label]:
+                if " " not in keyword:
+                    self._keyword_weights[words.index(keyword), j] = 1
+        phrases = {label: [rf"\b{re.escape(k)}\b" for k in keywords if " " in k] for label, keywords in KEYWORDS.items()}
+        self._patterns = [(LABELS.index(label), re.compile(p, re.IGNORECASE))
+                          for source in (phrases, PATTERNS) for label, patterns in source.items() for p in patterns]
+        self.vectorizer: Optional["TfidfVectorizer"] = None
+        self.model: Optional["OneVsRestClassifier"] = None
+
+    def fit(self, texts: Sequence[str], labels: Sequence[Sequence[str]]) -> "EmailClassifier":
+        """Trains the linear model on emails and their stored labels."""
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.linear_model import LogisticRegression
+        from sklearn.multiclass import OneVsRestClassifier
+        from sklearn.preprocessing import MultiLabelBinarizer
+
+        self.vectorizer = TfidfVectorizer(sublinear_tf=True, min_df=2, ngram_range=(1, 2), max_features=50_000)
+        X = self.vectorizer.fit_transform(texts)
+        y = MultiLabelBinarizer(classes=LABELS).fit_transform([normalize_labels(l) for l in labels])
+        self.model = OneVsRestClassifier(LogisticRegression(C=10, max_iter=1000, class_weight="balanced")).fit(X, y)
+        return self
+
+    def rule_hits(self, texts: Sequence[str]) -> np.ndarray:
+        """n_texts x n_labels counts of matching keywords and patterns."""
+        if self._keywords is None:
+            from sklearn.feature_extraction.text import CountVectorizer
+
+            self._keywords = CountVectorizer(vocabulary=self._words, binary=True, token_pattern=r"(?u)\b\w+\b")
+        hits = np.asarray(self._keywords.transform(texts) @ self._keyword_weights)
+        for j, pattern in self._patterns:
+            hits[:, j] += np.fromiter((pattern.search(text) is not None for text in texts), dtype=float,
+                                      count=len(texts))
+        return hits
+
+    def confidences(self, texts: Sequence[str]) -> np.ndarray:
+        """n_texts x n_labels probabilities that each label applies."""
+        hits = self.rule_hits(texts)
+        rules = np.select([hits >= 2, hits == 1], [0.9, 0.6], 0.1)
+        if self.model is None:
+            return rules
+        probabilities = self.model.predict_proba(self.vectorizer.transform(texts))
+        return np.where(hits >= 2, np.maximum(rules, probabilities), probabilities)
+
+    def classify(self, texts: Sequence[str]) -> List[Classification]:
+        """Classifies a batch of emails (subject and body)."""
+        if not texts:
+            return []
+        confidences = self.confidences(texts)
+        uncertain = ((confidences > self.low) & (confidences < self.high)).any(axis=1)
+        results = []
+        for row, escalate in zip(confidences, uncertain):
+            results.append(Classification(
+                labels=[LABELS[j] for j in np.flatnonzero(row >= self.high)],
+                confidences={label: round(float(c), 3) for label, c in zip(LABELS, row)},
+                escalate=bool(escalate),
+            ))
+        return results
+
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            pickle.dump(self, f)
+
+    @staticmethod
+    def load(path: str) -> "EmailClassifier":
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+
+class ClassificationStats:
+    """How many emails were classified locally and how many needed the LLM."""
+
+    def __init__(self):
+        self.classified = 0
+        self.escalated = 0
+        self._lock = threading.Lock()
+
+    def record(self, escalated: bool):
+        with self._lock:
+            self.classified += 1
+            self.escalated += escalated
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "classified": self.classified,
+                "escalated": self.escalated,
+                "llm_call_rate": self.escalated / self.classified if self.classified else 0.0,
+            }
+
+
+def load_labelled_emails(db_path: str):
+    """Subject + body texts and labels of the labelled emails in a mail cache database."""
+    db = sqlite3.connect(db_path)
+    rows = db.execute("SELECT subject, body, labels FROM emails WHERE labels IS NOT NULL AND labels != '[]'")
+    texts, labels = [], []
+    for subject, body, stored in rows:
+        texts.append(f"{subject}\n{body}")
+        labels.append(json.loads(stored))
+    db.close()
+    return texts, labels
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the local email classifier.")
+    parser.add_argument("command", choices=["train"])
+    parser.add_argument("--db", required=True, help="Mail cache database with labelled emails")
+    parser.add_argument("--out", default="email_classifier.pkl", help="Where to save the trained classifier")
+    args = parser.parse_args()
+
+    texts, labels = load_labelled_emails(args.db)
+    if not texts:
+        print(f"Error: No labelled emails in {args.db}")
+        return
+    EmailClassifier().fit(texts, labels).save(args.out)
+    print(f"Trained on {len(texts)} emails; saved to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,32 @@
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable, Iterator, AsyncIterator
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+import asyncio
+import json
+import logging
+import os
+import re
+import threading
+import time
 import random # For mock classification
+import sys
+
+# The mail_agent package lives in EmailPreviewBrowser.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "EmailPreviewBrowser"))
+
+from batch import BatchRunner, create_job
+from classifier import Classification, ClassificationStats, EmailClassifier
+from mail_agent.agent import document_index_version, mail_cache, mail_pool, mailbox_sync
+from mail_agent.logs import configure_logging
+from mail_agent.metrics import REGISTRY, span, timed
+from reply_cache import ReplyCache, reply_cache_key
+from sessions import InMemorySessionBackend, SQLiteSessionBackend, Session, SessionStore
+
+logger = logging.getLogger(__name__)
 
 # --- Mock/Placeholder Agent and Tool Definitions ---
 # In a real application, you would import these from your agent framework (e.g., CrewAI, LangChain)
@@ -28,7 +52,7 @@ class DocumentSearchTool(Tool):
 
     def run(self, query: str) -> str:
         # Mock implementation
-        print(f"Tool '{self.name}' received query: {query}")
+        logger.info("Tool '%s' received query: %s", self.name, query)
         if "important project" in query.lower():
             return "Found document: 'Project Alpha Q3 Report.pdf' from DocumentSearchTool"
         elif "meeting notes" in query.lower():
@@ -44,6 +68,7 @@ class Agent:
         instruction: str,
         tools: Optional[List[Tool]] = None,
         output_key: str = "output",
+        classifier: Optional[EmailClassifier] = None,
     ):
         self.name = name
         self.model = model
@@ -51,22 +76,78 @@ class Agent:
         self.instruction = instruction
         self.tools = tools if tools else []
         self.output_key = output_key
-        print(f"Agent '{self.name}' initialized with model '{self.model}' and tools: {[tool.name for tool in self.tools]}")
+        self.classifier = classifier
+        logger.info("Agent '%s' initialized with model '%s' and tools: %s", self.name, self.model,
+                    [tool.name for tool in self.tools])
 
-    def run(self, user_input: str) -> Dict[str, Any]:
-        print(f"\nAgent '{self.name}' processing input: {user_input}")
+    def run(self, user_input: str, history: Optional[List[Dict[str, str]]] = None,
+            documents: Optional[List[Any]] = None, classification: Optional[Classification] = None) -> Dict[str, Any]:
+        response_text = ""
+        documents_found = []
+        labels = None
+        for event in self.run_stream(user_input, history, documents, classification):
+            if event["type"] == "token":
+                response_text += event["text"]
+            elif event["type"] == "tool_result":
+                documents_found.append(event["result"])
+            elif event["type"] == "classification":
+                labels = {"labels": event["labels"], "source": event["source"]}
+        return {self.output_key: response_text, "documents": documents_found, "classification": labels}
+
+    @timed("agent_run")
+    def run_stream(self, user_input: str, history: Optional[List[Dict[str, str]]] = None,
+                   documents: Optional[List[Any]] = None,
+                   classification: Optional[Classification] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Processes the input, yielding events as they are produced:
+        {"type": "classification", "labels": [...], "source": "local" or "llm"},
+        {"type": "tool_result",
+        "tool": ..., "result": ...} and {"type": "token", "text": ...} chunks
+        of the reply, which `run` joins into the full response.
+
+        `history` holds the session's earlier turns for the model's context,
+        and `documents` the ones retrieved earlier in the session; when
+        there are some, follow-up questions reuse them instead of searching again.
+        `classification` is the classifier's result for the input when the
+        caller already has it, e.g. from classifying a whole batch at once.
+        """
+        logger.info("Agent '%s' processing input: %s", self.name, user_input)
         # Simulate LLM interaction and instruction following
+        response_parts = []
+
+        def reply(text: str) -> Iterator[Dict[str, Any]]:
+            response_parts.append(text)
+            # Word-sized chunks, the way an LLM streams tokens
+            for token in re.findall(r"\S+\s*|\s+", text):
+                yield {"type": "token", "text": token}
 
-        # 1. Classification
+        # 1. Classification: locally when the classifier is sure, by the LLM otherwise
         possible_labels = ["(important)", "(work)", "(family)", "(deadline)", "(meeting)"]
-        num_labels = random.randint(0, 2) # Classify with 0, 1 or 2 labels
-        chosen_labels = random.sample(possible_labels, num_labels)
+        local = classification
+        if local is None and self.classifier:
+            with span("classify"):
+                local = self.classifier.classify([user_input])[0]
+        if local is not None and not local.escalate:
+            chosen_labels = [f"({label})" for label in local.labels]
+            source = "local"
+        elif local is not None:
+            # The LLM only decides the labels the classifier is unsure about.
+            unsure = [f"({label})" for label, c in local.confidences.items()
+                      if self.classifier.low < c < self.classifier.high]
+            llm_labels = random.sample(unsure, random.randint(0, len(unsure)))
+            chosen_labels = [l for l in possible_labels if l in llm_labels or l.strip("()") in local.labels]
+            source = "llm"
+        else:
+            num_labels = random.randint(0, 2) # Classify with 0, 1 or 2 labels
+            chosen_labels = random.sample(possible_labels, num_labels)
+            source = "llm"
         classification_output = f"Classification: {' '.join(chosen_labels) if chosen_labels else '(no specific labels)'}"
-        print(f"  -> {classification_output}")
+        logger.info("  -> %s (%s)", classification_output, source)
+        yield {"type": "classification", "labels": chosen_labels, "source": source}
 
         # 2. Basic response
-        response_text = f"Hello! Regarding your message: '{user_input}'. I've processed it. "
-        response_text += classification_output + ". "
+        yield from reply(f"Hello! Regarding your message: '{user_input}'. I've processed it. ")
+        yield from reply(classification_output + ". ")
 
         # 3. Tool usage (mocked)
         documents_found = []
@@ -74,26 +155,34 @@ class Agent:
         # use the 'find_related_documents' tool or the google_search tool"
         # For mock, let's assume if "document", "report", "notes" is in input, we search.
         if any(keyword in user_input.lower() for keyword in ["document", "documentation", "report", "notes", "incomplete"]):
-            for tool in self.tools:
-                if tool.name == "find_related_documents": # Matching the tool name
-                    print(f"  -> Attempting to use tool: {tool.name}")
-                    tool_result = tool.run(user_input) # Pass user input or a derived query
-                    documents_found.append(tool_result)
-                    response_text += f"\n   Additionally, {tool_result}. "
-                # You would add logic for 'google_search' tool here if it was provided
-                # elif tool.name == "google_search":
-                #     # ...
+            if documents:
+                logger.info("  -> Reusing %d document(s) retrieved earlier in the session", len(documents))
+                for document in documents:
+                    documents_found.append(document)
+                    yield {"type": "tool_result", "tool": "session", "result": document}
+                    yield from reply(f"\n   As found earlier, {document}. ")
+            else:
+                for tool in self.tools:
+                    if tool.name == "find_related_documents": # Matching the tool name
+                        logger.info("  -> Attempting to use tool: %s", tool.name)
+                        with span("tool_run", tool=tool.name):
+                            tool_result = tool.run(user_input) # Pass user input or a derived query
+                        documents_found.append(tool_result)
+                        yield {"type": "tool_result", "tool": tool.name, "result": tool_result}
+                        yield from reply(f"\n   Additionally, {tool_result}. ")
+                    # You would add logic for 'google_search' tool here if it was provided
+                    # elif tool.name == "google_search":
+                    #     # ...
 
         # 4. Enrich answer with documents
         if documents_found:
-            response_text += "\nI've used the retrieved information to inform this response. "
+            yield from reply("\nI've used the retrieved information to inform this response. ")
         else:
-            response_text += "\nNo specific documents were retrieved for this query. "
+            yield from reply("\nNo specific documents were retrieved for this query. ")
 
-        response_text += "Please let me know if you need further assistance."
+        yield from reply("Please let me know if you need further assistance.")
 
-        print(f"  -> Agent '{self.name}' final response: {response_text}")
-        return {self.output_key: response_text}
+        logger.info("  -> Agent '%s' final response: %s", self.name, "".join(response_parts))
 
 # --- End of Mock Definitions ---
 
@@ -118,6 +207,14 @@ document_search_tool_instance = DocumentSearchTool()
 #     output_key="email_assistant_output",
 # )
 
+def load_email_classifier() -> EmailClassifier:
+    """The trained classifier at EMAIL_CLASSIFIER_MODEL if there is one, the rules alone otherwise."""
+    model_path = os.getenv("EMAIL_CLASSIFIER_MODEL", "email_classifier.pkl")
+    if os.path.exists(model_path):
+        return EmailClassifier.load(model_path)
+    return EmailClassifier()
+
+
 root_agent = Agent(
     name="email_root_agent_v2",
     model="gemini-2.0-flash-001", # This is just a string in the mock; a real LLM would use it
@@ -129,11 +226,262 @@ root_agent = Agent(
     # sub_agents=[], # You would define and add sub_agents here if needed
     #tools=[google_search],
     output_key="email_assistant_output",
+    classifier=load_email_classifier(),
+)
+
+
+# --- Agent execution pool ---
+
+class ExecutorBusy(Exception):
+    """Raised when the agent pool and its queue are both full."""
+
+
+class ClientDisconnected(Exception):
+    """Raised when the client goes away before its reply is ready."""
+
+
+class AgentExecutor:
+    """
+    Runs blocking agent calls on a worker pool, off the event loop, with backpressure.
+
+    The pool runs at most `max_in_flight` calls at once; up to `max_queue`
+    more wait in its queue, and anything beyond that is rejected with
+    ExecutorBusy. A call that times out or is cancelled while still queued
+    never runs. One that already started can't be interrupted, so it counts
+    against the limits until it finishes.
+    """
+
+    def __init__(self, pool: Executor, max_in_flight: int, max_queue: int, timeout: float):
+        self.pool = pool
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        """Calls running or waiting for a worker."""
+        return self._pending
+
+    async def run(self, func: Callable, *args) -> Any:
+        future = self._submit(func, *args)
+        # Cancelling the wrapper (timeout, disconnect) cancels the call if it hasn't started.
+        return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+
+    def stream(self, func: Callable[..., Iterator], *args) -> AsyncIterator:
+        """
+        Runs a generator function on the pool and yields its items as they are produced.
+
+        The call is admitted (or rejected with ExecutorBusy) before this
+        returns. Closing the returned iterator, e.g. when the client
+        disconnects, stops the generator at its next item. A process pool
+        can't hand items back one at a time, so there the items all arrive
+        when the generator finishes.
+        """
+        if not isinstance(self.pool, ThreadPoolExecutor):
+            future = self._submit(collect, func, *args)
+
+            async def collected():
+                for item in await asyncio.wait_for(asyncio.wrap_future(future), self.timeout):
+                    yield item
+            return collected()
+
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+        end = object()
+
+        def produce():
+            try:
+                for item in func(*args):
+                    if stop.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, item)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, end)
+
+        future = self._submit(produce)
+
+        async def consume():
+            deadline = time.monotonic() + self.timeout
+            try:
+                while True:
+                    item = await asyncio.wait_for(queue.get(), deadline - time.monotonic())
+                    if item is end:
+                        await asyncio.wrap_future(future)  # re-raises the generator's exception, if any
+                        return
+                    yield item
+            finally:
+                stop.set()
+                future.cancel()
+        return consume()
+
+    def _submit(self, func: Callable, *args):
+        with self._lock:
+            if self._pending >= self.max_in_flight + self.max_queue:
+                raise ExecutorBusy()
+            self._pending += 1
+
+        future = self.pool.submit(func, *args)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self._pending -= 1
+
+
+def collect(func: Callable[..., Iterator], *args) -> list:
+    """Drains a generator function; module-level so process pools can pickle it."""
+    return list(func(*args))
+
+
+def make_agent_executor() -> AgentExecutor:
+    max_in_flight = int(os.getenv("AGENT_MAX_IN_FLIGHT", "4"))
+    pool_type = ProcessPoolExecutor if os.getenv("AGENT_POOL", "thread") == "process" else ThreadPoolExecutor
+    return AgentExecutor(
+        pool_type(max_workers=max_in_flight),
+        max_in_flight=max_in_flight,
+        max_queue=int(os.getenv("AGENT_MAX_QUEUE", "16")),
+        timeout=float(os.getenv("AGENT_TIMEOUT_SECONDS", "60")),
+    )
+
+
+agent_executor = make_agent_executor()
+
+
+def make_session_store() -> SessionStore:
+    if os.getenv("SESSION_BACKEND", "memory") == "sqlite":
+        backend = SQLiteSessionBackend(os.getenv("SESSION_DB", "sessions.db"))
+    else:
+        backend = InMemorySessionBackend()
+    return SessionStore(
+        backend,
+        ttl=float(os.getenv("SESSION_TTL_SECONDS", "3600")),
+        max_sessions=int(os.getenv("SESSION_MAX_SESSIONS", "10000")),
+        max_turns=int(os.getenv("SESSION_MAX_TURNS", "20")),
+        max_chars=int(os.getenv("SESSION_MAX_CHARS", "8000")),
+    )
+
+
+session_store = make_session_store()
+
+
+reply_cache = ReplyCache(
+    max_entries=int(os.getenv("REPLY_CACHE_MAX_ENTRIES", "1024")),
+    ttl=float(os.getenv("REPLY_CACHE_TTL_SECONDS", "3600")),
+    spill_dir=os.getenv("REPLY_CACHE_SPILL_DIR") or None,
+    # Replies cached before a user's document index was rebuilt are misses.
+    version=document_index_version,
 )
 
 
+classification_stats = ClassificationStats()
+
+
+batch_runner = BatchRunner(
+    root_agent,
+    mail_cache,
+    workers=int(os.getenv("BATCH_WORKERS", "4")),
+    chunk_size=int(os.getenv("BATCH_CHUNK_SIZE", "64")),
+    reply_cache=reply_cache,
+)
+
+
+async def record_turn(session: Session, user_message_text: str, reply_text: str, documents: List[Any]):
+    """
+    Adds the exchange to the session and remembers what was retrieved for
+    follow-ups, merged with turns other requests on the session added meanwhile.
+    """
+    await asyncio.to_thread(
+        session_store.record, session.key, [("user", user_message_text), ("agent", reply_text)], documents
+    )
+
+
+async def wait_unless_disconnected(request: Request, awaitable, poll_interval: float = 0.1):
+    """Awaits `awaitable`, cancelling it if the client disconnects first."""
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                raise ClientDisconnected()
+    finally:
+        task.cancel()
+
+
+def warm_up() -> Dict[str, float]:
+    """
+    Loads what the first requests would otherwise wait for: scikit-learn and
+    the classifier's rules, and the reply cache's and session store's
+    storage.
+    """
+    timings = {}
+    start = time.perf_counter()
+    root_agent.classifier.classify(["warm up"])
+    timings["classifier"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    reply_cache_key("warm up", root_agent)
+    reply_cache.stats()  # lists the spill directory, if any
+    document_index_version()
+    timings["reply_cache"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    session_store.get(("warm up", "warm up", "warm up"))
+    timings["session_store"] = time.perf_counter() - start
+    return {step: round(seconds, 3) for step, seconds in timings.items()}
+
+
 # --- FastAPI Application ---
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Here rather than on import, so batch.py and the benchmarks keep their own
+    # logging. LOG_MODE=async moves writing logs off the request path, and
+    # LOG_SAMPLE_RATE keeps a share of the per-request lines under load (see
+    # mail_agent/logs.py).
+    configure_logging()
+    # WARM_UP=0 starts serving straight away and loads everything on first use.
+    if os.getenv("WARM_UP", "1") != "0":
+        logger.info("Warmed up in seconds: %s", await asyncio.to_thread(warm_up))
+    yield
+    agent_executor.pool.shutdown(wait=False, cancel_futures=True)
+
+
+class RequestMetrics:
+    """ASGI middleware timing each HTTP request, until its response is fully sent, by route and status."""
+
+    def __init__(self, app):
+        self.app = app
+        self.histogram = REGISTRY.histogram("http_request_seconds", "Seconds to serve HTTP requests.",
+                                            ("method", "route", "status"))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The route's path template, e.g. /batch/{job_id}, keeps the series few.
+            route = scope.get("route")
+            self.histogram.observe(time.perf_counter() - start, method=scope["method"],
+                                   route=getattr(route, "path", "unmatched"), status=status)
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(RequestMetrics)
 
 # CORS middleware
 app.add_middleware(
@@ -159,27 +507,193 @@ class RunRequest(BaseModel):
     new_message: NewMessage
 
 @app.post("/run")
-async def run_app_endpoint(request: RunRequest): # Renamed to avoid conflict with Agent.run
-    print(f"Received request for app '{request.app_name}' from user '{request.user_id}'")
-    print(f"Session ID: {request.session_id}")
+async def run_app_endpoint(request: RunRequest, http_request: Request): # Renamed to avoid conflict with Agent.run
     user_message_text = request.new_message.parts[0].text
-    print(f"Message: {user_message_text}")
+    logger.info("Received request for app '%s' from user '%s', session %s: %s",
+                request.app_name, request.user_id, request.session_id, user_message_text)
 
-    # Use the root_agent to process the message
+    # The SQLite backend does file IO, so the store is used off the event loop.
+    session = await asyncio.to_thread(session_store.get, (request.app_name, request.user_id, request.session_id))
+
+    cache_key = reply_cache_key(user_message_text, root_agent, session.documents)
+
+    # Use the root_agent to process the message, off the event loop
     try:
-        agent_response_dict = root_agent.run(user_input=user_message_text)
+        # Like the session store, the cache may read and write spill files.
+        agent_response_dict = await asyncio.to_thread(reply_cache.get, cache_key)
+        if agent_response_dict is None:
+            agent_response_dict = await wait_unless_disconnected(
+                http_request, agent_executor.run(root_agent.run, user_message_text, session.history(), session.documents)
+            )
+            await asyncio.to_thread(reply_cache.put, cache_key, agent_response_dict)
+            if agent_response_dict.get("classification"):
+                classification_stats.record(agent_response_dict["classification"]["source"] == "llm")
         reply_text = agent_response_dict.get(root_agent.output_key, "Error: Agent did not produce the expected output.")
+        await record_turn(session, user_message_text, reply_text, agent_response_dict.get("documents", []))
         
         return {
             "status": "success",
             "reply": reply_text
         }
+    except ExecutorBusy:
+        return JSONResponse(
+            status_code=429,
+            headers={"Retry-After": "1"},
+            content={"status": "error", "reply": "The assistant is busy, please try again shortly."},
+        )
+    except asyncio.TimeoutError:
+        return JSONResponse(
+            status_code=504,
+            content={"status": "error", "reply": "The assistant took too long to answer."},
+        )
+    except ClientDisconnected:
+        # Nobody is listening any more; 499 is the conventional "client closed request".
+        return Response(status_code=499)
     except Exception as e:
-        print(f"Error during agent execution: {e}")
+        logger.exception("Error during agent execution")
         return {
             "status": "error",
             "reply": f"An error occurred: {str(e)}"
         }
 
+async def cached_events(agent_response_dict: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+    """Replays a cached reply as the events /run_sse would have streamed."""
+    if agent_response_dict.get("classification"):
+        yield {"type": "classification", **agent_response_dict["classification"]}
+    for document in agent_response_dict.get("documents", []):
+        yield {"type": "tool_result", "tool": "cache", "result": document}
+    yield {"type": "token", "text": agent_response_dict[root_agent.output_key]}
+
+
+@app.post("/run_sse")
+async def run_sse_endpoint(request: RunRequest):
+    """Same as /run, but streams the agent's events as Server-Sent Events while they are produced."""
+    user_message_text = request.new_message.parts[0].text
+    session = await asyncio.to_thread(session_store.get, (request.app_name, request.user_id, request.session_id))
+    cache_key = reply_cache_key(user_message_text, root_agent, session.documents)
+    cached = await asyncio.to_thread(reply_cache.get, cache_key)
+
+    try:
+        if cached is not None:
+            events = cached_events(cached)
+        else:
+            events = agent_executor.stream(root_agent.run_stream, user_message_text, session.history(), session.documents)
+    except ExecutorBusy:
+        return JSONResponse(
+            status_code=429,
+            headers={"Retry-After": "1"},
+            content={"status": "error", "reply": "The assistant is busy, please try again shortly."},
+        )
+
+    async def event_stream():
+        reply_parts, documents, classification = [], [], None
+        try:
+            async for event in events:
+                if event["type"] == "token":
+                    reply_parts.append(event["text"])
+                elif event["type"] == "tool_result":
+                    documents.append(event["result"])
+                elif event["type"] == "classification":
+                    classification = {"labels": event["labels"], "source": event["source"]}
+                    if cached is None:
+                        # Like /run, replayed replies aren't counted again.
+                        classification_stats.record(event["source"] == "llm")
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+            await record_turn(session, user_message_text, "".join(reply_parts), documents)
+            if cached is None:
+                await asyncio.to_thread(reply_cache.put, cache_key, {
+                    root_agent.output_key: "".join(reply_parts), "documents": documents,
+                    "classification": classification,
+                })
+            yield "event: done\ndata: {}\n\n"
+        except asyncio.TimeoutError:
+            yield f"event: error\ndata: {json.dumps({'reply': 'The assistant took too long to answer.'})}\n\n"
+        except Exception as e:
+            logger.exception("Error during agent execution")
+            yield f"event: error\ndata: {json.dumps({'reply': f'An error occurred: {str(e)}'})}\n\n"
+        finally:
+            await events.aclose()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/cache/stats")
+async def cache_stats_endpoint():
+    return reply_cache.stats()
+
+
+@app.get("/classifier/stats")
+async def classifier_stats_endpoint():
+    """How many emails were classified and the share that needed the LLM."""
+    return classification_stats.stats()
+
+
+class BatchRequest(BaseModel):
+    email_ids: Optional[List[int]] = None
+    query: Optional[str] = None
+    folder: str = "INBOX"
+
+
+@app.post("/batch")
+async def batch_endpoint(request: BatchRequest):
+    """Starts a batch job over cached emails, picked by id or by an IMAP SEARCH query."""
+    try:
+        job_id = await asyncio.to_thread(
+            create_job, mail_cache, mailbox_sync.user_id, request.email_ids, request.query, request.folder,
+            mail_pool() if request.query else None, mailbox_sync,
+        )
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"status": "error", "reply": str(e)})
+    batch_runner.start(job_id)
+    return {"status": "success", "job_id": job_id}
+
+
+@app.get("/batch/{job_id}")
+async def batch_status_endpoint(job_id: str):
+    """A batch job's progress, with its throughput in emails/min while it runs."""
+    job = mail_cache.job(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"status": "error", "reply": f"No batch job {job_id}"})
+    return {**job, **batch_runner.progress.get(job_id, {})}
+
+
+@app.post("/batch/{job_id}/resume")
+async def batch_resume_endpoint(job_id: str):
+    """Restarts an interrupted batch job; messages it already processed are skipped."""
+    if mail_cache.job(job_id) is None:
+        return JSONResponse(status_code=404, content={"status": "error", "reply": f"No batch job {job_id}"})
+    return {"status": "success", "started": batch_runner.start(job_id)}
+
+
+REGISTRY.gauge("agent_calls_pending", "Agent calls running or waiting for a worker.",
+               lambda: agent_executor.pending)
+REGISTRY.gauge("reply_cache_hit_rate", "Share of reply cache lookups that hit.",
+               lambda: reply_cache.stats()["hit_rate"])
+REGISTRY.gauge("classifier_llm_call_rate", "Share of classified emails escalated to the LLM.",
+               lambda: classification_stats.stats()["llm_call_rate"])
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Latency histograms, error counts and gauges of this process, in the Prometheus text format."""
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.post("/cache/invalidate")
+async def cache_invalidate_endpoint():
+    """
+    Drops every cached reply. Replies cached before a document index was
+    rebuilt are already ignored (see document_index_version).
+    """
+    await asyncio.to_thread(reply_cache.invalidate)
+    return {"status": "success"}
+
 # To run this application (save as main.py):
-# uvicorn main:app --reload
\ No newline at end of file
+# uvicorn main:app --reload
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host=os.getenv("HOST", "127.0.0.1"), port=int(os.getenv("PORT", "8000")))
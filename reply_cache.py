@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+QUOTED_LINE = re.compile(r"^\s*>.*$", re.MULTILINE)
+REPLY_PREFIX = re.compile(r"^\s*((re|r|fwd?|i)\s*:\s*)+", re.IGNORECASE)
+WHITESPACE = re.compile(r"\s+")
+SPILL_FILE = re.compile(r"^[0-9a-f]{64}\.json$")
+
+
+def normalize_message(text: str) -> str:
+    """
+    Reduces an email to what determines the reply: quoted lines and
+    Re:/Fwd: prefixes are dropped, whitespace collapsed and case folded, so
+    forwards and re-opened threads map to the same text.
+    """
+    text = QUOTED_LINE.sub("", text)
+    text = REPLY_PREFIX.sub("", text)
+    return WHITESPACE.sub(" ", text).strip().casefold()
+
+
+def reply_cache_key(text: str, agent, documents: Optional[List[Any]] = None) -> str:
+    """
+    Content address of a reply: the normalised message, the agent's
+    instruction, model and tool set, and any documents handed to it.
+
+    The session history is left out on purpose, so the same email sent in
+    another session still hits.
+    """
+    parts = [
+        normalize_message(text),
+        agent.instruction,
+        agent.model,
+        sorted(tool.name for tool in agent.tools),
+        documents or [],
+    ]
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ReplyCache:
+    """
+    LRU cache of agent replies with a TTL and optional on-disk spill.
+
+    Entries evicted from memory are written to `spill_dir`, when given, and
+    promoted back on their next hit. `invalidate` drops everything.
+
+    Attributes:
+        version: Optional function returning the version of what replies
+            depend on besides their key, e.g. the document index. Entries
+            stored under another version are misses, so replies drafted with
+            old documents are never served; they age out like expired ones.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600, spill_dir: Optional[str] = None,
+                 version: Optional[Callable[[], str]] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.spill_dir = spill_dir
+        self.version = version
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        version = self.version() if self.version else None
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                entry = self._unspill(key)
+            if entry is None or entry["stored_at"] < time.time() - self.ttl or entry.get("version") != version:
+                self.misses += 1
+                return None
+            self._entries[key] = entry
+            self.hits += 1
+            return entry["value"]
+
+    def put(self, key: str, value: Dict[str, Any]):
+        version = self.version() if self.version else None
+        with self._lock:
+            self._entries[key] = {"stored_at": time.time(), "value": value, "version": version}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                old_key, old_entry = self._entries.popitem(last=False)
+                self.evictions += 1
+                self._spill(old_key, old_entry)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            # Only the entries' own files: the directory may be shared.
+            for name in self._spilled():
+                try:
+                    os.remove(os.path.join(self.spill_dir, name))
+                except FileNotFoundError:
+                    pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "spilled": len(self._spilled()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+    def _spilled(self) -> List[str]:
+        if not self.spill_dir:
+            return []
+        return [name for name in os.listdir(self.spill_dir) if SPILL_FILE.match(name)]
+
+    def _spill(self, key: str, entry: Dict[str, Any]):
+        if not self.spill_dir or entry["stored_at"] < time.time() - self.ttl:
+            return
+        with open(os.path.join(self.spill_dir, f"{key}.json"), "w") as f:
+            json.dump(entry, f)
+
+    def _unspill(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.spill_dir:
+            return None
+        path = os.path.join(self.spill_dir, f"{key}.json")
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        os.remove(path)
+        return entry
@@ -0,0 +1,233 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+SessionKey = Tuple[str, str, str]  # (app_name, user_id, session_id)
+
+
+@dataclass
+class Session:
+    """Conversation state of one /run session."""
+    key: SessionKey
+    turns: List[Dict[str, str]] = field(default_factory=list)
+    documents: List[Any] = field(default_factory=list)
+    summary: str = ""
+    updated_at: float = 0.0
+
+    def add_turn(self, role: str, text: str):
+        self.turns.append({"role": role, "text": text})
+
+    def history(self) -> List[Dict[str, str]]:
+        """The turns to show the agent, led by the summary of truncated ones."""
+        if self.summary:
+            return [{"role": "summary", "text": self.summary}] + self.turns
+        return list(self.turns)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data["key"] = list(self.key)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Session":
+        # Fresh lists, so changes to the session don't leak into the backend before it is saved.
+        return cls(**{**data, "key": tuple(data["key"]), "turns": list(data["turns"]),
+                      "documents": list(data["documents"])})
+
+
+class InMemorySessionBackend:
+    """Sessions in a dict ordered by last use; lost when the process exits."""
+
+    def __init__(self):
+        self._sessions: "OrderedDict[SessionKey, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, key: SessionKey) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._sessions.get(key)
+
+    def store(self, key: SessionKey, data: Dict[str, Any]):
+        with self._lock:
+            self._sessions[key] = data
+            self._sessions.move_to_end(key)
+
+    def update(self, key: SessionKey, apply: Callable[[Optional[Dict[str, Any]]], Dict[str, Any]]):
+        """Stores apply(current data or None), with no other write to the session in between."""
+        with self._lock:
+            self._sessions[key] = apply(self._sessions.get(key))
+            self._sessions.move_to_end(key)
+
+    def expire(self, before: float):
+        with self._lock:
+            while self._sessions:
+                key, data = next(iter(self._sessions.items()))
+                if data["updated_at"] >= before:
+                    break
+                del self._sessions[key]
+
+    def trim(self, max_sessions: int):
+        with self._lock:
+            while len(self._sessions) > max_sessions:
+                self._sessions.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+class SQLiteSessionBackend:
+    """Sessions in a local SQLite file, shared by the workers of one machine."""
+
+    def __init__(self, path: str):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " app_name TEXT, user_id TEXT, session_id TEXT, data TEXT, updated_at REAL,"
+            " PRIMARY KEY (app_name, user_id, session_id))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+        self._db.commit()
+        self._lock = threading.Lock()
+
+    def load(self, key: SessionKey) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT data FROM sessions WHERE app_name = ? AND user_id = ? AND session_id = ?", key
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def store(self, key: SessionKey, data: Dict[str, Any]):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?)",
+                (*key, json.dumps(data), data["updated_at"]),
+            )
+            self._db.commit()
+
+    def update(self, key: SessionKey, apply: Callable[[Optional[Dict[str, Any]]], Dict[str, Any]]):
+        """
+        Stores apply(current data or None) in one write transaction, so
+        concurrent updates from other threads or workers aren't lost.
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT data FROM sessions WHERE app_name = ? AND user_id = ? AND session_id = ?", key
+                ).fetchone()
+                data = apply(json.loads(row[0]) if row else None)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?)",
+                    (*key, json.dumps(data), data["updated_at"]),
+                )
+                self._db.commit()
+            except BaseException:
+                self._db.rollback()
+                raise
+
+    def expire(self, before: float):
+        with self._lock:
+            self._db.execute("DELETE FROM sessions WHERE updated_at < ?", (before,))
+            self._db.commit()
+
+    def trim(self, max_sessions: int):
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM sessions WHERE rowid IN ("
+                " SELECT rowid FROM sessions ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                (max_sessions,),
+            )
+            self._db.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+class SessionStore:
+    """
+    Sessions keyed by (app_name, user_id, session_id), on a pluggable backend.
+
+    Sessions idle for longer than `ttl` seconds expire, and only the
+    `max_sessions` most recently used are kept. Once a session has more than
+    `max_turns` turns or `max_chars` characters of history, its oldest turns
+    are folded into a short summary.
+    """
+
+    def __init__(self, backend=None, ttl: float = 3600, max_sessions: int = 10_000,
+                 max_turns: int = 20, max_chars: int = 8_000):
+        self.backend = backend if backend is not None else InMemorySessionBackend()
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_turns = max_turns
+        self.max_chars = max_chars
+
+    def get(self, key: SessionKey) -> Session:
+        """Returns the session, or a new empty one if it doesn't exist or has expired."""
+        return self._session(key, self.backend.load(key))
+
+    def save(self, session: Session):
+        """Stores the session as is, replacing what was stored; see `record` for concurrent requests."""
+        self._truncate(session)
+        session.updated_at = time.time()
+        self.backend.store(session.key, session.to_dict())
+        self._expire(session.updated_at)
+
+    def record(self, key: SessionKey, turns: List[Tuple[str, str]], documents: Optional[List[Any]] = None) -> Session:
+        """
+        Appends (role, text) turns to the session as it is stored now, and
+        replaces its documents if any are given.
+
+        Unlike `get` then `save`, two requests on the same session that
+        overlap both keep their turns instead of the last one to save winning.
+
+        Returns:
+            The session as stored.
+        """
+        session = None
+
+        def apply(data):
+            nonlocal session
+            session = self._session(key, data)
+            for role, text in turns:
+                session.add_turn(role, text)
+            if documents:
+                session.documents = list(documents)
+            self._truncate(session)
+            session.updated_at = time.time()
+            return session.to_dict()
+
+        self.backend.update(key, apply)
+        self._expire(session.updated_at)
+        return session
+
+    def _session(self, key: SessionKey, data: Optional[Dict[str, Any]]) -> Session:
+        if data is None or data["updated_at"] < time.time() - self.ttl:
+            return Session(key=key)
+        return Session.from_dict(data)
+
+    def _expire(self, now: float):
+        self.backend.expire(now - self.ttl)
+        self.backend.trim(self.max_sessions)
+
+    def _truncate(self, session: Session):
+        dropped = []
+        while session.turns and (
+            len(session.turns) > self.max_turns
+            or sum(len(turn["text"]) for turn in session.turns) > self.max_chars
+        ):
+            dropped.append(session.turns.pop(0))
+        if dropped:
+            session.summary = summarize(session.summary, dropped, self.max_chars // 4)
+
+
+def summarize(summary: str, turns: List[Dict[str, str]], max_chars: int) -> str:
+    """Extends the summary with the first sentence of each turn, keeping its most recent max_chars."""
+    lines = [summary] if summary else []
+    for turn in turns:
+        first_sentence = turn["text"].strip().split(". ")[0].split("\n")[0][:200]
+        lines.append(f"{turn['role']}: {first_sentence}")
+    return "\n".join(lines)[-max_chars:]
@@ -1,21 +1,23 @@
-import imaplib
-import email
+import os
+import sys
 from email.header import decode_header
 from dotenv import load_dotenv
-import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "EmailPreviewBrowser"))
+from mail_agent.imap import get_pool, latest_headers
+from mail_agent.threads import ThreadIndex, message_ids
 
 load_dotenv()
 
-mail = imaplib.IMAP4_SSL("imap.gmail.com")
-mail.login(os.getenv("EMAIL"), os.getenv("PASSWORD"))
-mail.select("inbox")
+pool = get_pool("imap.gmail.com", os.getenv("EMAIL"), os.getenv("PASSWORD"))
 
-# Step 2: Search and fetch all message IDs
-_, data = mail.search(None, 'OR SUBJECT "Re:" SUBJECT "R:"')
-ids = data[0].split()[-5:]
+# Step 2: Search and fetch the headers of the last 5 replies in one round trip
+emails = latest_headers(pool, 'OR SUBJECT "Re:" SUBJECT "R:"', 5,
+                        fields=("FROM", "SUBJECT", "DATE", "MESSAGE-ID", "IN-REPLY-TO", "REFERENCES"))
 
 messages = {}   
 threads = {}
+thread_index = ThreadIndex()
 
 def clean_subject(subject_raw):
     subject, encoding = decode_header(subject_raw)[0]
@@ -23,10 +25,18 @@ def clean_subject(subject_raw):
         return subject.decode(encoding or "utf-8")
     return subject
 
-for eid in ids:
-    res, msg_data = mail.fetch(eid, "(RFC822)")
-    msg = email.message_from_bytes(msg_data[0][1])
+for msg in emails:
+    message_id = msg["Message-ID"] or f"<{len(messages)}@local>"
     subject = clean_subject(msg["Subject"])
+    messages[message_id] = msg
+    thread_index.add(message_id, message_ids(msg["In-Reply-To"]), message_ids(msg["References"]), subject)
     print("Subject:", subject)
     print("From:", msg["From"])
-    print("-" * 30)
\ No newline at end of file
+    print("Thread:", thread_index.thread_of(message_id))
+    print("-" * 30)
+
+for message_id in messages:
+    thread_id = thread_index.thread_of(message_id)
+    threads[thread_id] = thread_index.members(thread_id)
+
+pool.close()